@@ -0,0 +1,226 @@
+# amendment_utils.py
+# Row-level amendments of stored invoices.
+# An amendment used to delete every line and container of the invoice and insert the new set again,
+# rewriting indexes, summary/FTS rows and the WAL even when one line changed. apply_amendment() instead
+# diffs the incoming lines against the stored ones and applies only the differences:
+#   1. incoming rows carrying a stored 'id' (Explorer edits) are paired with that row;
+#   2. identical lines (same content hash) are left alone;
+#   3. the remaining lines are paired by their line key (production order, PO, item, description)
+#      and updated column by column;
+#   4. whatever is left over is inserted or deleted.
+# Containers are diffed the same way. Every applied change is recorded in invoice_change_log, with
+# only the changed columns for updates.
+
+import hashlib
+import json
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import db_utils
+
+TABLE_NAME = db_utils.INVOICES_TABLE
+CONTAINER_TABLE_NAME = db_utils.CONTAINERS_TABLE
+CHANGE_LOG_TABLE = db_utils.CHANGE_LOG_TABLE
+LOCAL_TIMEZONE = ZoneInfo("Asia/Phnom_Penh")
+
+# Columns compared between stored and incoming lines (creating_date is a stamp, not line content)
+LINE_COLUMNS = (
+    'inv_no', 'inv_date', 'inv_ref', 'po', 'item', 'description', 'pcs',
+    'sqft', 'pallet_count', 'unit', 'amount', 'net', 'gross', 'cbm',
+    'production_order_no', 'status'
+)
+# Identifies "the same line" across amendments when its quantities change
+LINE_KEY_COLUMNS = ('production_order_no', 'po', 'item', 'description')
+
+
+@dataclass
+class AmendmentResult:
+    """Counts of the changes apply_amendment() made."""
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    containers_added: int = 0
+    containers_removed: int = 0
+    log: List[Tuple[Optional[str], str, Optional[int], Optional[str]]] = field(default_factory=list, repr=False)
+
+    @property
+    def changed(self) -> int:
+        return self.inserted + self.updated + self.deleted + self.containers_added + self.containers_removed
+
+    def describe(self) -> str:
+        return (f"{self.inserted} line(s) added, {self.updated} updated, {self.deleted} removed, "
+                f"{self.unchanged} unchanged; {self.containers_added} container(s) added, {self.containers_removed} removed")
+
+
+def _canonical(value: Any) -> Optional[str]:
+    """Comparable form of a cell: 140484, '140484' and 140484.0 compare equal; missing values are None."""
+    value = db_utils.sql_value(value)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def line_hash(line: Dict[str, Any]) -> str:
+    """Content hash of a line item over LINE_COLUMNS."""
+    payload = "\x1f".join(_canonical(line.get(c)) or "" for c in LINE_COLUMNS)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _line_key(line: Dict[str, Any]) -> Tuple:
+    return tuple(_canonical(line.get(c)) for c in LINE_KEY_COLUMNS)
+
+
+def _changed_columns(stored: Dict[str, Any], incoming: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+    return {c: (stored.get(c), db_utils.sql_value(incoming.get(c))) for c in LINE_COLUMNS
+            if c in incoming and _canonical(stored.get(c)) != _canonical(incoming.get(c))}
+
+
+def diff_lines(stored: Sequence[Dict[str, Any]], incoming: Sequence[Dict[str, Any]]):
+    """
+    Computes the changes that turn the stored lines into the incoming ones.
+
+    Args:
+        stored: Stored lines, each with its 'id'.
+        incoming: New lines; an 'id' matching a stored line pairs the two directly.
+
+    Returns:
+        (inserts, updates, deletes, unchanged): incoming lines to insert, (stored line, incoming line,
+        changed columns) to update, stored lines to delete, and the number of untouched lines.
+    """
+    stored_by_id = {line['id']: line for line in stored}
+    updates, unchanged = [], 0
+    free_stored = dict(stored_by_id)
+    free_incoming = []
+    for line in incoming:
+        line_id = db_utils.sql_value(line.get('id'))
+        if line_id is not None and line_id in free_stored:
+            old = free_stored.pop(line_id)
+            changes = _changed_columns(old, line)
+            if changes:
+                updates.append((old, line, changes))
+            else:
+                unchanged += 1
+        else:
+            free_incoming.append(line)
+
+    # Identical lines: leave the stored row in place
+    by_hash = defaultdict(deque)
+    for old in free_stored.values():
+        by_hash[line_hash(old)].append(old)
+    remaining_incoming = []
+    for line in free_incoming:
+        bucket = by_hash.get(line_hash(line))
+        if bucket:
+            free_stored.pop(bucket.popleft()['id'])
+            unchanged += 1
+        else:
+            remaining_incoming.append(line)
+
+    # Same line, new values: update in place
+    by_key = defaultdict(deque)
+    for old in free_stored.values():
+        by_key[_line_key(old)].append(old)
+    inserts = []
+    for line in remaining_incoming:
+        bucket = by_key.get(_line_key(line))
+        if bucket:
+            old = bucket.popleft()
+            free_stored.pop(old['id'])
+            changes = _changed_columns(old, line)
+            if changes:
+                updates.append((old, line, changes))
+            else:  # Differs only in columns the incoming line does not carry
+                unchanged += 1
+        else:
+            inserts.append(line)
+    return inserts, updates, list(free_stored.values()), unchanged
+
+
+def _log(result: AmendmentResult, inv_ref: Optional[str], action: str, row_id: Optional[int], detail: Any = None):
+    result.log.append((inv_ref, action, row_id,
+                       json.dumps(detail, ensure_ascii=False, separators=(",", ":"), default=str) if detail else None))
+
+
+def apply_amendment(conn, match_refs: Iterable[str], new_lines: Sequence[Dict[str, Any]],
+                    containers: Optional[Sequence[str]] = None, source: Optional[str] = None) -> AmendmentResult:
+    """
+    Replaces the stored invoice(s) 'match_refs' with 'new_lines', writing only the differences. The stored
+    lines are read, diffed and rewritten in one write transaction (BEGIN IMMEDIATE), so the diff is never
+    applied to lines another writer changed meanwhile. invoice_summary follows through its triggers.
+
+    Args:
+        conn: An open connection.
+        match_refs: inv_ref values of the stored invoice(s) being amended.
+        new_lines: The complete new set of lines (dicts of invoice columns; 'id' optional).
+        containers: The complete new container list for the new inv_ref (None leaves containers as they are).
+        source: Where the amendment came from (file name, page), for the change log.
+
+    Returns:
+        An AmendmentResult with the change counts.
+    """
+    match_refs = list(dict.fromkeys(match_refs))
+    result = AmendmentResult()
+    placeholders = ', '.join('?' * len(match_refs))
+    columns = ('id',) + LINE_COLUMNS
+    new_ref = db_utils.sql_value(new_lines[0].get('inv_ref')) if new_lines else None
+
+    # Take the write lock before reading, so no other writer can change the invoice between the diff and
+    # the writes (sqlite3 opens no transaction for a SELECT); 'with conn' commits or rolls back the whole of it
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {TABLE_NAME} WHERE inv_ref IN ({placeholders}) ORDER BY id", match_refs) \
+            if match_refs else []
+        stored = [dict(zip(columns, row)) for row in cursor]
+        inserts, updates, deletes, result.unchanged = diff_lines(stored, new_lines)
+
+        for old in deletes:
+            conn.execute(f"DELETE FROM {TABLE_NAME} WHERE id = ?", (old['id'],))
+            _log(result, old['inv_ref'], 'delete', old['id'], {c: old[c] for c in LINE_KEY_COLUMNS + ('pcs', 'amount') if old[c] is not None})
+        for old, line, changes in updates:
+            assignments = dict((c, new) for c, (_, new) in changes.items())
+            if line.get('creating_date') is not None:
+                assignments['creating_date'] = db_utils.sql_value(line['creating_date'])
+            conn.execute(f"UPDATE {TABLE_NAME} SET {', '.join(f'{c} = ?' for c in assignments)} WHERE id = ?",
+                         list(assignments.values()) + [old['id']])
+            _log(result, line.get('inv_ref') or old['inv_ref'], 'update', old['id'], {c: list(v) for c, v in changes.items()})
+        for line in inserts:
+            insert_columns = [c for c in LINE_COLUMNS + ('creating_date',) if c in line]
+            row_id = conn.execute(f"INSERT INTO {TABLE_NAME} ({', '.join(insert_columns)}) VALUES ({', '.join('?' * len(insert_columns))})",
+                                  [db_utils.sql_value(line[c]) for c in insert_columns]).lastrowid
+            _log(result, line.get('inv_ref'), 'insert', row_id)
+        result.inserted, result.updated, result.deleted = len(inserts), len(updates), len(deletes)
+
+        if containers is not None:
+            stored_containers = conn.execute(
+                f"SELECT id, inv_ref, container_description FROM {CONTAINER_TABLE_NAME} WHERE inv_ref IN ({placeholders}) ORDER BY id",
+                match_refs).fetchall() if match_refs else []
+            wanted = defaultdict(int)
+            for description in containers:
+                wanted[(new_ref, description)] += 1
+            for container_id, ref, description in stored_containers:
+                if wanted[(ref, description)] > 0:
+                    wanted[(ref, description)] -= 1
+                else:
+                    conn.execute(f"DELETE FROM {CONTAINER_TABLE_NAME} WHERE id = ?", (container_id,))
+                    result.containers_removed += 1
+                    _log(result, ref, 'container_delete', container_id, {'container': description})
+            for (ref, description), count in wanted.items():
+                for _ in range(count):
+                    container_id = conn.execute(f"INSERT INTO {CONTAINER_TABLE_NAME} (inv_ref, container_description) VALUES (?, ?)",
+                                                (ref, description)).lastrowid
+                    result.containers_added += 1
+                    _log(result, ref, 'container_insert', container_id, {'container': description})
+
+        if result.log:
+            changed_at = datetime.now(LOCAL_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+            conn.executemany(f"INSERT INTO {CHANGE_LOG_TABLE} (changed_at, source, inv_ref, action, row_id, detail) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(changed_at, source, ref, action, row_id, detail) for ref, action, row_id, detail in result.log])
+    print(f"Amendment ({source or 'unknown source'}): {result.describe()}")
+    return result
+
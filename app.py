@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+import db_utils
 import os
 from datetime import datetime, timedelta
 
@@ -28,22 +28,44 @@ if not os.path.exists(DATABASE_FILE):
     st.stop()
 
 # --- Load Data ---
-try:
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        # Only select active invoices for the dashboard
-        df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME} WHERE status = 'active'", conn)
-
-    # --- Data Cleaning and Preparation ---
-    if 'creating_date' in df.columns:
-        df['creating_date'] = pd.to_datetime(df['creating_date'], errors='coerce')
-    else:
-        st.warning("Warning: 'creating_date' column not found.")
-        df['creating_date'] = pd.NaT # Add dummy column to prevent errors
-
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-    df['sqft'] = pd.to_numeric(df['sqft'], errors='coerce')
-    df.dropna(subset=['creating_date', 'amount'], inplace=True)
+# The dashboard reads the rollup tables that triggers keep current (see db_utils), so a page load costs a
+# few rows per day in the selected range rather than every active line item ever recorded.
+# Cached results are keyed on the invoices data version and recomputed after any write.
+ROLLUP_TABLE = db_utils.ROLLUP_TABLE
+ROLLUP_INVOICES_TABLE = db_utils.ROLLUP_INVOICES_TABLE
+
+@st.cache_data(max_entries=4)
+def load_date_bounds(version):
+    """Returns the first and last creation day with active invoice data, or (None, None)."""
+    with db_utils.get_connection(DATABASE_FILE) as conn:
+        return conn.execute(f"SELECT MIN(day), MAX(day) FROM {ROLLUP_TABLE}").fetchone()
+
+@st.cache_data(max_entries=32)
+def load_dashboard(start_day, end_day, version):
+    """Returns the KPIs and chart data for the creation days start_day..end_day (inclusive, 'YYYY-MM-DD')."""
+    params = (start_day, end_day)
+    with db_utils.get_connection(DATABASE_FILE) as conn:
+        total_amount, total_sqft, lines = conn.execute(
+            f"SELECT COALESCE(SUM(amount), 0), COALESCE(SUM(sqft), 0), COALESCE(SUM(lines), 0) "
+            f"FROM {ROLLUP_TABLE} WHERE day BETWEEN ? AND ?", params).fetchone()
+        invoice_count = conn.execute(
+            f"SELECT COUNT(DISTINCT inv_ref) FROM {ROLLUP_INVOICES_TABLE} WHERE day BETWEEN ? AND ?", params).fetchone()[0]
+        monthly = pd.read_sql_query(
+            f"SELECT substr(day, 1, 7) AS month, SUM(amount) AS amount FROM {ROLLUP_TABLE} "
+            f"WHERE day BETWEEN ? AND ? GROUP BY month ORDER BY month", conn, params=params)
+        top_items = pd.read_sql_query(
+            f"SELECT item, SUM(amount) AS amount FROM {ROLLUP_TABLE} WHERE day BETWEEN ? AND ? AND item != '' "
+            f"GROUP BY item ORDER BY amount DESC LIMIT 10", conn, params=params)
+        customers = pd.read_sql_query(
+            f"SELECT CASE WHEN customer = '' THEN '(none)' ELSE customer END AS customer, SUM(amount) AS amount "
+            f"FROM {ROLLUP_TABLE} WHERE day BETWEEN ? AND ? GROUP BY 1 ORDER BY amount DESC", conn, params=params)
+    return {'total_amount': total_amount, 'total_sqft': total_sqft, 'lines': lines, 'invoice_count': invoice_count,
+            'monthly': monthly, 'top_items': top_items, 'customers': customers}
 
+try:
+    with db_utils.get_connection(DATABASE_FILE) as conn:
+        invoices_version = db_utils.data_version(conn, TABLE_NAME)
+    first_day, last_day = load_date_bounds(invoices_version)
 except Exception as e:
     st.error(f"Could not read or process data. Error: {e}")
     st.exception(e) # Show full traceback for debugging
@@ -52,12 +74,12 @@ except Exception as e:
 # --- Date Range Filter ---
 st.header("Filter by Creation Date")
 
-if df.empty:
+if first_day is None:
     st.warning("No active invoice data found in the database to build a dashboard.")
     st.stop()
 
-start_date_default = df['creating_date'].min().date()
-end_date_default = df['creating_date'].max().date()
+start_date_default = datetime.strptime(first_day, '%Y-%m-%d').date()
+end_date_default = datetime.strptime(last_day, '%Y-%m-%d').date()
 
 col1, col2 = st.columns(2)
 start_date = col1.date_input("Start Date", start_date_default)
@@ -68,38 +90,36 @@ if start_date > end_date:
     st.error("Error: Start date cannot be after end date.")
     st.stop()
 
-start_datetime = datetime.combine(start_date, datetime.min.time())
-end_datetime = datetime.combine(end_date, datetime.max.time())
+dashboard = load_dashboard(start_date.isoformat(), end_date.isoformat(), invoices_version)
 
-filtered_df = df[(df['creating_date'] >= start_datetime) & (df['creating_date'] <= end_datetime)]
-
-if filtered_df.empty:
+if dashboard['lines'] == 0:
     st.warning("No invoice data found for the selected date range. Try expanding the date filter.")
     st.stop()
 
 # --- Display KPIs ---
 st.header("Key Performance Indicators")
-total_amount = filtered_df['amount'].sum()
-total_sqft = filtered_df['sqft'].sum()
-invoice_count = filtered_df['inv_ref'].nunique()
-
 kpi1, kpi2, kpi3 = st.columns(3)
-kpi1.metric(label="Total Invoiced Amount", value=f"${total_amount:,.2f}")
-kpi2.metric(label="Total Square Feet", value=f"{total_sqft:,.0f}")
-kpi3.metric(label="Unique Invoices Added", value=invoice_count)
+kpi1.metric(label="Total Invoiced Amount", value=f"${dashboard['total_amount']:,.2f}")
+kpi2.metric(label="Total Square Feet", value=f"{dashboard['total_sqft']:,.0f}")
+kpi3.metric(label="Unique Invoices Added", value=dashboard['invoice_count'])
 
 st.divider()
 
 # --- Visualizations ---
 st.header("Visualizations")
 
-# Invoiced Amount Over Time (by month)
-monthly_data = filtered_df.set_index('creating_date').resample('M')['amount'].sum().reset_index()
-monthly_data['creating_date'] = monthly_data['creating_date'].dt.strftime('%b %Y')
+# Invoiced Amount Over Time (by month); months without invoices are shown as zero
+monthly_data = dashboard['monthly'].set_index('month')['amount']
+monthly_data.index = pd.PeriodIndex(monthly_data.index, freq='M')
+monthly_data = monthly_data.reindex(pd.period_range(monthly_data.index.min(), monthly_data.index.max(), freq='M'), fill_value=0)
+monthly_data.index = monthly_data.index.strftime('%b %Y')
 st.subheader("Total Amount by Month Added")
-st.bar_chart(monthly_data.set_index('creating_date')['amount'])
+st.bar_chart(monthly_data)
 
 # Top 10 Items by Amount, grouped by the 'item' field
 st.subheader("Top 10 Products by Invoiced Amount (by Item Code)")
-top_items = filtered_df.groupby('item')['amount'].sum().nlargest(10)
-st.bar_chart(top_items)
+st.bar_chart(dashboard['top_items'].set_index('item')['amount'])
+
+# Amount by customer (the letters leading the invoice reference)
+st.subheader("Invoiced Amount by Customer Prefix")
+st.bar_chart(dashboard['customers'].set_index('customer')['amount'])
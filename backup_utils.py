@@ -0,0 +1,291 @@
+# backup_utils.py
+# Online backups of the invoice database.
+# - create_backup(): copies the live database with SQLite's backup API a few pages at a time, so writers
+#   keep working while the snapshot is taken (a plain file copy can catch a half-written page or miss
+#   commits still in the WAL). Each snapshot is integrity-checked, gzip-compressed and moved into place
+#   with an atomic rename, so a backup file is either complete or absent.
+# - prune_backups(): grandfather-father-son retention; keeps the newest backup of each of the last N
+#   hours, days and months and deletes the rest.
+# - restore_backup(): decompresses and checks the backup next to the live file, closes the shared
+#   connections, makes sure no other process has the database open and swaps it in with an atomic rename.
+#   Stop the app (every Streamlit worker) before restoring from the command line; a restore while another
+#   process uses the database is refused rather than risk corrupting it.
+#
+# Scheduled use (cron / Task Scheduler), from the project root:
+#     python backup_utils.py backup            # snapshot + retention
+#     python backup_utils.py list | verify NAME | restore NAME | prune
+
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+from zoneinfo import ZoneInfo
+
+import db_utils
+
+DATABASE_FILE = os.path.join("data", "Invoice Record", "master_invoice_data.db")
+BACKUP_DIRECTORY = "backups"
+BACKUP_TIMEZONE = ZoneInfo("Asia/Phnom_Penh")
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+BACKUP_SUFFIXES = (".db.gz", ".db")  # .db: uncompressed backups made before compression was added
+
+PAGES_PER_STEP = 1024     # Pages copied per backup step (4 MiB at the default page size)
+STEP_SLEEP_SECONDS = 0.0  # Pause between steps; raise it to give writers more room on a busy database
+COMPRESS_LEVEL = 6
+RESTORE_LOCK_TIMEOUT_SECONDS = 5.0  # How long restore waits for the exclusive lock before giving up
+
+# Retention: the newest backup in each of the last N hours / days / months is kept
+KEEP_HOURLY = 24
+KEEP_DAILY = 30
+KEEP_MONTHLY = 12
+
+
+@dataclass(frozen=True)
+class BackupFile:
+    """A backup in the backup directory."""
+    name: str
+    path: Path
+    created: datetime
+    compressed: bool
+
+
+def _backup_stem(db_path: Union[str, Path]) -> str:
+    return Path(db_path).stem
+
+
+def _parse_backup(path: Path, stem: str) -> Optional[BackupFile]:
+    for suffix in BACKUP_SUFFIXES:
+        if path.name.endswith(suffix):
+            match = re.fullmatch(rf"{re.escape(stem)}_(.+)", path.name[:-len(suffix)])
+            if not match:
+                return None
+            try:
+                created = datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+            except ValueError:
+                created = datetime.fromtimestamp(path.stat().st_mtime)
+            return BackupFile(path.name, path, created, suffix == ".db.gz")
+    return None
+
+
+def list_backups(backup_dir: Union[str, Path] = BACKUP_DIRECTORY, db_path: Union[str, Path] = DATABASE_FILE) -> List[BackupFile]:
+    """Returns the backups of a database, newest first."""
+    backup_dir = Path(backup_dir)
+    if not backup_dir.is_dir():
+        return []
+    stem = _backup_stem(db_path)
+    backups = [b for b in (_parse_backup(p, stem) for p in backup_dir.iterdir() if p.is_file()) if b]
+    return sorted(backups, key=lambda b: b.created, reverse=True)
+
+
+def integrity_check(db_path: Union[str, Path]) -> str:
+    """Runs PRAGMA integrity_check on a database file and returns its result ('ok' when healthy)."""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return "\n".join(row[0] for row in conn.execute("PRAGMA integrity_check"))
+    finally:
+        conn.close()
+
+
+def _snapshot(db_path: Union[str, Path], target: Path, progress: Optional[Callable[[int, int], None]]):
+    """Copies the live database into 'target' with the online backup API, PAGES_PER_STEP pages at a time."""
+    source = db_utils.open_connection(db_path)
+    dest = sqlite3.connect(str(target))
+    try:
+        source.backup(dest, pages=PAGES_PER_STEP, sleep=STEP_SLEEP_SECONDS,
+                      progress=(lambda status, remaining, total: progress(total - remaining, total)) if progress else None)
+        # A single self-contained file: no -wal needed to read the snapshot
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+        source.close()
+
+
+def create_backup(db_path: Union[str, Path] = DATABASE_FILE, backup_dir: Union[str, Path] = BACKUP_DIRECTORY,
+                  progress: Optional[Callable[[int, int], None]] = None) -> BackupFile:
+    """
+    Takes an online, verified, compressed backup of the database.
+
+    Args:
+        db_path: The live database.
+        backup_dir: Where backups are kept.
+        progress: Optional callback(pages_done, pages_total) called after each backup step.
+
+    Returns:
+        The new backup.
+
+    Raises:
+        FileNotFoundError: If the database does not exist.
+        sqlite3.DatabaseError: If the snapshot fails its integrity check.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now(BACKUP_TIMEZONE).strftime(TIMESTAMP_FORMAT)
+    final_path = backup_dir / f"{_backup_stem(db_path)}_{timestamp}.db.gz"
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=backup_dir, prefix=".backup-") as work_dir:
+        snapshot_path = Path(work_dir) / "snapshot.db"
+        _snapshot(db_path, snapshot_path, progress)
+        result = integrity_check(snapshot_path)
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Backup snapshot failed its integrity check: {result}")
+        compressed_path = Path(work_dir) / final_path.name
+        with open(snapshot_path, "rb") as src, gzip.open(compressed_path, "wb", compresslevel=COMPRESS_LEVEL) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(compressed_path, final_path)
+    print(f"Backup: wrote {final_path} ({final_path.stat().st_size:,} bytes) in {time.perf_counter() - start:.2f}s")
+    return _parse_backup(final_path, _backup_stem(db_path))
+
+
+def _expand_backup(backup: BackupFile, target: Path):
+    if backup.compressed:
+        with gzip.open(backup.path, "rb") as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    else:
+        shutil.copyfile(backup.path, target)
+
+
+def _find_backup(name: str, backup_dir: Union[str, Path], db_path: Union[str, Path]) -> BackupFile:
+    backup = _parse_backup(Path(backup_dir) / name, _backup_stem(db_path))
+    if backup is None or not backup.path.is_file():
+        raise FileNotFoundError(f"Backup not found: {name}")
+    return backup
+
+
+def verify_backup(name: str, backup_dir: Union[str, Path] = BACKUP_DIRECTORY, db_path: Union[str, Path] = DATABASE_FILE) -> str:
+    """Expands a backup to a temporary file and returns its integrity check result ('ok' when healthy)."""
+    backup = _find_backup(name, backup_dir, db_path)
+    with tempfile.TemporaryDirectory(prefix=".verify-") as work_dir:
+        expanded = Path(work_dir) / "verify.db"
+        _expand_backup(backup, expanded)
+        return integrity_check(expanded)
+
+
+def _ensure_exclusive_access(db_path: Path):
+    """
+    Checks that no other connection, in any process, has the database open: takes an exclusive lock,
+    checkpoints the whole WAL into the main file and leaves WAL mode. SQLite only allows leaving WAL mode
+    with no other connection open, so an idle reader elsewhere is detected too (an exclusive lock alone
+    does not block WAL readers).
+
+    Raises:
+        sqlite3.OperationalError: If the database is in use elsewhere.
+    """
+    conn = sqlite3.connect(str(db_path), timeout=RESTORE_LOCK_TIMEOUT_SECONDS, isolation_level=None)
+    try:
+        conn.execute("BEGIN EXCLUSIVE")  # Waits out (or fails on) a writer
+        conn.execute("ROLLBACK")
+        busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+        if busy or conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0].lower() == "wal":
+            raise sqlite3.OperationalError("database is locked")
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(
+            f"Cannot restore: the database is in use by another process ({e}). Stop the app and try again.") from e
+    finally:
+        conn.close()
+
+
+def restore_backup(name: str, backup_dir: Union[str, Path] = BACKUP_DIRECTORY, db_path: Union[str, Path] = DATABASE_FILE) -> Path:
+    """
+    Replaces the live database with a backup. The backup is expanded and checked next to the live file
+    first, so a failed check or a full disk leaves the live database untouched; the swap itself is an
+    atomic rename. The app must be stopped: the caller's shared connections are closed here, and the
+    restore is refused (sqlite3.OperationalError) if another app session or any other process still has
+    the database open.
+
+    Returns:
+        The database path.
+    """
+    backup = _find_backup(name, backup_dir, db_path)
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, staging = tempfile.mkstemp(dir=db_path.parent, prefix=f".{db_path.name}.restore-")
+    os.close(fd)
+    try:
+        _expand_backup(backup, Path(staging))
+        result = integrity_check(staging)
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Backup {name} failed its integrity check: {result}")
+        # Close our shared connections first (refused while another live session holds one), so no open
+        # WAL is replayed over the restored file, then make sure no other process has it open before its
+        # -wal/-shm files are removed
+        db_utils.release_connections(db_path)
+        if db_path.exists():
+            _ensure_exclusive_access(db_path)
+        for suffix in ("-wal", "-shm"):
+            sidecar = Path(f"{db_path}{suffix}")
+            if sidecar.exists():
+                sidecar.unlink()
+        os.replace(staging, db_path)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    print(f"Backup: restored {db_path} from {name}")
+    return db_path
+
+
+def prune_backups(backup_dir: Union[str, Path] = BACKUP_DIRECTORY, db_path: Union[str, Path] = DATABASE_FILE,
+                  keep_hourly: int = KEEP_HOURLY, keep_daily: int = KEEP_DAILY, keep_monthly: int = KEEP_MONTHLY) -> List[str]:
+    """
+    Applies the retention policy: the newest backup of each of the last 'keep_hourly' hours,
+    'keep_daily' days and 'keep_monthly' months is kept; every other backup is deleted.
+
+    Returns:
+        The names of the deleted backups.
+    """
+    backups = list_backups(backup_dir, db_path)  # Newest first
+    keep = set()
+    for bucket_format, limit in (("%Y-%m-%d %H", keep_hourly), ("%Y-%m-%d", keep_daily), ("%Y-%m", keep_monthly)):
+        seen = []
+        for backup in backups:
+            bucket = backup.created.strftime(bucket_format)
+            if bucket not in seen:
+                if len(seen) == limit:
+                    break
+                seen.append(bucket)
+                keep.add(backup.name)
+    deleted = []
+    for backup in backups:
+        if backup.name not in keep:
+            backup.path.unlink()
+            deleted.append(backup.name)
+    if deleted:
+        print(f"Backup: retention removed {len(deleted)} old backup(s).")
+    return deleted
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Online backups of the invoice database.")
+    parser.add_argument("command", choices=["backup", "list", "verify", "restore", "prune"])
+    parser.add_argument("name", nargs="?", help="Backup file name (verify / restore).")
+    parser.add_argument("--db", default=DATABASE_FILE, help="Path to the live database.")
+    parser.add_argument("--dir", default=BACKUP_DIRECTORY, help="Backup directory.")
+    parser.add_argument("--no-prune", action="store_true", help="Skip the retention policy after 'backup'.")
+    args = parser.parse_args()
+
+    if args.command in ("verify", "restore") and not args.name:
+        parser.error(f"'{args.command}' needs a backup file name.")
+    if args.command == "backup":
+        create_backup(args.db, args.dir)
+        if not args.no_prune:
+            prune_backups(args.dir, args.db)
+    elif args.command == "list":
+        for backup in list_backups(args.dir, args.db):
+            print(f"{backup.name}  {backup.path.stat().st_size:>12,} bytes")
+    elif args.command == "verify":
+        print(f"{args.name}: {verify_backup(args.name, args.dir, args.db)}")
+    elif args.command == "restore":
+        restore_backup(args.name, args.dir, args.db)
+    else:
+        prune_backups(args.dir, args.db)
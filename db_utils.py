@@ -0,0 +1,781 @@
+# db_utils.py
+# Shared SQLite access for app.py and the pages.
+# Connections are opened once per Streamlit session (or per thread outside Streamlit) and reused across
+# reruns, instead of paying sqlite3.connect() and the schema parse on every helper call. Every connection
+# gets the same tuning: WAL journal (readers no longer block behind a writer), synchronous=NORMAL,
+# a memory-mapped read window, a larger page cache and a busy timeout so concurrent writers wait instead
+# of failing with "database is locked". The sqlite3 module's per-connection statement cache then reuses
+# prepared statements across reruns, since the connection outlives them.
+#
+# Usage:
+#     with db_utils.get_connection(DATABASE_FILE) as conn:   # commits on success, rolls back on error
+#         conn.execute(...)
+# The connection is not closed at the end of the block; call release_connections() before replacing the
+# database file (restore) and checkpoint() before copying it (backup).
+#
+# Schema migrations are versioned with PRAGMA user_version and applied once per database when the first
+# shared connection to it is opened (or with: python db_utils.py migrate DB_FILE).
+# invoice_summary is maintained by triggers on invoices and invoice_containers; writers only touch the
+# line and container tables. python db_utils.py rebuild-summary DB_FILE recomputes it from scratch.
+# The dashboard rollups are trigger-maintained the same way (python db_utils.py rebuild-rollups DB_FILE).
+# Triggers also bump per-table and per-invoice counters in data_versions; data_version() reads them so
+# cached query results can be keyed on exactly the data they were computed from.
+
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+# --- Tuning ---
+BUSY_TIMEOUT_MS = 5000            # Wait up to 5 s for a competing writer
+CACHE_SIZE_KIB = 65536            # 64 MiB page cache per connection
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+CACHED_STATEMENTS = 256           # Prepared statements kept per connection
+MAX_CACHED_CONNECTIONS = 64       # Beyond this, connections whose session or thread has ended are closed
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KIB}",
+    f"PRAGMA mmap_size={MMAP_SIZE_BYTES}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# --- Schema ---
+SCHEMA_VERSION = 6
+MIGRATION_BATCH_ROWS = 5000       # Rows copied per transaction while rebuilding a table
+INVOICES_TABLE = "invoices"
+CONTAINERS_TABLE = "invoice_containers"
+SUMMARY_TABLE = "invoice_summary"
+CHANGE_LOG_TABLE = "invoice_change_log"
+DATA_VERSION_TABLE = "data_versions"
+# Line-item quantities stored as numbers (version 1). Amounts stay REAL: every page, export and the
+# summary already work in currency units, so integer cents would only add conversions on every read.
+INVOICE_NUMERIC_COLUMNS = {
+    "pcs": "INTEGER", "pallet_count": "INTEGER",
+    "sqft": "REAL", "amount": "REAL", "net": "REAL", "gross": "REAL", "cbm": "REAL",
+}
+
+_CONNECTIONS: Dict[Tuple[str, str], sqlite3.Connection] = {}
+_LOCK = threading.Lock()
+_MIGRATED: Set[str] = set()
+_MIGRATION_LOCKS: Dict[str, threading.Lock] = {}  # One per database path: sessions migrate it one at a time
+
+
+def _owner_key() -> str:
+    """Identifies who may reuse a connection: the Streamlit session if there is one, else the thread."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return f"session:{ctx.session_id}"
+    except ImportError:
+        pass
+    return f"thread:{threading.get_ident()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """Whether the session or thread behind an _owner_key() still exists. Unknown counts as alive."""
+    kind, _, ident = owner.partition(":")
+    if kind == "thread":
+        return any(str(thread.ident) == ident for thread in threading.enumerate())
+    try:
+        from streamlit.runtime import Runtime
+        return Runtime.instance().is_active_session(ident)
+    except Exception:  # No runtime (or an older Streamlit): never close a connection that may be in use
+        return True
+
+
+def _prune_connections():
+    """Closes cached connections whose owner has ended. Call with _LOCK held."""
+    for key in [key for key in _CONNECTIONS if not _owner_alive(key[1])]:
+        _CONNECTIONS.pop(key).close()
+
+
+def open_connection(db_path: Union[str, Path]) -> sqlite3.Connection:
+    """
+    Opens a new, tuned connection (not cached). Use for one-off scripts and maintenance jobs.
+
+    Args:
+        db_path: Path to the SQLite database file.
+
+    Returns:
+        The connection.
+    """
+    # check_same_thread=False: a Streamlit session reruns on different threads, but never two at once
+    conn = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(db_path: Union[str, Path]) -> sqlite3.Connection:
+    """
+    Returns the caller's shared connection to a database, opening it on first use.
+
+    Args:
+        db_path: Path to the SQLite database file.
+
+    Returns:
+        A connection that stays open; use it as a context manager for a transaction.
+    """
+    key = (os.path.abspath(db_path), _owner_key())
+    with _LOCK:
+        conn = _CONNECTIONS.get(key)
+        if conn is not None:
+            return conn
+    conn = open_connection(db_path)
+    with _LOCK:
+        migration_lock = _MIGRATION_LOCKS.setdefault(key[0], threading.Lock())
+    with migration_lock:  # Another session may be migrating the same file; wait, then re-check
+        if key[0] not in _MIGRATED:
+            migrate_schema(conn)
+            _MIGRATED.add(key[0])
+    with _LOCK:
+        _CONNECTIONS[key] = conn
+        # Another live session may be mid-query on its connection, so only ended owners' connections are
+        # closed; if every owner is still alive the cache stays above the limit until some end.
+        if len(_CONNECTIONS) > MAX_CACHED_CONNECTIONS:
+            _prune_connections()
+    return conn
+
+
+def close_connections(db_path: Union[str, Path, None] = None) -> int:
+    """
+    Closes the cached connections to one database (or to all databases if db_path is None).
+
+    Returns:
+        The number of connections closed.
+    """
+    target = os.path.abspath(db_path) if db_path is not None else None
+    with _LOCK:
+        keys = [key for key in _CONNECTIONS if target is None or key[0] == target]
+        for key in keys:
+            _CONNECTIONS.pop(key).close()
+        # The file may be replaced (restore), so check its schema again on the next connection
+        _MIGRATED.difference_update([target] if target else list(_MIGRATED))
+    return len(keys)
+
+
+def release_connections(db_path: Union[str, Path]) -> int:
+    """
+    Closes the caller's cached connections to a database that is about to be replaced, plus those whose
+    session or thread has ended. Connections of other live sessions are never closed (one may be
+    mid-query): if any exist, nothing is closed and sqlite3.OperationalError is raised.
+
+    Returns:
+        The number of connections closed.
+    """
+    target, owner = os.path.abspath(db_path), _owner_key()
+    with _LOCK:
+        keys = [key for key in _CONNECTIONS if key[0] == target]
+        in_use = [key[1] for key in keys if key[1] != owner and _owner_alive(key[1])]
+        if in_use:
+            raise sqlite3.OperationalError(
+                f"The database is open in {len(in_use)} other app session(s). Close them and try again.")
+        for key in keys:
+            _CONNECTIONS.pop(key).close()
+        _MIGRATED.discard(target)  # The replacement's schema is checked on the next connection
+    return len(keys)
+
+
+def checkpoint(db_path: Union[str, Path]) -> Tuple[int, int, int]:
+    """
+    Copies every committed WAL page into the main database file and truncates the WAL, so the .db file
+    alone holds all committed data (required before copying it).
+
+    Returns:
+        SQLite's (busy, log pages, checkpointed pages) result.
+    """
+    with get_connection(db_path) as conn:
+        return tuple(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+
+
+def connection_settings(db_path: Union[str, Path]) -> Dict[str, object]:
+    """Returns the effective pragma values of the caller's connection (for diagnostics)."""
+    conn = get_connection(db_path)
+    return {name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")}
+
+
+# --- Typed values ---
+def to_number(value: Any, integer: bool = False) -> Any:
+    """
+    Converts a stored or entered quantity ('1,234.50', '38', 12.0, '') to the number SQLite should hold.
+
+    Args:
+        value: The raw value.
+        integer: Return integral values as int (for INTEGER columns).
+
+    Returns:
+        An int/float, None for blanks and NaN, or the value unchanged if it is not a number.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        text = value.strip().replace(",", "")
+        if not text or text.lower() in ("nan", "none", "null"):
+            return None
+        try:
+            value = float(text)
+        except ValueError:
+            return value
+    if isinstance(value, (int, float)) or hasattr(value, "item"):  # Python or numpy scalar
+        value = value.item() if hasattr(value, "item") else value
+        if isinstance(value, float):
+            if value != value:  # NaN
+                return None
+            if integer and value.is_integer():
+                return int(value)
+    return value
+
+
+def sql_value(value: Any) -> Any:
+    """Maps pandas/numpy missing values to None and numpy scalars to Python values for sqlite3 binding."""
+    if value is None or type(value).__name__ in ("NAType", "NaTType"):
+        return None
+    if isinstance(value, float) and value != value:  # NaN
+        return None
+    if hasattr(value, "item"):  # numpy scalar
+        value = value.item()
+        return None if isinstance(value, float) and value != value else value
+    return value
+
+
+def bind_invoice_numbers(df):
+    """Converts the numeric invoice columns of a DataFrame in place, so to_sql() binds numbers, not text."""
+    for column, sql_type in INVOICE_NUMERIC_COLUMNS.items():
+        if column in df.columns:
+            values = [to_number(v, sql_type == "INTEGER") for v in df[column]]
+            # object dtype keeps ints as ints and blanks as None (a float column would turn them into x.0/NaN)
+            df[column] = type(df[column])(values, index=df.index, dtype=object)
+    return df
+
+
+# --- Invoice summary ---
+SUMMARY_TOTALS = (("total_sqft", "sqft"), ("total_amount", "amount"), ("total_pcs", "pcs"),
+                  ("total_net", "net"), ("total_gross", "gross"), ("total_cbm", "cbm"))
+# Columns the summary takes the MAX of (same as the GROUP BY rebuild: a partly voided invoice is 'voided')
+SUMMARY_MAX_COLUMNS = ("inv_no", "inv_date", "status", "creating_date")
+_TOTALS = ", ".join(total for total, _ in SUMMARY_TOTALS)
+_MAX_COLUMNS = ", ".join(SUMMARY_MAX_COLUMNS)
+
+# Same definition as the Generate page and the Database Manager reset
+CONTAINERS_SCHEMA = f"""CREATE TABLE IF NOT EXISTS {CONTAINERS_TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    inv_ref TEXT NOT NULL,
+    container_description TEXT NOT NULL,
+    FOREIGN KEY (inv_ref) REFERENCES invoices (inv_ref)
+)"""
+
+SUMMARY_SCHEMA = (
+    f"""CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+        inv_ref TEXT PRIMARY KEY, inv_no TEXT, inv_date TEXT,
+        status TEXT, total_sqft REAL, total_amount REAL,
+        total_pcs INTEGER, total_net REAL, total_gross REAL,
+        total_cbm REAL, creating_date TEXT, containers TEXT
+    )""",
+    # FTS5 index over the summary, kept in sync by the summary_* triggers
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS summary_fts USING fts5(
+        inv_ref, inv_no, containers,
+        content='{SUMMARY_TABLE}',
+        content_rowid='rowid'
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_summary_inv_no ON {SUMMARY_TABLE}(inv_no)",
+    f"CREATE INDEX IF NOT EXISTS idx_summary_creating_date ON {SUMMARY_TABLE}(creating_date)",
+    f"CREATE INDEX IF NOT EXISTS idx_summary_containers ON {SUMMARY_TABLE}(containers)",
+    # The maintenance triggers look lines and containers up by inv_ref
+    f"CREATE INDEX IF NOT EXISTS idx_invoices_inv_ref ON {INVOICES_TABLE} (inv_ref)",
+    f"CREATE INDEX IF NOT EXISTS idx_containers_inv_ref ON {CONTAINERS_TABLE} (inv_ref)",
+)
+
+
+# FTS sync triggers. The update trigger fires only when an indexed column changes: the line triggers
+# update the totals of invoice_summary on every line write, and those must not rewrite the FTS entry.
+_FTS_TRIGGERS = {
+    "summary_ai": f"""AFTER INSERT ON {SUMMARY_TABLE} BEGIN
+        INSERT INTO summary_fts(rowid, inv_ref, inv_no, containers)
+        VALUES (new.rowid, new.inv_ref, new.inv_no, new.containers);
+    END""",
+    "summary_ad": f"""AFTER DELETE ON {SUMMARY_TABLE} BEGIN
+        INSERT INTO summary_fts(summary_fts, rowid, inv_ref, inv_no, containers)
+        VALUES ('delete', old.rowid, old.inv_ref, old.inv_no, old.containers);
+    END""",
+    "summary_au": f"""AFTER UPDATE OF inv_ref, inv_no, containers ON {SUMMARY_TABLE} BEGIN
+        INSERT INTO summary_fts(summary_fts, rowid, inv_ref, inv_no, containers)
+        VALUES ('delete', old.rowid, old.inv_ref, old.inv_no, old.containers);
+        INSERT INTO summary_fts(rowid, inv_ref, inv_no, containers)
+        VALUES (new.rowid, new.inv_ref, new.inv_no, new.containers);
+    END""",
+}
+
+
+def _containers_of(ref: str) -> str:
+    return f"(SELECT GROUP_CONCAT(container_description, ', ') FROM {CONTAINERS_TABLE} WHERE inv_ref = {ref})"
+
+
+def _add_line_sql(line: str) -> str:
+    """Upsert adding one line's quantities to its invoice's summary row (creating the row if needed)."""
+    values = ", ".join(f"COALESCE({line}.{column}, 0)" for _, column in SUMMARY_TOTALS)
+    added = ", ".join(f"{total} = {total} + excluded.{total}" for total, _ in SUMMARY_TOTALS)
+    # Scalar MAX() returns NULL if either side is NULL, so fill each side from the other first
+    maxed = ", ".join(f"{c} = MAX(COALESCE({c}, excluded.{c}), COALESCE(excluded.{c}, {c}))" for c in SUMMARY_MAX_COLUMNS)
+    return (f"INSERT INTO {SUMMARY_TABLE} (inv_ref, {_MAX_COLUMNS}, {_TOTALS}, containers) "
+            f"VALUES ({line}.inv_ref, {', '.join(f'{line}.{c}' for c in SUMMARY_MAX_COLUMNS)}, {values}, "
+            f"{_containers_of(f'{line}.inv_ref')}) "
+            f"ON CONFLICT(inv_ref) DO UPDATE SET {added}, {maxed};")
+
+
+def _remove_line_sql(line: str) -> str:
+    """Subtracts one line's quantities, then drops the summary row if the invoice has no lines left."""
+    subtracted = ", ".join(f"{total} = {total} - COALESCE({line}.{column}, 0)" for total, column in SUMMARY_TOTALS)
+    return (f"UPDATE {SUMMARY_TABLE} SET {subtracted} WHERE inv_ref = {line}.inv_ref;\n"
+            f"DELETE FROM {SUMMARY_TABLE} WHERE inv_ref = {line}.inv_ref "
+            f"AND NOT EXISTS (SELECT 1 FROM {INVOICES_TABLE} WHERE inv_ref = {line}.inv_ref);")
+
+
+def _refresh_max_columns_sql(ref: str) -> str:
+    """Recomputes the MAX() columns from the invoice's remaining lines (a MAX cannot be decremented)."""
+    return (f"UPDATE {SUMMARY_TABLE} SET ({_MAX_COLUMNS}) = (SELECT {', '.join(f'MAX({c})' for c in SUMMARY_MAX_COLUMNS)} "
+            f"FROM {INVOICES_TABLE} WHERE inv_ref = {ref}) WHERE inv_ref = {ref};")
+
+
+def _refresh_containers_sql(ref: str) -> str:
+    return f"UPDATE {SUMMARY_TABLE} SET containers = {_containers_of(ref)} WHERE inv_ref = {ref};"
+
+
+_MAINTENANCE_TRIGGERS = {
+    # Lines: apply each inserted/deleted/updated line as a delta to its invoice's summary row
+    "invoice_lines_ai": f"AFTER INSERT ON {INVOICES_TABLE} WHEN new.inv_ref IS NOT NULL BEGIN\n"
+                        f"{_add_line_sql('new')}\nEND",
+    "invoice_lines_ad": f"AFTER DELETE ON {INVOICES_TABLE} WHEN old.inv_ref IS NOT NULL BEGIN\n"
+                        f"{_remove_line_sql('old')}\n{_refresh_max_columns_sql('old.inv_ref')}\nEND",
+    "invoice_lines_au": f"AFTER UPDATE OF inv_ref, {_MAX_COLUMNS}, {', '.join(c for _, c in SUMMARY_TOTALS)} "
+                        f"ON {INVOICES_TABLE} BEGIN\n"
+                        f"{_remove_line_sql('old')}\n{_add_line_sql('new')}\n"
+                        f"{_refresh_max_columns_sql('old.inv_ref')}\n{_refresh_max_columns_sql('new.inv_ref')}\nEND",
+    # Containers: re-list the invoice's containers
+    "invoice_containers_ai": f"AFTER INSERT ON {CONTAINERS_TABLE} BEGIN\n{_refresh_containers_sql('new.inv_ref')}\nEND",
+    "invoice_containers_ad": f"AFTER DELETE ON {CONTAINERS_TABLE} BEGIN\n{_refresh_containers_sql('old.inv_ref')}\nEND",
+    "invoice_containers_au": f"AFTER UPDATE ON {CONTAINERS_TABLE} BEGIN\n{_refresh_containers_sql('old.inv_ref')}\n"
+                             f"{_refresh_containers_sql('new.inv_ref')}\nEND",
+}
+
+
+def create_summary_schema(conn: sqlite3.Connection):
+    """
+    Creates invoice_summary with its FTS index and (re)creates the triggers that keep both in step with the
+    invoices and invoice_containers tables. Both tables must already exist.
+    """
+    for sql in SUMMARY_SCHEMA:
+        conn.execute(sql)
+    for name, body in {**_FTS_TRIGGERS, **_MAINTENANCE_TRIGGERS}.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def rebuild_summaries(conn: sqlite3.Connection, inv_refs: Optional[List[str]] = None) -> int:
+    """
+    Recomputes invoice_summary rows from the line and container tables in one transaction.
+    The triggers keep the summary current; this is the repair/backfill path.
+
+    Args:
+        conn: An open connection.
+        inv_refs: Invoice references to rebuild; None rebuilds the whole table.
+
+    Returns:
+        The number of summary rows written.
+    """
+    where, params = "", ()
+    if inv_refs is not None:
+        if not inv_refs:
+            return 0
+        where, params = f"WHERE inv_ref IN ({', '.join('?' * len(inv_refs))})", tuple(inv_refs)
+    maxes = ", ".join(f"MAX({c}) AS {c}" for c in SUMMARY_MAX_COLUMNS)
+    sums = ", ".join(f"COALESCE(SUM({column}), 0) AS {total}" for total, column in SUMMARY_TOTALS)
+    line_filter = f"{where} AND inv_ref IS NOT NULL" if where else "WHERE inv_ref IS NOT NULL"
+    with conn:
+        conn.execute(f"DELETE FROM {SUMMARY_TABLE} {where}", params)
+        # One pass over each table: containers are grouped once and joined, not looked up per invoice
+        conn.execute(f"""
+            INSERT INTO {SUMMARY_TABLE} (inv_ref, {_MAX_COLUMNS}, {_TOTALS}, containers)
+            SELECT i.inv_ref, {', '.join(f'i.{c}' for c in SUMMARY_MAX_COLUMNS)}, {', '.join(f'i.{t}' for t, _ in SUMMARY_TOTALS)}, c.containers
+            FROM (SELECT inv_ref, {maxes}, {sums} FROM {INVOICES_TABLE} {line_filter} GROUP BY inv_ref) i
+            LEFT JOIN (SELECT inv_ref, GROUP_CONCAT(container_description, ', ') AS containers
+                       FROM {CONTAINERS_TABLE} {where} GROUP BY inv_ref) c ON c.inv_ref = i.inv_ref
+        """, params * 2)
+        return conn.execute(f"SELECT COUNT(*) FROM {SUMMARY_TABLE} {where}", params).fetchone()[0]
+
+
+# --- Change log ---
+CHANGE_LOG_SCHEMA = (
+    # One row per applied line/container change: updates keep only the changed columns ({col: [old, new]})
+    f"""CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+        id INTEGER PRIMARY KEY, changed_at TEXT NOT NULL, source TEXT,
+        inv_ref TEXT, action TEXT NOT NULL, row_id INTEGER, detail TEXT
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_change_log_inv_ref ON {CHANGE_LOG_TABLE} (inv_ref)",
+)
+
+
+def create_change_log(conn: sqlite3.Connection):
+    """Creates the amendment change log table."""
+    for sql in CHANGE_LOG_SCHEMA:
+        conn.execute(sql)
+
+
+# --- Dashboard rollups ---
+# Active line items pre-aggregated by creation day x customer prefix x item, and the invoices added per
+# day, maintained by triggers on invoices so the dashboard reads a few rows per day instead of every line.
+# A line counts when the dashboard counted it before: active, with a numeric amount and a readable
+# creating_date. Months are summed from the daily rows.
+ROLLUP_TABLE = "dashboard_daily"
+ROLLUP_INVOICES_TABLE = "dashboard_invoice_days"
+_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+ROLLUP_SCHEMA = (
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+        day TEXT NOT NULL, customer TEXT NOT NULL, item TEXT NOT NULL,
+        amount REAL NOT NULL, sqft REAL NOT NULL, lines INTEGER NOT NULL,
+        PRIMARY KEY (day, customer, item)
+    ) WITHOUT ROWID""",
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_INVOICES_TABLE} (
+        day TEXT NOT NULL, inv_ref TEXT NOT NULL, lines INTEGER NOT NULL,
+        PRIMARY KEY (day, inv_ref)
+    ) WITHOUT ROWID""",
+)
+
+
+def customer_prefix_sql(ref: str) -> str:
+    """SQL for the customer prefix of an inv_ref: its leading letters, upper-cased ('CLF2025-200' -> 'CLF')."""
+    return (f"substr(upper(COALESCE({ref}, '')), 1, length(COALESCE({ref}, '')) "
+            f"- length(ltrim(upper(COALESCE({ref}, '')), '{_LETTERS}')))")
+
+
+def _rollup_counts_sql(line: str) -> str:
+    return (f"{line}.status = 'active' AND typeof({line}.amount) IN ('integer', 'real') "
+            f"AND date({line}.creating_date) IS NOT NULL")
+
+
+def _rollup_key(line: str) -> Tuple[str, str, str]:
+    return f"date({line}.creating_date)", customer_prefix_sql(f"{line}.inv_ref"), f"COALESCE({line}.item, '')"
+
+
+def _rollup_sqft(line: str) -> str:
+    return f"CASE WHEN typeof({line}.sqft) IN ('integer', 'real') THEN {line}.sqft ELSE 0 END"
+
+
+def _rollup_add_sql(line: str) -> str:
+    """Adds one line to its day/customer/item row and its invoice-day row (creating them if needed)."""
+    day, customer, item = _rollup_key(line)
+    counts = _rollup_counts_sql(line)
+    return (f"INSERT INTO {ROLLUP_TABLE} (day, customer, item, amount, sqft, lines) "
+            f"SELECT {day}, {customer}, {item}, {line}.amount, {_rollup_sqft(line)}, 1 WHERE {counts} "
+            f"ON CONFLICT(day, customer, item) DO UPDATE SET amount = amount + excluded.amount, "
+            f"sqft = sqft + excluded.sqft, lines = lines + 1;\n"
+            f"INSERT INTO {ROLLUP_INVOICES_TABLE} (day, inv_ref, lines) "
+            f"SELECT {day}, {line}.inv_ref, 1 WHERE {counts} AND {line}.inv_ref IS NOT NULL "
+            f"ON CONFLICT(day, inv_ref) DO UPDATE SET lines = lines + 1;")
+
+
+def _rollup_remove_sql(line: str) -> str:
+    """Subtracts one line, dropping rows that no longer count any line."""
+    day, customer, item = _rollup_key(line)
+    counts = _rollup_counts_sql(line)
+    key = f"day = {day} AND customer = {customer} AND item = {item}"
+    return (f"UPDATE {ROLLUP_TABLE} SET amount = amount - {line}.amount, sqft = sqft - {_rollup_sqft(line)}, "
+            f"lines = lines - 1 WHERE {key} AND {counts};\n"
+            f"DELETE FROM {ROLLUP_TABLE} WHERE {key} AND lines <= 0;\n"
+            f"UPDATE {ROLLUP_INVOICES_TABLE} SET lines = lines - 1 WHERE day = {day} AND inv_ref = {line}.inv_ref AND {counts};\n"
+            f"DELETE FROM {ROLLUP_INVOICES_TABLE} WHERE day = {day} AND inv_ref = {line}.inv_ref AND lines <= 0;")
+
+
+_ROLLUP_TRIGGERS = {
+    "rollup_lines_ai": f"AFTER INSERT ON {INVOICES_TABLE} BEGIN\n{_rollup_add_sql('new')}\nEND",
+    "rollup_lines_ad": f"AFTER DELETE ON {INVOICES_TABLE} BEGIN\n{_rollup_remove_sql('old')}\nEND",
+    "rollup_lines_au": f"AFTER UPDATE OF inv_ref, item, status, amount, sqft, creating_date ON {INVOICES_TABLE} BEGIN\n"
+                       f"{_rollup_remove_sql('old')}\n{_rollup_add_sql('new')}\nEND",
+}
+
+
+def create_rollup_schema(conn: sqlite3.Connection):
+    """Creates the dashboard rollup tables and (re)creates the triggers that maintain them from invoices."""
+    for sql in ROLLUP_SCHEMA:
+        conn.execute(sql)
+    for name, body in _ROLLUP_TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> int:
+    """
+    Recomputes both rollup tables from the invoices table in one transaction (the repair/backfill path).
+
+    Returns:
+        The number of day/customer/item rows written.
+    """
+    day, customer, item = _rollup_key("i")
+    counts = _rollup_counts_sql("i")
+    with conn:
+        conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+        conn.execute(f"DELETE FROM {ROLLUP_INVOICES_TABLE}")
+        conn.execute(f"""
+            INSERT INTO {ROLLUP_TABLE} (day, customer, item, amount, sqft, lines)
+            SELECT {day}, {customer}, {item}, SUM(i.amount), SUM({_rollup_sqft('i')}), COUNT(*)
+            FROM {INVOICES_TABLE} i WHERE {counts} GROUP BY 1, 2, 3
+        """)
+        conn.execute(f"""
+            INSERT INTO {ROLLUP_INVOICES_TABLE} (day, inv_ref, lines)
+            SELECT {day}, i.inv_ref, COUNT(*) FROM {INVOICES_TABLE} i
+            WHERE {counts} AND i.inv_ref IS NOT NULL GROUP BY 1, 2
+        """)
+        return conn.execute(f"SELECT COUNT(*) FROM {ROLLUP_TABLE}").fetchone()[0]
+
+
+# --- Data versions ---
+# Version counters bumped by triggers on every committed change: one per table, and one per invoice
+# ('invoice:<inv_ref>') for changes to its lines or containers. PRAGMA data_version is not usable as a
+# shared cache key: it is per connection and does not count the connection's own commits.
+TRACKED_TABLES = (INVOICES_TABLE, CONTAINERS_TABLE, SUMMARY_TABLE)
+
+
+def invoice_scope(inv_ref: str) -> str:
+    """The data_versions scope of one invoice's lines and containers."""
+    return f"invoice:{inv_ref}"
+
+
+def _bump_sql(scope_sql: str, condition: str = "1") -> str:
+    return (f"INSERT INTO {DATA_VERSION_TABLE} (scope, version) SELECT {scope_sql}, 1 WHERE {condition} "
+            f"ON CONFLICT(scope) DO UPDATE SET version = version + 1;")
+
+
+def create_data_version_tracking(conn: sqlite3.Connection):
+    """Creates the data_versions table and (re)creates the triggers that bump it."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (scope TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID")
+    for table in TRACKED_TABLES:
+        for suffix, event in (("ai", "INSERT"), ("ad", "DELETE"), ("au", "UPDATE")):
+            body = [_bump_sql(f"'{table}'")]
+            if table != SUMMARY_TABLE:
+                if event != "INSERT":
+                    body.append(_bump_sql("'invoice:' || old.inv_ref", "old.inv_ref IS NOT NULL"))
+                if event != "DELETE":  # On UPDATE only a renamed row changes a second invoice
+                    renamed = " AND new.inv_ref IS NOT old.inv_ref" if event == "UPDATE" else ""
+                    body.append(_bump_sql("'invoice:' || new.inv_ref", "new.inv_ref IS NOT NULL" + renamed))
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_version_{suffix}")
+            conn.execute(f"CREATE TRIGGER {table}_version_{suffix} AFTER {event} ON {table} BEGIN\n" + "\n".join(body) + "\nEND")
+
+
+def data_version(conn: sqlite3.Connection, *scopes: str) -> Tuple[int, ...]:
+    """
+    Returns the current version of each scope (a table name or invoice_scope(ref)); 0 if never changed.
+    Pass the result to a cached function as an argument so any change to those scopes misses the cache.
+    """
+    placeholders = ", ".join("?" * len(scopes))
+    found = dict(conn.execute(f"SELECT scope, version FROM {DATA_VERSION_TABLE} WHERE scope IN ({placeholders})", scopes))
+    return tuple(found.get(scope, 0) for scope in scopes)
+
+
+# --- Migrations ---
+def _table_sql(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def _text_numeric_columns(conn: sqlite3.Connection) -> List[str]:
+    """Lists the INVOICE_NUMERIC_COLUMNS still declared with another type in the invoices table."""
+    declared = {row[1]: row[2].upper() for row in conn.execute(f"PRAGMA table_info({INVOICES_TABLE})")}
+    return [c for c, t in INVOICE_NUMERIC_COLUMNS.items() if c in declared and declared[c] != t]
+
+
+def _rebuild_invoices_typed(conn: sqlite3.Connection, batch_rows: int = MIGRATION_BATCH_ROWS) -> int:
+    """
+    Rebuilds the invoices table with INTEGER/REAL quantity columns (SQLite cannot change a column's type).
+    Rows are copied in id order, one transaction per batch, into invoices_migrating; an interrupted run
+    resumes after the last copied id. Writers keep working meanwhile: triggers record the id of every row
+    inserted, updated or deleted during the copy, and those rows are copied again under the write lock
+    (BEGIN IMMEDIATE) together with the final swap (drop, rename, recreate indexes/triggers), so no
+    concurrent change is lost.
+
+    Returns:
+        The number of rows copied by this call.
+    """
+    temp_table = f"{INVOICES_TABLE}_migrating"
+    changes_table = f"{INVOICES_TABLE}_migrating_changes"
+    create_sql = _table_sql(conn, INVOICES_TABLE)
+    for column, sql_type in INVOICE_NUMERIC_COLUMNS.items():
+        create_sql = re.sub(rf"\b{column}\s+TEXT\b", f"{column} {sql_type}", create_sql, flags=re.IGNORECASE)
+    create_sql = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"'`]?{INVOICES_TABLE}[\"'`]?",
+                        f"CREATE TABLE IF NOT EXISTS {temp_table}", create_sql, flags=re.IGNORECASE)
+    # Indexes and triggers are dropped with the old table; recreate them on the new one
+    dependents = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL "
+        "AND name NOT LIKE ?", (INVOICES_TABLE, f"{changes_table}%"))]
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({INVOICES_TABLE})")]
+    integer_flags = [INVOICE_NUMERIC_COLUMNS.get(c) == "INTEGER" for c in columns]
+    numeric_flags = [c in INVOICE_NUMERIC_COLUMNS for c in columns]
+    column_list = ", ".join(columns)
+    # OR REPLACE: a copy another process is making at the same time writes the same rows
+    insert_sql = f"INSERT OR REPLACE INTO {temp_table} ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+
+    def typed(rows):
+        return [tuple(to_number(v, is_int) if is_num else v
+                      for v, is_num, is_int in zip(row, numeric_flags, integer_flags)) for row in rows]
+
+    with conn:
+        if _table_sql(conn, temp_table) is not None and _table_sql(conn, changes_table) is None:
+            # A partial copy made without change tracking cannot be trusted; start over
+            conn.execute(f"DROP TABLE {temp_table}")
+        conn.execute(create_sql)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {changes_table} (id INTEGER PRIMARY KEY)")
+        for suffix, event, ids in (("ai", "INSERT", ("new.id",)), ("ad", "DELETE", ("old.id",)),
+                                   ("au", "UPDATE", ("old.id", "new.id"))):
+            body = "\n".join(f"INSERT OR IGNORE INTO {changes_table} (id) VALUES ({row_id});" for row_id in ids)
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {changes_table}_{suffix} AFTER {event} ON {INVOICES_TABLE} "
+                         f"BEGIN\n{body}\nEND")
+    last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {temp_table}").fetchone()[0]
+    copied = 0
+    while True:
+        rows = conn.execute(f"SELECT {column_list} FROM {INVOICES_TABLE} WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_rows)).fetchall()
+        if not rows:
+            break
+        try:
+            with conn:
+                conn.executemany(insert_sql, typed(rows))
+        except sqlite3.OperationalError:
+            if _table_sql(conn, temp_table) is None:  # Another process finished the rebuild meanwhile
+                return copied
+            raise
+        last_id = rows[-1][columns.index("id")]
+        copied += len(rows)
+        print(f"Schema migration: copied {copied} invoice row(s)...")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if _table_sql(conn, changes_table) is None:  # Another process already swapped the tables in
+            conn.rollback()
+            return copied
+        # Under the write lock: replay what changed since each batch was copied, then swap
+        conn.execute(f"DELETE FROM {temp_table} WHERE id IN (SELECT id FROM {changes_table})")
+        replayed = conn.execute(f"SELECT {column_list} FROM {INVOICES_TABLE} "
+                                f"WHERE id IN (SELECT id FROM {changes_table}) OR id > ?", (last_id,)).fetchall()
+        conn.executemany(insert_sql, typed(replayed))
+        if replayed:
+            print(f"Schema migration: re-copied {len(replayed)} invoice row(s) changed during the copy.")
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (INVOICES_TABLE,)).fetchone() \
+            if _table_sql(conn, "sqlite_sequence") else None
+        conn.execute(f"DROP TABLE {INVOICES_TABLE}")  # Drops the change-tracking triggers with it
+        conn.execute(f"DROP TABLE {changes_table}")
+        conn.execute(f"ALTER TABLE {temp_table} RENAME TO {INVOICES_TABLE}")
+        for sql in dependents:
+            conn.execute(sql)
+        if sequence:  # Keep AUTOINCREMENT from reusing ids of deleted rows
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], INVOICES_TABLE))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return copied
+
+
+def _step_pending(conn: sqlite3.Connection, version: int) -> bool:
+    """Re-reads user_version under the write lock, so a step another process has finished is skipped."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0] < version
+    finally:
+        conn.rollback()
+
+
+def _set_schema_version(conn: sqlite3.Connection, version: int):
+    """Records a completed migration step, so an interrupted run resumes after it. Never lowers the version."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+            conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrate_schema(conn: sqlite3.Connection) -> int:
+    """
+    Brings a database up to SCHEMA_VERSION. Safe to call on every start: up-to-date databases cost one
+    PRAGMA read, and a database without an invoices table yet is left for the page that creates it.
+
+    Version 1: invoices.pcs/pallet_count become INTEGER and sqft/amount/net/gross/cbm REAL, so totals
+    no longer CAST every row.
+    Version 2: invoice_summary is maintained by triggers (and rebuilt once from the line tables).
+    Version 3: invoice_change_log records the row-level changes applied by amendments.
+    Version 4: data_versions counters for cache invalidation.
+    Version 5: dashboard rollups maintained by triggers (and built once from the line table).
+    Version 6: the summary FTS update trigger fires only when inv_ref, inv_no or containers change.
+    user_version is advanced after each step, and a step never runs without its prerequisites (a
+    missing invoice_containers table is created for version 2), so every version it records is installed.
+    Each step re-reads user_version under BEGIN IMMEDIATE first, so when several processes open an old
+    database at once a step one of them has finished is skipped by the others (and the steps are safe
+    to repeat if two start together).
+
+    Returns:
+        The schema version after migrating.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION or _table_sql(conn, INVOICES_TABLE) is None:
+        return version
+    if _step_pending(conn, 1):
+        if _text_numeric_columns(conn):
+            print("Schema migration: converting invoice quantities to numeric columns...")
+            _rebuild_invoices_typed(conn)
+        _set_schema_version(conn, 1)
+    if _step_pending(conn, 2):
+        print("Schema migration: installing the invoice summary triggers...")
+        with conn:
+            conn.execute(CONTAINERS_SCHEMA)  # The summary triggers need it, even before the first container
+            create_summary_schema(conn)
+        print(f"Schema migration: rebuilt {rebuild_summaries(conn)} invoice summary row(s).")
+        _set_schema_version(conn, 2)
+    if _step_pending(conn, 3):
+        with conn:
+            create_change_log(conn)
+        _set_schema_version(conn, 3)
+    if _step_pending(conn, 4):
+        with conn:
+            create_data_version_tracking(conn)
+        _set_schema_version(conn, 4)
+    if _step_pending(conn, 5):
+        print("Schema migration: building the dashboard rollups...")
+        with conn:
+            create_rollup_schema(conn)
+        print(f"Schema migration: built {rebuild_rollups(conn)} dashboard rollup row(s).")
+        _set_schema_version(conn, 5)
+    if _step_pending(conn, 6):
+        with conn:
+            create_summary_schema(conn)  # Recreates the summary triggers with their current definitions
+        _set_schema_version(conn, 6)
+    return SCHEMA_VERSION
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintenance commands for the invoice database.")
+    parser.add_argument("command", choices=["migrate", "rebuild-summary", "rebuild-rollups", "checkpoint", "settings"])
+    parser.add_argument("db_file", help="Path to the SQLite database file.")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Schema version: {migrate_schema(open_connection(args.db_file))}")
+    elif args.command == "rebuild-summary":
+        print(f"Rebuilt {rebuild_summaries(get_connection(args.db_file))} invoice summary row(s).")
+    elif args.command == "rebuild-rollups":
+        print(f"Rebuilt {rebuild_rollups(get_connection(args.db_file))} dashboard rollup row(s).")
+    elif args.command == "checkpoint":
+        print(f"Checkpoint (busy, log pages, checkpointed): {checkpoint(args.db_file)}")
+    else:
+        for name, value in connection_settings(args.db_file).items():
+            print(f"{name}: {value}")
@@ -0,0 +1,218 @@
+# export_utils.py
+# Streaming report exports from the invoice database.
+# The Explorer used to build a whole report as a CSV string, encode it to bytes and hand those to the
+# download button, holding about three copies of the report in memory. export_report() instead runs one
+# query with the column selection and filters in SQL, fetches EXPORT_CHUNK_ROWS rows at a time and writes
+# them straight to a file on disk: CSV, or XLSX through openpyxl's write-only workbook (rows are streamed
+# to the sheet XML rather than kept as cell objects). The page then serves the finished file from disk.
+# Exports are kept in EXPORT_DIRECTORY and removed by prune_exports() once older than EXPORT_MAX_AGE_HOURS.
+#
+# Usage (from the project root):
+#     python export_utils.py lines --format xlsx --start 2025-01-01 --end 2025-12-31 [--columns inv_ref,amount]
+
+import csv
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import db_utils
+
+DATABASE_FILE = os.path.join("data", "Invoice Record", "master_invoice_data.db")
+EXPORT_DIRECTORY = Path(tempfile.gettempdir()) / "invoice_exports"
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_MAX_AGE_HOURS = 6
+XLSX_MAX_ROWS = 1048576  # Excel's sheet limit, header included; longer exports continue on a new sheet
+
+# Report sources: table and row order
+SOURCES = {
+    "summary": (db_utils.SUMMARY_TABLE, "creating_date DESC"),
+    "lines": (db_utils.INVOICES_TABLE, "id"),
+}
+FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+@dataclass(frozen=True)
+class ExportResult:
+    """A finished export file."""
+    path: Path
+    file_name: str
+    mime: str
+    rows: int
+    columns: List[str]
+
+
+def available_columns(conn, source: str) -> List[str]:
+    """Returns the columns a report source can export, in table order."""
+    table, _ = SOURCES[source]
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def build_export_query(conn, source: str, columns: Optional[Sequence[str]] = None,
+                       start: Optional[date] = None, end: Optional[date] = None,
+                       statuses: Optional[Sequence[str]] = None, ref_filter: str = ""):
+    """
+    Builds the report query with the column selection and the filters in SQL.
+
+    Args:
+        conn: An open connection.
+        source: 'summary' (one row per invoice) or 'lines' (one row per line item).
+        columns: Columns to export (None for all); each must be a column of the source table.
+        start, end: Inclusive creation date range; either may be None.
+        statuses: Invoice statuses to include (None for all).
+        ref_filter: Case-insensitive substring of inv_ref.
+
+    Returns:
+        (query, params, columns).
+    """
+    table, order = SOURCES[source]
+    known = available_columns(conn, source)
+    columns = list(columns) if columns else known
+    unknown = [c for c in columns if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown column(s) for {source}: {', '.join(unknown)}")
+
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("creating_date >= ?")
+        params.append(datetime.combine(start, datetime.min.time()).strftime('%Y-%m-%d %H:%M:%S'))
+    if end is not None:
+        conditions.append("creating_date <= ?")
+        params.append(datetime.combine(end, datetime.max.time()).strftime('%Y-%m-%d %H:%M:%S'))
+    if statuses:
+        conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if ref_filter.strip():
+        conditions.append("inv_ref LIKE ?")  # LIKE is case-insensitive for ASCII
+        params.append(f"%{ref_filter.strip()}%")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {order}"
+    return query, params, columns
+
+
+def _write_csv(cursor, path: Path, columns: List[str], chunk_rows: int) -> int:
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        while True:
+            chunk = cursor.fetchmany(chunk_rows)
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def _write_xlsx(cursor, path: Path, columns: List[str], chunk_rows: int, title: str) -> int:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    rows, sheet, sheet_rows = 0, None, XLSX_MAX_ROWS
+    while True:
+        chunk = cursor.fetchmany(chunk_rows)
+        if not chunk:
+            break
+        for row in chunk:
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(title if sheet is None else f"{title} ({len(workbook.sheetnames) + 1})")
+                sheet.append(columns)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+        rows += len(chunk)
+    if sheet is None:  # No rows: still a valid workbook with the header
+        workbook.create_sheet(title).append(columns)
+    workbook.save(path)
+    return rows
+
+
+def export_report(db_path: Union[str, Path] = DATABASE_FILE, source: str = "summary", fmt: str = "csv",
+                  columns: Optional[Sequence[str]] = None, start: Optional[date] = None, end: Optional[date] = None,
+                  statuses: Optional[Sequence[str]] = None, ref_filter: str = "",
+                  export_dir: Union[str, Path] = EXPORT_DIRECTORY, chunk_rows: int = EXPORT_CHUNK_ROWS) -> ExportResult:
+    """
+    Streams a report into a file in 'export_dir'. The file is written under a temporary name and renamed
+    when complete, so a failed export leaves nothing behind.
+
+    Args:
+        db_path: The invoice database.
+        source: 'summary' or 'lines'.
+        fmt: 'csv' or 'xlsx'.
+        columns, start, end, statuses, ref_filter: See build_export_query().
+        export_dir: Where the file is written.
+        chunk_rows: Rows fetched per fetchmany() call.
+
+    Returns:
+        The finished export (rows may be 0).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    prune_exports(export_dir)
+    conn = db_utils.get_connection(db_path)
+    query, params, columns = build_export_query(conn, source, columns, start, end, statuses, ref_filter)
+
+    range_part = f"_{start or 'start'}_to_{end or 'end'}" if start or end else ""
+    file_name = f"invoice_report_{'summarized' if source == 'summary' else 'all_rows'}{range_part}.{fmt}"
+    fd, staging = tempfile.mkstemp(dir=export_dir, prefix=".export-", suffix=f".{fmt}")
+    os.close(fd)
+    start_time = time.perf_counter()
+    try:
+        cursor = conn.execute(query, params)
+        if fmt == "csv":
+            rows = _write_csv(cursor, Path(staging), columns, chunk_rows)
+        else:
+            rows = _write_xlsx(cursor, Path(staging), columns, chunk_rows, "Summary" if source == "summary" else "Lines")
+        # Unique per export, so concurrent sessions never overwrite each other's file
+        path = export_dir / f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{Path(staging).stem.lstrip('.')}_{file_name}"
+        os.replace(staging, path)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    print(f"Export: {rows} row(s) to {path.name} ({path.stat().st_size:,} bytes) in {time.perf_counter() - start_time:.2f}s")
+    return ExportResult(path, file_name, FORMATS[fmt], rows, columns)
+
+
+def prune_exports(export_dir: Union[str, Path] = EXPORT_DIRECTORY, max_age_hours: float = EXPORT_MAX_AGE_HOURS) -> int:
+    """Deletes export files older than 'max_age_hours'. Returns the number removed."""
+    export_dir = Path(export_dir)
+    if not export_dir.is_dir():
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for path in export_dir.iterdir():
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass  # Still being written or served
+    return removed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export invoice reports to CSV or XLSX.")
+    parser.add_argument("source", choices=list(SOURCES))
+    parser.add_argument("--db", default=DATABASE_FILE, help="Path to the invoice database.")
+    parser.add_argument("--format", dest="fmt", choices=list(FORMATS), default="csv")
+    parser.add_argument("--columns", help="Comma-separated columns (default: all).")
+    parser.add_argument("--start", type=date.fromisoformat, help="First creation date (YYYY-MM-DD).")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last creation date (YYYY-MM-DD).")
+    parser.add_argument("--status", action="append", help="Status to include (repeatable; default: all).")
+    parser.add_argument("--ref", default="", help="Only invoice references containing this text.")
+    parser.add_argument("--out", default=str(EXPORT_DIRECTORY), help="Output directory.")
+    args = parser.parse_args()
+
+    result = export_report(args.db, args.source, args.fmt, args.columns.split(",") if args.columns else None,
+                           args.start, args.end, args.status, args.ref, args.out)
+    print(f"Wrote {result.rows} row(s) to {result.path}")
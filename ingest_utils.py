@@ -0,0 +1,210 @@
+# ingest_utils.py
+# Loading and bulk ingestion of the invoice JSON files in data/invoices_to_process.
+# - load_invoice_file(): turns one generated JSON into the invoice line rows and its container list
+#   (the same parsing the Verify page uses for its one-file-at-a-time review).
+# - ingest_pending(): validates every pending file and inserts the new invoices in batches, one
+#   transaction per batch with executemany() for lines and containers. invoice_summary is filled by its
+#   triggers inside the same transaction. Files that fail validation are moved to failed_invoices;
+#   files matching an invoice already in the database are left in place for review on the Verify page
+#   (amendments replace data, so they stay a human decision). Every run writes a JSON manifest.
+#
+# Usage (from the project root): python ingest_utils.py [--dry-run] [--batch-size N]
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+import db_utils
+
+DATA_ROOT = Path("data")
+JSON_DIRECTORY = DATA_ROOT / 'invoices_to_process'
+FAILED_DIRECTORY = DATA_ROOT / 'failed_invoices'
+MANIFEST_DIRECTORY = DATA_ROOT / 'ingest_manifests'
+DATABASE_FILE = DATA_ROOT / 'Invoice Record' / 'master_invoice_data.db'
+TABLE_NAME = 'invoices'
+CONTAINER_TABLE_NAME = 'invoice_containers'
+FINAL_COLUMNS = [
+    'inv_no', 'inv_date', 'inv_ref', 'po', 'item', 'description', 'pcs',
+    'sqft', 'pallet_count', 'unit', 'amount', 'net', 'gross', 'cbm',
+    'production_order_no', 'creating_date', 'status'
+]
+LOCAL_TIMEZONE = ZoneInfo("Asia/Phnom_Penh")
+DEFAULT_BATCH_SIZE = 50  # Files per transaction
+
+# Manifest statuses
+ACCEPTED = "accepted"
+QUARANTINED = "quarantined"  # Invalid; moved to FAILED_DIRECTORY
+DEFERRED = "deferred"        # Matches an existing invoice; left for review on the Verify page
+
+
+def load_invoice_file(file_path: Union[str, Path]) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Processes a generated invoice JSON, focusing on 'processed_tables_data', and extracts container info.
+
+    Args:
+        file_path: The JSON file.
+
+    Returns:
+        (line rows with FINAL_COLUMNS, container descriptions).
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    processed_tables = data.get('processed_tables_data')
+    if not processed_tables:
+        if 'aggregated_summary' in data:
+            df = pd.DataFrame([data['aggregated_summary']])
+        else:
+            raise ValueError("File does not contain 'processed_tables_data' or 'aggregated_summary'.")
+    else:
+        all_dfs = [pd.DataFrame(table_data) for table_data in processed_tables.values()]
+        df = pd.concat(all_dfs, ignore_index=True)
+
+    df['inv_no'] = df['inv_no'].apply(lambda x: x if isinstance(x, str) and x.strip() and not x.startswith('0') else pd.NA).ffill()
+    df['inv_ref'] = df['inv_ref'].apply(lambda x: str(x).strip() if isinstance(x, str) and x.strip() else pd.NA).ffill()
+    df['inv_date'] = pd.to_datetime(df['inv_date'], errors='coerce').ffill().dt.strftime('%Y-%m-%d')
+    manual_containers = []
+    if 'container_type' in df.columns:
+        container_str = df['container_type'].dropna().astype(str).unique()
+        if len(container_str) > 0:
+            manual_containers = [c.strip() for c in container_str[0].split(',') if c.strip()]
+    # Use Cambodia timezone for creating_date
+    df['creating_date'] = datetime.now(LOCAL_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+    df['status'] = 'active'
+    for col in df.columns:
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass  # Not a numeric column (errors='ignore' was removed in pandas 3)
+    df = df.reindex(columns=FINAL_COLUMNS)
+    db_utils.bind_invoice_numbers(df) # Quantities go into the INTEGER/REAL columns as numbers
+    return df, manual_containers
+
+
+def _identity(df: pd.DataFrame) -> Tuple[str, str]:
+    """Returns the (inv_ref, inv_no) of a loaded invoice, or raises ValueError if it has neither."""
+    if df.empty:
+        raise ValueError("Processing the file resulted in an empty dataset.")
+    inv_ref = db_utils.sql_value(df['inv_ref'].iloc[0])
+    inv_no = db_utils.sql_value(df['inv_no'].iloc[0])
+    inv_ref = str(inv_ref).strip() if inv_ref is not None else ""
+    inv_no = str(inv_no).strip() if inv_no is not None else ""
+    if not inv_ref and not inv_no:
+        raise ValueError("Could not determine a valid Invoice Ref or Invoice No from the file.")
+    if df['inv_ref'].nunique(dropna=True) > 1:
+        raise ValueError(f"File contains more than one Invoice Ref: {', '.join(map(str, df['inv_ref'].dropna().unique()))}")
+    return inv_ref, inv_no
+
+
+def _existing_keys(conn) -> Tuple[set, set]:
+    """Lower-cased inv_ref and inv_no values already in the database (read from their LOWER() indexes)."""
+    refs = {row[0] for row in conn.execute(f"SELECT DISTINCT LOWER(inv_ref) FROM {TABLE_NAME} WHERE inv_ref != ''")}
+    numbers = {row[0] for row in conn.execute(f"SELECT DISTINCT LOWER(inv_no) FROM {TABLE_NAME} WHERE inv_no != ''")}
+    return refs, numbers
+
+
+def _write_batch(conn, batch: List[Dict[str, Any]]):
+    """Inserts the lines and containers of a batch of invoices in one transaction."""
+    line_sql = f"INSERT INTO {TABLE_NAME} ({', '.join(FINAL_COLUMNS)}) VALUES ({', '.join('?' * len(FINAL_COLUMNS))})"
+    container_sql = f"INSERT INTO {CONTAINER_TABLE_NAME} (inv_ref, container_description) VALUES (?, ?)"
+    lines = [tuple(db_utils.sql_value(v) for v in row) for item in batch for row in item['df'].itertuples(index=False, name=None)]
+    containers = [(item['inv_ref'], container) for item in batch for container in item['containers']]
+    with conn:
+        conn.executemany(line_sql, lines)
+        if containers:
+            conn.executemany(container_sql, containers)
+
+
+def ingest_pending(db_path: Union[str, Path] = DATABASE_FILE, json_dir: Union[str, Path] = JSON_DIRECTORY,
+                   failed_dir: Union[str, Path] = FAILED_DIRECTORY, manifest_dir: Union[str, Path, None] = MANIFEST_DIRECTORY,
+                   batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Validates every pending invoice JSON and inserts the new ones in batched transactions.
+
+    Args:
+        db_path: The invoice database.
+        json_dir: Folder of pending JSON files.
+        failed_dir: Where invalid files are moved.
+        manifest_dir: Where the run's manifest is written (None to skip writing it).
+        batch_size: Invoices per transaction.
+        dry_run: Validate and report only; no database writes or file moves.
+
+    Returns:
+        The manifest: {'started', 'dry_run', 'counts', 'files': [{'file', 'status', ...}]}.
+    """
+    start = time.perf_counter()
+    json_dir, failed_dir = Path(json_dir), Path(failed_dir)
+    conn = db_utils.get_connection(db_path)
+    known_refs, known_numbers = _existing_keys(conn)
+    entries, pending = [], []
+
+    for file_path in sorted(json_dir.glob('*.json')):
+        entry = {'file': file_path.name}
+        try:
+            df, containers = load_invoice_file(file_path)
+            inv_ref, inv_no = _identity(df)
+            entry.update(inv_ref=inv_ref, inv_no=inv_no, lines=len(df), containers=len(containers))
+        except Exception as e:
+            entry.update(status=QUARANTINED, reason=f"{type(e).__name__}: {e}")
+            if not dry_run:
+                failed_dir.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(file_path), str(failed_dir / file_path.name))
+            entries.append(entry)
+            continue
+        # Same exact-match rule as the Verify page; earlier files in this run count as existing too
+        if (inv_ref and inv_ref.lower() in known_refs) or (inv_no and inv_no.lower() in known_numbers):
+            entry.update(status=DEFERRED, reason="Matches an existing invoice; review the amendment on the Verify page.")
+            entries.append(entry)
+            continue
+        known_refs.add(inv_ref.lower())
+        known_numbers.add(inv_no.lower())
+        entry['status'] = ACCEPTED
+        entries.append(entry)
+        pending.append({'path': file_path, 'df': df, 'containers': containers, 'inv_ref': inv_ref})
+
+    if not dry_run:
+        for i in range(0, len(pending), max(1, batch_size)):
+            batch = pending[i:i + max(1, batch_size)]
+            _write_batch(conn, batch)
+            for item in batch:
+                os.remove(item['path'])
+            print(f"Ingest: committed {min(i + len(batch), len(pending))}/{len(pending)} invoice(s)")
+
+    counts = {status: sum(1 for e in entries if e['status'] == status) for status in (ACCEPTED, QUARANTINED, DEFERRED)}
+    manifest = {'started': datetime.now(LOCAL_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'), 'dry_run': dry_run,
+                'seconds': round(time.perf_counter() - start, 3), 'counts': counts, 'files': entries}
+    if manifest_dir is not None and entries:
+        manifest_dir = Path(manifest_dir)
+        manifest_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = manifest_dir / f"ingest_{datetime.now(LOCAL_TIMEZONE).strftime('%Y-%m-%d_%H-%M-%S')}{'_dry_run' if dry_run else ''}.json"
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        manifest['path'] = str(manifest_path)
+    print(f"Ingest: {counts[ACCEPTED]} accepted, {counts[QUARANTINED]} quarantined, {counts[DEFERRED]} deferred in {manifest['seconds']}s")
+    return manifest
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-ingest the pending invoice JSON files.")
+    parser.add_argument("--db", default=str(DATABASE_FILE), help="Path to the invoice database.")
+    parser.add_argument("--json-dir", default=str(JSON_DIRECTORY), help="Folder of pending JSON files.")
+    parser.add_argument("--failed-dir", default=str(FAILED_DIRECTORY), help="Where invalid files are moved.")
+    parser.add_argument("--manifest-dir", default=str(MANIFEST_DIRECTORY), help="Where the run manifest is written.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Invoices per transaction.")
+    parser.add_argument("--dry-run", action="store_true", help="Validate only; write nothing.")
+    args = parser.parse_args()
+
+    result = ingest_pending(args.db, args.json_dir, args.failed_dir, args.manifest_dir, args.batch_size, args.dry_run)
+    for entry in result['files']:
+        print(f"  {entry['status']:<11} {entry['file']}" + (f"  ({entry['reason']})" if 'reason' in entry else ""))
+    if 'path' in result:
+        print(f"Manifest: {result['path']}")
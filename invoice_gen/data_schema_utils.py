@@ -0,0 +1,91 @@
+# data_schema_utils.py
+# Declared numeric schema for invoice JSON data. Numeric columns of the per-table data
+# ('processed_tables_data' for generate_invoice.py, 'raw_data' for hybrid_generate_invoice.py) and
+# the numeric fields of the aggregation results are converted once, in bulk, right after loading,
+# so the row writers receive typed values instead of re-parsing strings cell by cell.
+
+from decimal import Decimal
+from typing import Dict, Any, List, FrozenSet
+
+# Sections holding tables as {table_id: {column_key: [values...]}}
+TABLE_SECTIONS = ("processed_tables_data", "raw_data")
+
+# Table columns that hold numbers (possibly written as strings, e.g. "467.8306")
+NUMERIC_TABLE_COLUMNS: FrozenSet[str] = frozenset({
+    "pcs", "sqft", "net", "gross", "unit", "price", "amount", "cbm", "pallet_count",
+})
+
+# Aggregation sections holding {row_key: {field: value}} and their numeric fields
+NUMERIC_AGGREGATION_FIELDS: Dict[str, FrozenSet[str]] = {
+    "standard_aggregation_results": frozenset({"sqft_sum", "amount_sum"}),
+    "custom_aggregation_results": frozenset({"sqft_sum", "amount_sum"}),
+    "final_fob_compounded_result": frozenset({"total_sqft", "total_amount"}),
+}
+
+
+def to_numeric(value: Any, strip_thousands: bool = False) -> Any:
+    """
+    Converts a value to int or float if possible; anything that isn't a number is returned unchanged.
+
+    Args:
+        value: The value to convert.
+        strip_thousands: Treat commas as thousands separators ("1,234.5"). Only safe for
+                         columns known to be numeric, since text like PO lists may contain commas.
+    """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        text = value.replace(',', '') if strip_thousands else value
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                return value # Not a number; keep the original text
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def convert_numeric_column(values: List[Any]) -> List[Any]:
+    """Returns a declared-numeric column with every entry passed through to_numeric."""
+    return [to_numeric(v, strip_thousands=True) for v in values]
+
+
+def apply_numeric_schema(invoice_data: Dict[str, Any]) -> int:
+    """
+    Converts the numeric columns/fields declared above in place.
+
+    Args:
+        invoice_data: The loaded invoice data dictionary.
+
+    Returns:
+        The number of columns and aggregation rows that were converted.
+    """
+    converted = 0
+    for section in TABLE_SECTIONS:
+        tables = invoice_data.get(section)
+        if not isinstance(tables, dict):
+            continue
+        for table_data in tables.values():
+            if not isinstance(table_data, dict):
+                continue
+            for column_key in NUMERIC_TABLE_COLUMNS.intersection(table_data):
+                if isinstance(table_data[column_key], list):
+                    table_data[column_key] = convert_numeric_column(table_data[column_key])
+                    converted += 1
+
+    for section, fields in NUMERIC_AGGREGATION_FIELDS.items():
+        rows = invoice_data.get(section)
+        if not isinstance(rows, dict):
+            continue
+        for value_dict in rows.values():
+            if not isinstance(value_dict, dict):
+                continue
+            for field in fields.intersection(value_dict):
+                value_dict[field] = to_numeric(value_dict[field], strip_thousands=True)
+            converted += 1
+
+    print(f"Numeric schema applied: {converted} column(s)/aggregation row(s) typed.")
+    return converted
@@ -0,0 +1,288 @@
+# fast_export_utils.py
+# Template-free fast export of packing-list data for internal consumers (e.g. the warehouse).
+# Writes the 'processed_tables_data' tables with per-table totals and a grand total straight to a
+# write-only .xlsx and/or a .csv. Columns, header labels, number formats and the summed columns come
+# from the config's packing-list sheet (column ids, 'mappings.data_map', 'footer_configurations'),
+# but no template is loaded and nothing is merged or styled beyond a bold header and number formats.
+# Rows are generated lazily and streamed to the writers, so memory use does not grow with the row count.
+#
+# Usage: python fast_export_utils.py data/JF.json [-t TEMPLATE] [-c config] [-o JF_packing.xlsx] [--csv JF_packing.csv] [--sheet "Packing list"]
+
+import csv
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterator, Tuple, Union
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import layout_plan_utils
+import template_registry_utils
+from data_schema_utils import NUMERIC_TABLE_COLUMNS, to_numeric
+
+TABLE_COLUMN_HEADER = "Table"
+ROW_KIND_DATA = "data"
+ROW_KIND_TOTAL = "total"
+ROW_KIND_GRAND_TOTAL = "grand_total"
+
+
+@dataclass(frozen=True)
+class ExportColumn:
+    """One exported column: the config column id, its header label and the data key it is read from."""
+    column_id: str
+    header: str
+    data_key: str
+    number_format: Optional[str]
+    summed: bool
+    fallback: Any = None
+
+
+def find_packing_list_sheet(config: Dict[str, Any]) -> Optional[str]:
+    """Returns the first sheet whose 'sheet_data_map' entry is 'processed_tables_multi', else None."""
+    for sheet_name, data_source in config.get('sheet_data_map', {}).items():
+        if data_source == "processed_tables_multi" and sheet_name in config.get('data_mapping', {}):
+            return sheet_name
+    return None
+
+
+def build_export_columns(config: Dict[str, Any], sheet_name: str) -> List[ExportColumn]:
+    """
+    Derives the exported columns from a sheet's config, in the sheet's left-to-right order.
+    Only header columns that a 'data_map' entry fills from the table data are exported.
+
+    Args:
+        config: The loaded *_config.json.
+        sheet_name: The sheet whose layout defines the columns.
+
+    Returns:
+        The export columns.
+    """
+    sheet_section = config['data_mapping'][sheet_name]
+    sheet_plan = layout_plan_utils.get_layout_plan(config).get(sheet_name)
+    data_map = (sheet_section.get('mappings') or {}).get('data_map') or {}
+    footer_config = sheet_section.get("footer_configurations") or {}
+    column_styles = (sheet_section.get("styling") or {}).get("column_id_styles") or {}
+    number_formats = footer_config.get("number_formats") or {}
+    header_text_by_id = {cell['id']: str(cell.get('text') or cell['id']).replace("\n", " ")
+                         for cell in sheet_section.get('header_to_write', []) if cell.get('id')}
+
+    columns = []
+    for col_idx in sorted(sheet_plan.idx_to_id_map):
+        column_id = sheet_plan.idx_to_id_map[col_idx]
+        data_key = next((key for key, rule in data_map.items() if isinstance(rule, dict) and rule.get('id') == column_id), None)
+        if not data_key:
+            continue
+        fallback = data_map[data_key].get('fallback_on_none')
+        number_format = (column_styles.get(column_id) or {}).get("number_format") or (number_formats.get(column_id) or {}).get("number_format")
+        columns.append(ExportColumn(column_id, header_text_by_id[column_id], data_key, number_format,
+                                    column_id in footer_config.get("sum_column_ids", []), fallback))
+    return columns
+
+
+def _pallet_text(pallet_count: int) -> str:
+    return f"{pallet_count} PALLET{'S' if pallet_count != 1 else ''}"
+
+
+def _add_to_total(total: Decimal, value: Union[int, float]) -> Decimal:
+    """Adds a cell value to a running total exactly (summing floats directly accumulates binary error)."""
+    return total + Decimal(value if isinstance(value, int) else repr(value))
+
+
+def _total_value(total: Optional[Decimal]) -> Union[int, float, None]:
+    if total is None or not total.is_finite():
+        return None if total is None else float(total)
+    return int(total) if total == total.to_integral_value() else float(total)
+
+
+def _total_row(columns: List[ExportColumn], totals: List[Optional[Decimal]], label: str, label_index: int,
+               pallet_count: int, pallet_index: Optional[int]) -> List[Any]:
+    """Builds a total row: sums in the summed columns, the label and the pallet count text where the footer puts them."""
+    values = [_total_value(total) for total in totals]
+    if values[label_index] is None:
+        values[label_index] = label
+    if pallet_index is not None and pallet_count > 0 and values[pallet_index] is None:
+        values[pallet_index] = _pallet_text(pallet_count)
+    return values
+
+
+def iter_export_rows(invoice_data: Dict[str, Any], columns: List[ExportColumn],
+                     footer_config: Optional[Dict[str, Any]] = None,
+                     grand_total_text: str = "TOTAL OF:") -> Iterator[Tuple[str, List[Any]]]:
+    """
+    Yields the export rows one at a time: each table's data rows, then its total row, then a grand
+    total row if there is more than one table. Tables are ordered the same way generate_invoice.py orders them.
+
+    Args:
+        invoice_data: The invoice JSON (only 'processed_tables_data' is used).
+        columns: The export columns from build_export_columns().
+        footer_config: The sheet's 'footer_configurations'; places the total text and pallet count like the footer does.
+        grand_total_text: Label of the grand total row.
+
+    Yields:
+        (row kind, [table key, value per column]) with row kind 'data', 'total' or 'grand_total'.
+    """
+    footer_config = footer_config or {}
+    column_index_by_id = {column.column_id: c for c, column in enumerate(columns)}
+    label_index = column_index_by_id.get(footer_config.get("total_text_column_id"), 0)
+    pallet_index = column_index_by_id.get(footer_config.get("pallet_count_column_id"))
+    total_text = footer_config.get("total_text", "TOTAL:")
+
+    all_tables_data = invoice_data.get('processed_tables_data') or {}
+    table_keys = sorted(all_tables_data.keys(), key=lambda x: int(x) if str(x).isdigit() else float('inf'))
+    grand_totals = [Decimal(0) if column.summed else None for column in columns]
+    grand_pallets = 0
+    num_tables = 0
+
+    for table_key in table_keys:
+        table_data = all_tables_data.get(table_key)
+        if not isinstance(table_data, dict) or not table_data:
+            continue
+        num_tables += 1
+        column_lists = [table_data.get(column.data_key) or [] for column in columns]
+        numeric = [column.data_key in NUMERIC_TABLE_COLUMNS for column in columns]
+        num_rows = max((len(v) for v in table_data.values() if isinstance(v, list)), default=0)
+        totals = [Decimal(0) if column.summed else None for column in columns]
+
+        for i in range(num_rows):
+            values = []
+            for c, values_list in enumerate(column_lists):
+                value = values_list[i] if i < len(values_list) else None
+                if value is None:
+                    value = columns[c].fallback
+                elif numeric[c]:
+                    value = to_numeric(value, strip_thousands=True)
+                if totals[c] is not None and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[c] = _add_to_total(totals[c], value)
+                values.append(value)
+            yield ROW_KIND_DATA, [table_key] + values
+
+        pallets = 0
+        for count in table_data.get("pallet_count") or []:
+            try:
+                pallets += int(count)
+            except (ValueError, TypeError):
+                pass # Ignore non-integer counts, as generate_invoice.py does
+        yield ROW_KIND_TOTAL, [table_key] + _total_row(columns, totals, total_text, label_index, pallets, pallet_index)
+        grand_pallets += pallets
+        for c, total in enumerate(totals):
+            if total is not None:
+                grand_totals[c] += total
+
+    if num_tables > 1:
+        yield ROW_KIND_GRAND_TOTAL, [None] + _total_row(columns, grand_totals, grand_total_text, label_index,
+                                                        grand_pallets, pallet_index)
+
+
+def export_packing_list(invoice_data: Dict[str, Any], config: Dict[str, Any],
+                        xlsx_path: Optional[Union[str, Path]] = None, csv_path: Optional[Union[str, Path]] = None,
+                        sheet_name: Optional[str] = None) -> int:
+    """
+    Streams the packing-list tables to a write-only workbook and/or a CSV file in a single pass.
+
+    Args:
+        invoice_data: The invoice JSON (only 'processed_tables_data' is used).
+        config: The loaded *_config.json.
+        xlsx_path: Where to write the .xlsx (optional).
+        csv_path: Where to write the .csv (optional).
+        sheet_name: The config sheet that defines the columns. Defaults to the multi-table (packing list) sheet.
+
+    Returns:
+        The number of data rows written.
+    """
+    sheet_name = sheet_name or find_packing_list_sheet(config)
+    if not sheet_name or sheet_name not in config.get('data_mapping', {}):
+        raise ValueError("No packing-list sheet ('processed_tables_multi') found in the config; pass sheet_name.")
+    if not xlsx_path and not csv_path:
+        raise ValueError("Nothing to write: pass xlsx_path and/or csv_path.")
+
+    columns = build_export_columns(config, sheet_name)
+    footer_config = config['data_mapping'][sheet_name].get("footer_configurations") or {}
+    header_row = [TABLE_COLUMN_HEADER] + [column.header for column in columns]
+    print(f"--- Fast export of '{sheet_name}' ({len(columns)} columns) ---")
+
+    workbook = worksheet = None
+    bold_font = Font(bold=True)
+    if xlsx_path:
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(sheet_name[:31])
+        header_cells = []
+        for text in header_row:
+            cell = WriteOnlyCell(worksheet, value=text)
+            cell.font = bold_font
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+
+    csv_file = open(csv_path, "w", newline="", encoding="utf-8-sig") if csv_path else None # BOM so Excel detects UTF-8
+    try:
+        csv_writer = csv.writer(csv_file) if csv_file else None
+        if csv_writer:
+            csv_writer.writerow(header_row)
+
+        data_rows = 0
+        for row_kind, values in iter_export_rows(invoice_data, columns, footer_config):
+            if row_kind == ROW_KIND_DATA:
+                data_rows += 1
+            if csv_writer:
+                csv_writer.writerow(["" if v is None else v for v in values])
+            if worksheet is not None:
+                row_cells = []
+                for c, value in enumerate(values):
+                    number_format = columns[c - 1].number_format if c > 0 else None
+                    if row_kind == ROW_KIND_DATA and not (number_format and isinstance(value, (int, float))):
+                        row_cells.append(value) # Plain values stay plain: cheapest path in write-only mode
+                        continue
+                    cell = WriteOnlyCell(worksheet, value=value)
+                    if number_format and isinstance(value, (int, float)):
+                        cell.number_format = number_format
+                    if row_kind != ROW_KIND_DATA:
+                        cell.font = bold_font
+                    row_cells.append(cell)
+                worksheet.append(row_cells)
+    finally:
+        if csv_file:
+            csv_file.close()
+
+    if workbook is not None:
+        Path(xlsx_path).parent.mkdir(parents=True, exist_ok=True)
+        workbook.save(xlsx_path)
+        print(f"  -> Wrote '{xlsx_path}'.")
+    if csv_path:
+        print(f"  -> Wrote '{csv_path}'.")
+    print(f"--- Fast export complete: {data_rows} data row(s) ---")
+    return data_rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export packing-list data to .xlsx/.csv without the customer template.")
+    parser.add_argument("input_data_file", help="Path to the input JSON data file. Filename base determines the config.")
+    parser.add_argument("-o", "--output", help="Path for the .xlsx file.")
+    parser.add_argument("--csv", help="Path for the .csv file.")
+    parser.add_argument("-t", "--templatedir", default="./TEMPLATE", help="Directory containing template Excel files.")
+    parser.add_argument("-c", "--configdir", default="./config", help="Directory containing configuration JSON files.")
+    parser.add_argument("--config", help="Explicit config file (overrides the template registry lookup).")
+    parser.add_argument("--sheet", help="Config sheet that defines the columns (default: the packing-list sheet).")
+    args = parser.parse_args()
+
+    data_path = Path(args.input_data_file)
+    if args.config:
+        config_path = Path(args.config)
+    else:
+        # Same lookup as the generators: the startup template registry
+        pair = template_registry_utils.get_registry(args.templatedir, args.configdir).resolve(data_path.stem)
+        if pair is None:
+            raise SystemExit(f"No template/config pair found for '{data_path.stem}'.")
+        config_path = pair.config
+    if not config_path.is_file():
+        raise SystemExit(f"Config not found: {config_path}")
+
+    with open(config_path, "r", encoding="utf-8") as f:
+        export_config = json.load(f)
+    with open(data_path, "r", encoding="utf-8") as f:
+        export_data = json.load(f)
+    output_path = args.output or (None if args.csv else data_path.with_name(f"{data_path.stem}_packing.xlsx"))
+    export_packing_list(export_data, export_config, xlsx_path=output_path, csv_path=args.csv, sheet_name=args.sheet)
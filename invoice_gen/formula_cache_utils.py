@@ -0,0 +1,321 @@
+# formula_cache_utils.py
+# Cached results for the formulas generate_invoice.py writes (footer/grand-total SUMs, unit price and
+# amount formulas, cross-sheet references such as =Invoice!H5). openpyxl saves formulas without a
+# value, so data_only readers (verification, re-ingestion, the Verify page) see None until Excel
+# recalculates. Here the formulas are evaluated in Python from the in-memory workbook and, after the
+# workbook is saved, each formula cell's <v> is filled in the sheet XML. The formulas themselves are
+# kept and the workbook stays flagged fullCalcOnLoad, so Excel still recalculates on open.
+# Formulas outside the supported subset (SUM over ranges, + - * / between references and numbers,
+# single references) are left without a cached value rather than given a guessed one.
+#
+# Usage: python formula_cache_utils.py OUTPUT.xlsx [OUTPUT2.xlsx ...]
+
+import re
+import zipfile
+import datetime
+from decimal import Decimal
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape, unescape
+
+import openpyxl
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.datetime import to_excel
+
+import workbook_save_utils
+import xml_splice_utils
+from html_preview_utils import evaluate_formula, to_numeric_value
+
+UNSUPPORTED_RESULT = "#VALUE!"  # What evaluate_formula returns for anything it cannot evaluate
+CIRCULAR_RESULT = "#REF!"
+UNKNOWN_RESULT = object()  # Marks a formula whose cached value was cleared by update_dependent_cached_values
+
+# A reference, optionally sheet-qualified ('Packing list'!A1, Invoice!A1) and optionally a range (A1:B2)
+REFERENCE_PATTERN = re.compile(
+    r"(?:(?:'((?:[^']|'')+)'|([A-Za-z_][\w.]*))!)?\$?([A-Z]{1,3})\$?(\d+)(?::\$?([A-Z]{1,3})\$?(\d+))?"
+)
+# A formula cell in sheet XML, with or without a (possibly empty) cached value
+FORMULA_CELL_XML_PATTERN = re.compile(
+    r'<c\b(?P<attrs>[^>]*?\br="(?P<ref>[A-Z]{1,3}\d+)"[^>]*)>(?P<formula><f\b[^>]*(?:/>|>.*?</f>))(?:<v\s*/>|<v>.*?</v>)?</c>',
+    re.DOTALL,
+)
+TYPE_ATTR_PATTERN = re.compile(r'\s+t="[^"]*"')
+
+
+def _formula_operand(value: Any) -> Any:
+    """Returns a cell value as Excel sees it in formulas: dates as serial numbers, Decimals as floats."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return to_excel(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class _SheetValues:
+    """Read-only view of one sheet's evaluated values, in the (row, column) -> value form evaluate_formula expects."""
+
+    def __init__(self, evaluator: "FormulaEvaluator", sheet_title: str):
+        self.evaluator, self.sheet_title = evaluator, sheet_title
+
+    def get(self, key: Tuple[int, int], default: Any = None) -> Any:
+        value = self.evaluator.value(self.sheet_title, key[0], key[1])
+        return default if value is None else value
+
+
+class FormulaEvaluator:
+    """Evaluates a workbook's formulas on demand, following references across sheets, with memoisation."""
+
+    def __init__(self, workbook: openpyxl.Workbook):
+        self.workbook = workbook
+        self._raw: Dict[str, Dict[Tuple[int, int], Any]] = {}
+        self._values: Dict[Tuple[str, int, int], Any] = {}
+        self._in_progress = set()
+
+    def _raw_values(self, sheet_title: str) -> Dict[Tuple[int, int], Any]:
+        if sheet_title not in self._raw:
+            worksheet = self.workbook[sheet_title]
+            self._raw[sheet_title] = {(cell.row, cell.column): _formula_operand(cell.value)
+                                      for row in worksheet.iter_rows() for cell in row if cell.value is not None}
+        return self._raw[sheet_title]
+
+    def value(self, sheet_title: str, row: int, col: int) -> Any:
+        """Returns a cell's value, evaluating it first if it holds a formula."""
+        key = (sheet_title, row, col)
+        if key in self._values:
+            return self._values[key]
+        if sheet_title not in self.workbook.sheetnames:
+            return None
+        raw_value = self._raw_values(sheet_title).get((row, col))
+        if not (isinstance(raw_value, str) and raw_value.startswith("=")):
+            return raw_value
+        if key in self._in_progress:
+            return CIRCULAR_RESULT
+        self._in_progress.add(key)
+        try:
+            result = self.evaluate(sheet_title, raw_value)
+        finally:
+            self._in_progress.discard(key)
+        self._values[key] = result
+        return result
+
+    def evaluate(self, sheet_title: str, formula: str) -> Any:
+        """
+        Evaluates one formula in the context of a sheet.
+
+        Returns:
+            The value, an Excel error string, or UNSUPPORTED_RESULT.
+        """
+        expression = formula.lstrip("=").strip()
+        single = REFERENCE_PATTERN.fullmatch(expression)
+        if single and not single.group(5):
+            target_sheet = self._reference_sheet(single, sheet_title)
+            target_value = self.value(target_sheet, int(single.group(4)), column_index_from_string(single.group(3)))
+            return 0 if target_value is None else target_value # Excel shows a reference to a blank cell as 0
+
+        def inline_other_sheet(match: re.Match) -> str:
+            if not (match.group(1) or match.group(2)):
+                return match.group(0)
+            if match.group(5):
+                raise ValueError("cross-sheet ranges are not supported")
+            target_sheet = self._reference_sheet(match, sheet_title)
+            return repr(to_numeric_value(self.value(target_sheet, int(match.group(4)), column_index_from_string(match.group(3)))))
+
+        try:
+            expression = REFERENCE_PATTERN.sub(inline_other_sheet, expression)
+        except ValueError:
+            return UNSUPPORTED_RESULT
+        return evaluate_formula(expression, _SheetValues(self, sheet_title))
+
+    @staticmethod
+    def _reference_sheet(match: re.Match, default_sheet: str) -> str:
+        if match.group(1):
+            return match.group(1).replace("''", "'")
+        return match.group(2) or default_sheet
+
+
+def compute_formula_values(workbook: openpyxl.Workbook) -> Dict[str, Dict[str, Any]]:
+    """
+    Evaluates every supported formula in a workbook.
+
+    Args:
+        workbook: The generated workbook, before or after saving.
+
+    Returns:
+        {sheet title: {cell coordinate: value}} for the formulas that could be evaluated.
+    """
+    evaluator = FormulaEvaluator(workbook)
+    results: Dict[str, Dict[str, Any]] = {}
+    for worksheet in workbook.worksheets:
+        sheet_results = {}
+        for row in worksheet.iter_rows():
+            for cell in row:
+                if isinstance(cell.value, str) and cell.value.startswith("="):
+                    value = evaluator.value(worksheet.title, cell.row, cell.column)
+                    if value not in (UNSUPPORTED_RESULT, CIRCULAR_RESULT):
+                        sheet_results[cell.coordinate] = value
+        results[worksheet.title] = sheet_results
+    return results
+
+
+def cached_value_xml(attrs: str, formula_xml: str, value: Any) -> str:
+    """Builds a formula cell's XML carrying `value` as its cached result (type attribute set to match)."""
+    attrs = TYPE_ATTR_PATTERN.sub("", attrs)
+    if isinstance(value, bool):
+        return f'<c{attrs} t="b">{formula_xml}<v>{int(value)}</v></c>'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = to_excel(value)
+    if isinstance(value, (int, float)):
+        return f'<c{attrs}>{formula_xml}<v>{value!r}</v></c>'
+    text = str(value)
+    type_attr = "e" if text in ("#DIV/0!", "#VALUE!", "#REF!", "#N/A", "#NAME?", "#NUM!", "#NULL!") else "str"
+    return f'<c{attrs} t="{type_attr}">{formula_xml}<v>{escape(text)}</v></c>'
+
+
+def fill_sheet_xml(sheet_xml: str, sheet_values: Dict[str, Any]) -> Tuple[str, int]:
+    """Writes the cached values into one sheet part. Returns the new XML and the number of cells filled."""
+    filled = 0
+
+    def replace(match: re.Match) -> str:
+        nonlocal filled
+        if match.group("ref") not in sheet_values:
+            return match.group(0)
+        filled += 1
+        return cached_value_xml(match.group("attrs"), match.group("formula"), sheet_values[match.group("ref")])
+
+    return FORMULA_CELL_XML_PATTERN.sub(replace, sheet_xml), filled
+
+
+def write_cached_values(xlsx_path: Union[str, Path], values: Dict[str, Dict[str, Any]],
+                        compress_level: Optional[int] = None) -> int:
+    """
+    Rewrites a saved workbook in place with cached formula results. Only sheet parts with
+    formulas are rewritten; every other zip part is copied byte for byte.
+
+    Args:
+        xlsx_path: The saved workbook.
+        values: The output of compute_formula_values().
+        compress_level: Deflate level for the rewritten parts (see workbook_save_utils).
+
+    Returns:
+        The number of formula cells that received a cached value.
+    """
+    xlsx_path = Path(xlsx_path)
+    temp_path = xlsx_path.with_name(xlsx_path.name + ".tmp")
+    filled_total = 0
+    with zipfile.ZipFile(xlsx_path, "r") as zin:
+        patched_parts: Dict[str, bytes] = {}
+        for sheet_title, sheet_values in values.items():
+            sheet_part = xml_splice_utils.resolve_sheet_part(zin, sheet_title)
+            if not sheet_part or not sheet_values:
+                continue
+            sheet_xml, filled = fill_sheet_xml(zin.read(sheet_part).decode("utf-8"), sheet_values)
+            if filled:
+                patched_parts[sheet_part] = sheet_xml.encode("utf-8")
+                filled_total += filled
+        if not patched_parts:
+            return 0
+        settings = workbook_save_utils.zip_settings(compress_level)
+        with zipfile.ZipFile(temp_path, "w", **settings) as zout:
+            for info in zin.infolist():
+                if info.filename in patched_parts:
+                    zout.writestr(zipfile.ZipInfo(info.filename, date_time=info.date_time), patched_parts[info.filename],
+                                  compress_type=settings["compression"], compresslevel=settings.get("compresslevel"))
+                else:
+                    zout.writestr(info, zin.read(info.filename), compress_type=info.compress_type)
+    temp_path.replace(xlsx_path)
+    return filled_total
+
+
+def cache_formula_results(workbook: openpyxl.Workbook, xlsx_path: Union[str, Path],
+                          compress_level: Optional[int] = None) -> int:
+    """
+    Evaluates the workbook's formulas and stores the results in the saved file at `xlsx_path`.
+
+    Returns:
+        The number of formula cells that received a cached value.
+    """
+    print("--- Caching formula results ---")
+    values = compute_formula_values(workbook)
+    total_formulas = sum(len(v) for v in values.values())
+    filled = write_cached_values(xlsx_path, values, compress_level)
+    print(f"--- Cached {filled} formula result(s) ({total_formulas} evaluated) ---")
+    return filled
+
+
+def has_cached_values(sheet_xml: str) -> bool:
+    """True if any formula cell in the sheet part carries a non-empty cached value."""
+    return re.search(r"(?:</f>|<f\b[^>]*/>)<v>", sheet_xml) is not None
+
+
+def sheet_titles(zip_file: zipfile.ZipFile) -> List[str]:
+    """Returns the sheet titles of a saved workbook, in workbook order."""
+    workbook_xml = ET.fromstring(zip_file.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in workbook_xml.iter(f"{{{xml_splice_utils.NS_MAIN}}}sheet")]
+
+
+def _reads_changed_cell(reference: re.Match, sheet_title: str, changed_cells: Dict[Tuple[str, str], Any]) -> bool:
+    """True if a (possibly ranged) reference covers one of the changed cells."""
+    target_sheet = FormulaEvaluator._reference_sheet(reference, sheet_title)
+    min_col, max_col = sorted((column_index_from_string(reference.group(3)),
+                               column_index_from_string(reference.group(5) or reference.group(3))))
+    min_row, max_row = sorted((int(reference.group(4)), int(reference.group(6) or reference.group(4))))
+    for changed_sheet, coordinate in changed_cells:
+        if changed_sheet != target_sheet:
+            continue
+        col_letters, row_num = coordinate_from_string(coordinate)
+        if min_row <= row_num <= max_row and min_col <= column_index_from_string(col_letters) <= max_col:
+            return True
+    return False
+
+
+def update_dependent_cached_values(sheet_xml: str, sheet_title: str,
+                                   changed_cells: Dict[Tuple[str, str], Any]) -> Tuple[str, int]:
+    """
+    Keeps cached results consistent after cells were rewritten in place (header patch). Formulas that are a
+    single reference to a changed cell take its new value; other formulas reading a changed cell lose their
+    cached value (Excel still recalculates them on open). Every formula updated here is added to
+    `changed_cells`, so calling this again for all sheets until nothing changes reaches indirect dependents.
+
+    Args:
+        sheet_xml: The sheet part to update.
+        sheet_title: The sheet's title, for unqualified references.
+        changed_cells: {(sheet title, coordinate): new value}, updated in place.
+
+    Returns:
+        The new XML and the number of formula cells updated.
+    """
+    updated = 0
+
+    def replace(match: re.Match) -> str:
+        nonlocal updated
+        if (sheet_title, match.group("ref")) in changed_cells:
+            return match.group(0)
+        formula_xml = match.group("formula")
+        formula_text = unescape(re.sub(r"^<f\b[^>]*>|</f>$", "", formula_xml)).strip()
+        if not any(_reads_changed_cell(ref, sheet_title, changed_cells) for ref in REFERENCE_PATTERN.finditer(formula_text)):
+            return match.group(0)
+        updated += 1
+        single = REFERENCE_PATTERN.fullmatch(formula_text)
+        new_value = UNKNOWN_RESULT
+        if single and not single.group(5):
+            new_value = changed_cells[(FormulaEvaluator._reference_sheet(single, sheet_title), f"{single.group(3)}{single.group(4)}")]
+        changed_cells[(sheet_title, match.group("ref"))] = new_value
+        if new_value is UNKNOWN_RESULT:
+            return f'<c{TYPE_ATTR_PATTERN.sub("", match.group("attrs"))}>{formula_xml}<v /></c>'
+        return cached_value_xml(match.group("attrs"), formula_xml, 0 if new_value is None else new_value)
+
+    return FORMULA_CELL_XML_PATTERN.sub(replace, sheet_xml), updated
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Store cached formula results in generated invoice workbooks.")
+    parser.add_argument("workbooks", nargs="+", help="Workbooks produced by generate_invoice.py (rewritten in place).")
+    args = parser.parse_args()
+
+    for workbook_path in args.workbooks:
+        print(f"Processing '{workbook_path}'...")
+        cache_formula_results(openpyxl.load_workbook(workbook_path), workbook_path)
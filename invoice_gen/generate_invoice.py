@@ -33,6 +33,13 @@ try:
     # Ensure invoice_utils.py corresponds to the latest version with pallet order updates
     import invoice_utils
     import merge_utils # <-- Import the new merge utility module
+    import layout_plan_utils # Compiled, cached per-sheet layout plans
+    import template_index_utils # Precomputed template facts (placeholders, merges, ...)
+    import header_patch_utils # Records header cells so invoice-level edits can be patched in place
+    import data_schema_utils # Declared numeric columns, typed once at load time
+    import template_registry_utils # Startup index of template/config pairs
+    import formula_cache_utils # Cached results for the generated formulas
+    import workbook_save_utils # Save with a configurable deflate level
     print("Successfully imported invoice_utils and merge_utils.")
 except ImportError as import_err:
     print("------------------------------------------------------")
@@ -53,6 +60,7 @@ def derive_paths(input_data_path_str: str, template_dir_str: str, config_dir_str
     Checks if template/config paths are valid directories.
     Assumes data file is named like TEMPLATE_NAME.xxx or TEMPLATE_NAME_data.xxx
     Attempts prefix matching if exact match is not found.
+    Pairs are looked up in the startup template registry (template_registry_utils) instead of probed on disk.
     """
     print(f"Deriving paths from input: {input_data_path_str}")
     try:
@@ -64,64 +72,18 @@ def derive_paths(input_data_path_str: str, template_dir_str: str, config_dir_str
         if not template_dir.is_dir(): print(f"Error: Template directory not found: {template_dir}"); return None
         if not config_dir.is_dir(): print(f"Error: Config directory not found: {config_dir}"); return None
 
-        base_name = input_data_path.stem
-        template_name_part = base_name
-        suffixes_to_remove = ['_data', '_input', '_pkl']
-        prefixes_to_remove = ['data_']
-
-        for suffix in suffixes_to_remove:
-            if base_name.lower().endswith(suffix):
-                template_name_part = base_name[:-len(suffix)]
-                break
-        else: # Only check prefixes if no suffix was removed
-            for prefix in prefixes_to_remove:
-                if base_name.lower().startswith(prefix):
-                    template_name_part = base_name[len(prefix):]
-                    break
-
+        template_name_part = template_registry_utils.template_name_part(input_data_path.stem)
         if not template_name_part:
-            print(f"Error: Could not derive template name part from: '{base_name}'")
+            print(f"Error: Could not derive template name part from: '{input_data_path.stem}'")
             return None
         print(f"Derived initial template name part: '{template_name_part}'")
 
-        # --- Attempt 1: Exact Match ---
-        exact_template_filename = f"{template_name_part}.xlsx"
-        exact_config_filename = f"{template_name_part}_config.json"
-        exact_template_path = template_dir / exact_template_filename
-        exact_config_path = config_dir / exact_config_filename
-        print(f"Checking for exact match: Template='{exact_template_path}', Config='{exact_config_path}'")
-
-        if exact_template_path.is_file() and exact_config_path.is_file():
-            print("Found exact match for template and config.")
-            return {"data": input_data_path, "template": exact_template_path, "config": exact_config_path}
-        else:
-            print("Exact match not found. Attempting prefix matching...")
-
-            # --- Attempt 2: Prefix Match ---
-            prefix_match = re.match(r'^([a-zA-Z]+)', template_name_part) # Extract leading letters
-            if prefix_match:
-                prefix = prefix_match.group(1)
-                print(f"Extracted prefix: '{prefix}'")
-                prefix_template_filename = f"{prefix}.xlsx"
-                prefix_config_filename = f"{prefix}_config.json"
-                prefix_template_path = template_dir / prefix_template_filename
-                prefix_config_path = config_dir / prefix_config_filename
-                print(f"Checking for prefix match: Template='{prefix_template_path}', Config='{prefix_config_path}'")
-
-                if prefix_template_path.is_file() and prefix_config_path.is_file():
-                    print("Found prefix match for template and config.")
-                    return {"data": input_data_path, "template": prefix_template_path, "config": prefix_config_path}
-                else:
-                    print("Prefix match not found.")
-            else:
-                print("Could not extract a letter-based prefix.")
-
-            # --- No Match Found ---
+        pair = template_registry_utils.get_registry(template_dir, config_dir).resolve(template_name_part)
+        if pair is None:
             print(f"Error: Could not find matching template/config files using exact ('{template_name_part}') or prefix methods.")
-            # Report specific missing files based on the exact match attempt
-            if not exact_template_path.is_file(): print(f"Error: Template file not found: {exact_template_path}")
-            if not exact_config_path.is_file(): print(f"Error: Configuration file not found: {exact_config_path}")
             return None
+        print(f"Found match for template and config: '{pair.name}'")
+        return {"data": input_data_path, "template": pair.template, "config": pair.config}
 
     except Exception as e:
         print(f"Error deriving file paths: {e}")
@@ -285,6 +247,9 @@ def load_data(data_path: Path) -> Optional[Dict[str, Any]]:
             print(f"DEBUG: Finished key conversion for custom_aggregation_results. Converted: {custom_converted_count}, Errors: {custom_conversion_errors}")
         # --- END CUSTOM AGGREGATION KEY CONVERSION ---
 
+        # Type the declared numeric columns once, so rows don't re-parse strings per cell
+        data_schema_utils.apply_numeric_schema(invoice_data)
+
         return invoice_data
     except json.JSONDecodeError as e: print(f"Error: Invalid JSON in data file {data_path}: {e}"); return None
     except pickle.UnpicklingError as e: print(f"Error: Could not unpickle data file {data_path}: {e}"); return None
@@ -425,6 +390,7 @@ def process_single_table_sheet(
     final_grand_total_pallets: int,
     processed_table_source: Dict[str, Dict[str, List[Any]]],
     footer_config=None,
+    layout_plan: Optional[Any] = None,
 ) -> bool:
     """
     Processes a sheet configured as a single table or aggregation.
@@ -521,6 +487,7 @@ def process_single_table_sheet(
         custom_flag=args.custom,
         data_cell_merging_rules=data_cell_merging_rules,
         fob_mode=args.fob,
+        layout_plan=layout_plan,
     )
 
     if not fill_success:
@@ -586,6 +553,8 @@ def main():
     parser.add_argument("-c", "--configdir", default="./configs", help="Directory containing configuration JSON files (default: ./configs)")
     parser.add_argument("--fob", action="store_true", help="Generate FOB version using final_fob_compounded_result for Invoice/Contract sheets.")
     parser.add_argument("--custom", action="store_true", help="Enable custom processing logic (details TBD).")
+    parser.add_argument("--compress-level", type=int, default=None, help="Deflate level 0-9 for the saved workbook (0 = stored, default: INVOICE_COMPRESS_LEVEL or 6).")
+    parser.add_argument("--cache-formulas", action="store_true", help="Store computed results with the generated formulas, so data_only readers see the totals without Excel recalculating.")
     args = parser.parse_args()
 
     print("--- Starting Invoice Generation ---")
@@ -597,6 +566,9 @@ def main():
 
     print("\n2. Loading configuration and data..."); config = load_config(paths['config']); invoice_data = load_data(paths['data'])
     if not config or not invoice_data: sys.exit(1)
+    layout_plan = layout_plan_utils.get_layout_plan(config)
+    template_index = template_index_utils.load_template_index(paths['template'])
+    template_text_cells = template_index_utils.text_cells_by_sheet(template_index)
 
     print(f"\n3. Copying template '{paths['template'].name}' to '{args.output}'..."); output_path = Path(args.output).resolve()
     try:
@@ -630,17 +602,18 @@ def main():
         if args.fob:
             print("\n--- Running initial template replacements for FOB ---")
             text_replace_utils.run_fob_specific_replacement_task(
-                workbook=workbook
+                workbook=workbook,
+                candidate_cells=template_text_cells
             )
         
         # Perform data-driven replacements (e.g., JFINV, JFTIME)
         print("Performing data-driven replacements for single-table sheet...")
-        text_replace_utils.run_invoice_header_replacement_task(
-            workbook, invoice_data
+        header_replacements = text_replace_utils.run_invoice_header_replacement_task(
+            workbook, invoice_data, candidate_cells=template_text_cells
         )
         print("--- Finished initial template replacements ---\n")
 
-        original_merges = merge_utils.store_original_merges(workbook, sheets_to_process) # TODO: Re-enable
+        original_merges = merge_utils.store_original_merges(workbook, sheets_to_process, template_index) # TODO: Re-enable
         # print("DEBUG: Stored original merges structure:")
 
         # --- Get other config sections ---
@@ -693,6 +666,7 @@ def main():
             # --- End FOB flag override ---
 
             sheet_styling_config = sheet_mapping_section.get("styling") # Get styling rules dict or None
+            sheet_layout_plan = layout_plan.get(sheet_name)
 
             if not sheet_mapping_section: print(f"Warning: No 'data_mapping' section for sheet '{sheet_name}'. Skipping."); continue
             if not data_source_indicator: print(f"Warning: No 'sheet_data_map' entry for sheet '{sheet_name}' (or FOB override failed). Skipping."); continue # Adjusted warning
@@ -775,7 +749,7 @@ def main():
                     last_table_header_info = written_header_info # Keep track for width setting later
  
                     # Update write pointer after header
-                    num_header_rows, num_columns = calculate_header_dimensions(sheet_header_to_write)
+                    num_header_rows = sheet_layout_plan.num_header_rows
                     write_pointer_row += num_header_rows
  
                     print(f"Filling data and footer for table '{table_key}' starting near row {write_pointer_row}...")
@@ -811,6 +785,7 @@ def main():
                         custom_flag=args.custom,
                         data_cell_merging_rules=data_cell_merging_rules,
                         fob_mode=args.fob,
+                        layout_plan=sheet_layout_plan,
                     )
                     # fill_invoice_data now handles writing blank rows, data, footer row
                     # within the allocated space. next_row_after_chunk is the row AFTER its footer.
@@ -954,6 +929,7 @@ def main():
                     final_grand_total_pallets=final_grand_total_pallets,
                     processed_table_source=processed_tables_data_for_calc,
                     footer_config=footer_config,
+                    layout_plan=sheet_layout_plan,
                 )
         # --- Restore Original Merges AFTER processing all sheets using merge_utils ---
         merge_utils.find_and_restore_merges_heuristic(workbook, original_merges, sheets_to_process) # TODO: Re-enableN
@@ -962,12 +938,15 @@ def main():
         print("\n--------------------------------")
         if processing_successful:
             print("5. Saving final workbook...")
-            workbook.save(output_path); print(f"--- Workbook saved successfully: '{output_path}' ---")
+            header_patch_utils.store_header_cells(workbook, header_replacements)
+            workbook_save_utils.save_workbook(workbook, output_path, args.compress_level); print(f"--- Workbook saved successfully: '{output_path}' ---")
+            if args.cache_formulas:
+                formula_cache_utils.cache_formula_results(workbook, output_path, args.compress_level)
         else:
             print("--- Processing completed with errors. Saving workbook (may be incomplete). ---")
             try:
                 # Corrected the closing quote below
-                workbook.save(output_path); print(f"--- Incomplete workbook saved to: '{output_path}' ---")
+                workbook_save_utils.save_workbook(workbook, output_path, args.compress_level); print(f"--- Incomplete workbook saved to: '{output_path}' ---")
             except Exception as save_err:
                 print(f"--- CRITICAL ERROR: Failed to save incomplete workbook: {save_err} ---")
 
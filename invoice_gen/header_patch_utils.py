@@ -0,0 +1,244 @@
+# header_patch_utils.py
+# Header-only "patch mode" for an already generated invoice workbook.
+# When generate_invoice.py fills the invoice-level placeholders (JFINV, JFTIME, JFREF, ...), it records
+# which cells it wrote and from which data path in a custom document property of the output file.
+# If a later request only changes invoice-level fields (inv_no, inv_ref, inv_date, container_type),
+# those cells are rewritten directly in the sheet XML of the existing file instead of re-rendering it.
+# Formulas that depend on the patched cells keep their references (no cell moves) and the generator's
+# output is flagged fullCalcOnLoad, so Excel recalculates them when the file is opened. Cached formula
+# results (generate_invoice.py --cache-formulas) that read a patched cell are updated or cleared here.
+
+import re
+import json
+import zipfile
+import hashlib
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Union, Iterable
+
+import openpyxl
+from openpyxl.packaging.custom import StringProperty
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+import formula_cache_utils
+import output_cache_utils
+import text_replace_utils
+import xml_splice_utils
+
+HEADER_CELLS_PROPERTY = "InvoiceHeaderCells"
+UNPATCHABLE_KEY = "unpatchable"  # Stored instead of the records when a header cell could not be recorded
+CUSTOM_PROPS_PART = "docProps/custom.xml"
+NS_CUSTOM_PROPS = "http://schemas.openxmlformats.org/officeDocument/2006/custom-properties"
+NS_VT = "http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes"
+
+# Per-row fields the Generate page overrides that only ever reach the workbook through header placeholders
+INVOICE_LEVEL_FIELDS = ("inv_no", "inv_ref", "inv_date", "container_type")
+
+
+def store_header_cells(workbook: openpyxl.Workbook, applied_replacements: List[Dict[str, Any]]) -> int:
+    """
+    Stores the header replacement records in the workbook's custom document properties.
+    Call it right before saving. If any replaced cell no longer holds the value written by the
+    replacement (e.g. overwritten or moved by later processing), patching that cell later would
+    leave the old invoice's value behind, so the workbook is marked unpatchable instead.
+
+    Args:
+        workbook: The workbook about to be saved.
+        applied_replacements: Records returned by text_replace_utils.run_invoice_header_replacement_task.
+
+    Returns:
+        The number of records stored (0 if the workbook was marked unpatchable).
+    """
+    records, dropped = [], []
+    for record in applied_replacements or []:
+        if record["sheet"] not in workbook.sheetnames:
+            continue
+        if workbook[record["sheet"]][record["cell"]].value != record["value"]:
+            print(f"  Header patch: '{record['find']}' at {record['sheet']}!{record['cell']} changed after replacement; "
+                  f"workbook marked unpatchable.")
+            dropped.append(f"{record['sheet']}!{record['cell']}")
+            continue
+        records.append({key: value for key, value in record.items() if key != "value"})
+
+    existing = [prop for prop in workbook.custom_doc_props.props if prop.name == HEADER_CELLS_PROPERTY]
+    for prop in existing:
+        workbook.custom_doc_props.props.remove(prop)
+    stored = {UNPATCHABLE_KEY: dropped} if dropped else records
+    workbook.custom_doc_props.append(StringProperty(name=HEADER_CELLS_PROPERTY, value=json.dumps(stored)))
+    return 0 if dropped else len(records)
+
+
+def read_header_cells(zip_file: zipfile.ZipFile) -> Union[List[Dict[str, Any]], Dict[str, List[str]], None]:
+    """
+    Returns the header cell records stored in a generated workbook, {UNPATCHABLE_KEY: [cells]} if it
+    was marked unpatchable, or None if it has none.
+    """
+    if CUSTOM_PROPS_PART not in zip_file.namelist():
+        return None
+    props_xml = ET.fromstring(zip_file.read(CUSTOM_PROPS_PART))
+    for prop in props_xml.findall(f"{{{NS_CUSTOM_PROPS}}}property"):
+        if prop.get("name") == HEADER_CELLS_PROPERTY:
+            value = prop.find(f"{{{NS_VT}}}lpwstr")
+            return json.loads(value.text) if value is not None and value.text else []
+    return None
+
+
+def invoice_level_key(data: Dict[str, Any], template_path: Union[str, Path], config_path: Union[str, Path],
+                      mode_flags: Iterable[str]) -> Optional[str]:
+    """
+    Hashes everything that determines a generated workbook except the invoice-level fields.
+    Two requests with the same key differ at most in header cells, so one output can be patched into the other.
+
+    Args:
+        data: The loaded invoice JSON.
+        template_path: The template .xlsx the generator uses.
+        config_path: The *_config.json the generator uses.
+        mode_flags: Command-line mode flags (e.g. ['--fob']).
+
+    Returns:
+        The hex SHA-256 key, or None if the config maps an invoice-level field into the
+        sheet body (then those fields are not header-only and patching is unsafe).
+    """
+    config_bytes = Path(config_path).read_bytes()
+    if any(f'"{field}"'.encode("utf-8") in config_bytes for field in INVOICE_LEVEL_FIELDS):
+        return None
+
+    stripped = dict(data)
+    if isinstance(data.get("processed_tables_data"), dict):
+        stripped["processed_tables_data"] = {
+            table_id: {k: v for k, v in table.items() if k not in INVOICE_LEVEL_FIELDS} if isinstance(table, dict) else table
+            for table_id, table in data["processed_tables_data"].items()
+        }
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps(stripped, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(Path(template_path).read_bytes())
+    digest.update(config_bytes)
+    digest.update(("flags:" + " ".join(sorted(mode_flags))).encode("utf-8"))
+    digest.update(("generator:" + output_cache_utils.generator_version()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _resolve_patch_value(record: Dict[str, Any], invoice_data: Dict[str, Any]) -> Any:
+    """
+    Returns the value a full render would write into a recorded header cell, mirroring
+    find_and_replace. Raises ValueError if the cell's style can't show the value the same way.
+    """
+    new_value = text_replace_utils.get_nested_data(invoice_data, record["data_path"])
+    if new_value is None:
+        return record["find"] # A full render leaves the placeholder text in place
+    if record["is_date"]:
+        parsed_date = text_replace_utils.parse_date_value(new_value)
+        if bool(parsed_date) != record["date_formatted"]:
+            raise ValueError(f"date formatting of {record['sheet']}!{record['cell']} would change")
+        return parsed_date or new_value
+    return new_value
+
+
+def _replace_cell_xml(sheet_xml: str, coordinate: str, value: Any) -> Optional[str]:
+    """Rewrites one <c> element in a sheet part, keeping its style. Returns None if the cell is missing."""
+    cell_pattern = re.compile(rf'<c\b(?=[^>]*\br="{coordinate}")[^>]*?(?:/>|>.*?</c>)', re.DOTALL)
+    match = cell_pattern.search(sheet_xml)
+    if not match:
+        return None
+    style_match = re.search(r'\bs="(\d+)"', match.group(0)[:match.group(0).find(">") + 1])
+    col_letters, row_num = coordinate_from_string(coordinate)
+    new_cell_xml = xml_splice_utils.format_cell_xml(
+        row_num, column_index_from_string(col_letters), value, int(style_match.group(1)) if style_match else None
+    )
+    return sheet_xml[:match.start()] + new_cell_xml + sheet_xml[match.end():]
+
+
+def patch_header_cells(source_path: Union[str, Path], output_path: Union[str, Path],
+                       invoice_data: Dict[str, Any]) -> bool:
+    """
+    Writes a copy of a generated workbook with its recorded header cells updated from `invoice_data`.
+    Only the affected sheet parts are rewritten; every other zip part is copied byte for byte.
+
+    Args:
+        source_path: A workbook produced by generate_invoice.py.
+        output_path: Where to write the patched copy (may not be `source_path`).
+        invoice_data: The loaded invoice JSON with the new invoice-level values.
+
+    Returns:
+        True if the patched copy was written. False if the workbook has no usable header
+        records, in which case the caller should regenerate it in full.
+    """
+    source_path, output_path = Path(source_path), Path(output_path)
+    print(f"--- Patching header cells of '{source_path.name}' ---")
+    try:
+        with zipfile.ZipFile(source_path, "r") as zin:
+            records = read_header_cells(zin)
+            if records is None:
+                print("  No header cell records in this workbook; a full render is needed.")
+                return False
+            if isinstance(records, dict):
+                print(f"  Header cell(s) {', '.join(records.get(UNPATCHABLE_KEY, []))} could not be recorded; "
+                      f"a full render is needed.")
+                return False
+
+            records_by_part: Dict[str, List[Dict[str, Any]]] = {}
+            for record in records:
+                sheet_part = xml_splice_utils.resolve_sheet_part(zin, record["sheet"])
+                if not sheet_part:
+                    print(f"  Sheet '{record['sheet']}' not found; a full render is needed.")
+                    return False
+                records_by_part.setdefault(sheet_part, []).append(record)
+
+            patched_parts: Dict[str, bytes] = {}
+            for sheet_part, part_records in records_by_part.items():
+                sheet_xml = zin.read(sheet_part).decode("utf-8")
+                for record in part_records:
+                    sheet_xml = _replace_cell_xml(sheet_xml, record["cell"], _resolve_patch_value(record, invoice_data))
+                    if sheet_xml is None:
+                        print(f"  Cell {record['sheet']}!{record['cell']} not found; a full render is needed.")
+                        return False
+                    print(f"    -> Patched '{record['find']}' at {record['sheet']}!{record['cell']}.")
+                patched_parts[sheet_part] = sheet_xml.encode("utf-8")
+
+            # Formula results cached at generation time (--cache-formulas) must follow the patched cells
+            changed_cells = {(record["sheet"], record["cell"]): _resolve_patch_value(record, invoice_data) for record in records}
+            sheet_parts = {title: xml_splice_utils.resolve_sheet_part(zin, title) for title in formula_cache_utils.sheet_titles(zin)}
+            cached_sheets = [title for title, part in sheet_parts.items()
+                             if formula_cache_utils.has_cached_values((patched_parts.get(part) or zin.read(part)).decode("utf-8"))]
+            updated = True
+            while updated: # Repeat until indirect dependents (e.g. =G11+1 where G11 =G9) are reached
+                updated = 0
+                for sheet_title in cached_sheets:
+                    sheet_part = sheet_parts[sheet_title]
+                    sheet_xml, sheet_updated = formula_cache_utils.update_dependent_cached_values(
+                        (patched_parts.get(sheet_part) or zin.read(sheet_part)).decode("utf-8"), sheet_title, changed_cells)
+                    if sheet_updated:
+                        patched_parts[sheet_part] = sheet_xml.encode("utf-8")
+                        print(f"    -> Updated {sheet_updated} cached formula result(s) on '{sheet_title}'.")
+                        updated += sheet_updated
+
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zout:
+                for info in zin.infolist():
+                    if info.filename in patched_parts:
+                        zout.writestr(zipfile.ZipInfo(info.filename, date_time=info.date_time),
+                                      patched_parts[info.filename], compress_type=zipfile.ZIP_DEFLATED)
+                    else:
+                        zout.writestr(info, zin.read(info.filename), compress_type=info.compress_type)
+    except (ValueError, KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+        print(f"  Header patch not possible ({e}); a full render is needed.")
+        return False
+
+    print(f"--- Header patch complete: '{output_path}' ({len(records)} cell(s)) ---")
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update the invoice-level header cells of a generated invoice workbook.")
+    parser.add_argument("workbook", help="Path to a workbook generated by generate_invoice.py.")
+    parser.add_argument("input_data_file", help="Path to the invoice JSON with the new invoice-level values.")
+    parser.add_argument("-o", "--output", required=True, help="Path for the patched workbook.")
+    args = parser.parse_args()
+
+    with open(args.input_data_file, "r", encoding="utf-8") as f:
+        patch_data = json.load(f)
+    if not patch_header_cells(args.workbook, args.output, patch_data):
+        raise SystemExit(1)
@@ -0,0 +1,527 @@
+# html_preview_utils.py
+# Lightweight HTML preview of the tables generate_invoice.py writes (Invoice, Contract, Packing list).
+# Works from the in-memory invoice data and config only: the row layout comes from
+# layout_estimate_utils, the cell values from the same prepare_data_rows the generator uses, and
+# formulas (unit price/amount hints, footer SUMs) are evaluated in Python so totals show as numbers.
+# Fonts, alignment, number formats, column widths, row heights and merges follow the sheet's
+# 'styling' and 'footer_configurations' config. The template's own cells (company header, bank
+# details, ...) are not rendered; the preview covers the generated table region of each sheet.
+# The FOB summary rows and the weight summary are written by the generator's own functions onto a
+# scratch worksheet and copied over, since their totals are computed inside those writers.
+#
+# Usage: python html_preview_utils.py data/JF.json [-t TEMPLATE] [-c config] [--fob | --custom] -o preview.html
+
+import re
+import ast
+import html
+import operator
+from typing import Dict, Any, List, Optional, Tuple
+
+import openpyxl
+from openpyxl.utils import get_column_letter, column_index_from_string, range_boundaries
+
+import invoice_utils
+import layout_plan_utils
+import layout_estimate_utils
+
+DEFAULT_COLUMN_WIDTH = 8.43  # Excel's default width, in characters
+DEFAULT_FONT = {"name": "Calibri", "size": 11}
+
+_SUM_PATTERN = re.compile(r"SUM\(([^)]*)\)", re.IGNORECASE)
+_CELL_REF_PATTERN = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+
+def to_numeric_value(value: Any) -> float:
+    """Returns a cell value as a number for formula evaluation (text and blanks count as 0, like SUM)."""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def _arithmetic_operand(value: Any) -> float:
+    """Returns a referenced value for + - * / (blanks count as 0; text that isn't a number is #VALUE!, as in Excel)."""
+    if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return value or 0
+    try:
+        return float(str(value))
+    except ValueError:
+        raise ValueError(f"Text operand: {value!r}")
+
+
+def evaluate_formula(formula: str, values: Dict[Tuple[int, int], Any]) -> Any:
+    """
+    Evaluates the simple formulas the generator writes: SUM over ranges and + - * / between cell refs.
+
+    Args:
+        formula: The formula text, e.g. "=SUM(E23:E52,E58:E71)" or "=F12/E12".
+        values: Already evaluated cell values by (row, column).
+
+    Returns:
+        The number, or an Excel-style error string ('#DIV/0!', '#VALUE!').
+    """
+    expression = formula.lstrip("=")
+
+    def sum_ranges(match: re.Match) -> str:
+        total = 0
+        for part in match.group(1).split(","):
+            min_col, min_row, max_col, max_row = range_boundaries(part.strip().replace("$", ""))
+            total += sum(to_numeric_value(values.get((r, c))) for r in range(min_row, max_row + 1) for c in range(min_col, max_col + 1))
+        return repr(total)
+
+    try:
+        expression = _SUM_PATTERN.sub(sum_ranges, expression)
+        expression = _CELL_REF_PATTERN.sub(
+            lambda m: repr(_arithmetic_operand(values.get((int(m.group(2)), column_index_from_string(m.group(1)))))), expression)
+        return _evaluate_node(ast.parse(expression, mode="eval").body)
+    except ZeroDivisionError:
+        return "#DIV/0!"
+    except (ValueError, SyntaxError, TypeError):
+        return "#VALUE!"
+
+
+def _evaluate_node(node: ast.AST) -> Any:
+    """Evaluates an arithmetic-only expression tree."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        return _BINARY_OPERATORS[type(node.op)](_evaluate_node(node.left), _evaluate_node(node.right))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_evaluate_node(node.operand)
+    raise ValueError(f"Unsupported formula element: {ast.dump(node)}")
+
+
+def format_display_value(value: Any, number_format: Optional[str]) -> str:
+    """Formats a value the way a cell with `number_format` shows it (covers the formats the configs use)."""
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+    section = (number_format or "General").split(";")[0]
+    if section in ("General", "@"):
+        return f"{value:,.2f}" if isinstance(value, float) else f"{value:,}"
+    number_part = re.sub(r"_.|\\.|\"[^\"]*\"|[^#0.,]", "", section)
+    decimals = len(number_part.split(".", 1)[1]) if "." in number_part else 0
+    thousands = "," in number_part.split(".", 1)[0]
+    return f"{value:{',' if thousands else ''}.{decimals}f}"
+
+
+def _font_css(font_config: Optional[Dict[str, Any]]) -> List[str]:
+    """Returns CSS declarations for an openpyxl-style font config."""
+    font_config = font_config or {}
+    css = []
+    if font_config.get("name"):
+        css.append(f"font-family:'{font_config['name']}'")
+    if font_config.get("size"):
+        css.append(f"font-size:{float(font_config['size'])}pt")
+    if font_config.get("bold"):
+        css.append("font-weight:bold")
+    if font_config.get("italic"):
+        css.append("font-style:italic")
+    if font_config.get("underline"):
+        css.append("text-decoration:underline")
+    if font_config.get("color"):
+        css.append(f"color:#{str(font_config['color'])[-6:]}")
+    return css
+
+
+def _alignment_css(alignment_config: Optional[Dict[str, Any]]) -> List[str]:
+    """Returns CSS declarations for an openpyxl-style alignment config."""
+    alignment_config = alignment_config or {}
+    css = []
+    horizontal = alignment_config.get("horizontal")
+    if horizontal in ("left", "center", "right", "justify"):
+        css.append(f"text-align:{horizontal}")
+    vertical = alignment_config.get("vertical")
+    if vertical in ("top", "center", "bottom"):
+        css.append(f"vertical-align:{'middle' if vertical == 'center' else vertical}")
+    css.append("white-space:pre-wrap" if alignment_config.get("wrap_text") else "white-space:pre")
+    return css
+
+
+class SheetPreview:
+    """
+    The evaluated cells of one sheet's generated region, ready to be rendered.
+
+    Attributes:
+        sheet_name: The sheet name.
+        first_row / last_row: The row range covered by the preview.
+        num_columns: Table width.
+        cells: {(row, col): value} with formulas already evaluated.
+        styles: {(row, col): (font config, alignment config, number format)}.
+        merges: Merged ranges (A1 notation) inside the covered rows.
+        row_heights: {row: height in points}.
+        column_widths: {col: width in characters}.
+    """
+
+    def __init__(self, sheet_name: str, num_columns: int):
+        self.sheet_name = sheet_name
+        self.num_columns = num_columns
+        self.first_row = 0
+        self.last_row = -1
+        self.cells: Dict[Tuple[int, int], Any] = {}
+        self.styles: Dict[Tuple[int, int], Tuple[Dict[str, Any], Dict[str, Any], Optional[str]]] = {}
+        self.merges: List[str] = []
+        self.row_heights: Dict[int, float] = {}
+        self.column_widths: Dict[int, float] = {}
+
+    def set(self, row: int, col: int, value: Any, font: Optional[Dict[str, Any]] = None,
+            alignment: Optional[Dict[str, Any]] = None, number_format: Optional[str] = None):
+        """Stores one cell's value and style."""
+        self.cells[(row, col)] = value
+        self.styles[(row, col)] = (font or {}, alignment or {}, number_format)
+
+    def clear_merged_cells(self):
+        """Blanks every merged cell except the top-left one, as merging does in Excel."""
+        for merge in self.merges:
+            min_col, min_row, max_col, max_row = range_boundaries(merge)
+            for r in range(min_row, max_row + 1):
+                for c in range(min_col, max_col + 1):
+                    if (r, c) != (min_row, min_col) and (r, c) in self.cells:
+                        self.cells[(r, c)] = None
+
+    def copy_rows_from(self, worksheet, first_row: int, last_row: int):
+        """Copies the values and styles of rows written onto a scratch openpyxl worksheet."""
+        for row in range(first_row, last_row + 1):
+            for col in range(1, self.num_columns + 1):
+                cell = worksheet.cell(row=row, column=col)
+                font = {"name": cell.font.name, "size": cell.font.sz, "bold": cell.font.b, "italic": cell.font.i}
+                alignment = {"horizontal": cell.alignment.horizontal, "vertical": cell.alignment.vertical,
+                             "wrap_text": cell.alignment.wrap_text}
+                self.set(row, col, cell.value, font, alignment, cell.number_format)
+
+    def evaluate_formulas(self):
+        """Replaces formula strings with their values, in row order (footers sum evaluated data rows)."""
+        for key in sorted(self.cells):
+            value = self.cells[key]
+            if isinstance(value, str) and value.startswith("="):
+                self.cells[key] = evaluate_formula(value, self.cells)
+
+    def to_html(self) -> str:
+        """Renders the preview as a self-contained HTML table."""
+        covered = set()
+        spans: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for merge in self.merges:
+            min_col, min_row, max_col, max_row = range_boundaries(merge)
+            if min_row < self.first_row or max_row > self.last_row or (min_row, min_col) in covered:
+                continue
+            spans[(min_row, min_col)] = (max_row - min_row + 1, max_col - min_col + 1)
+            covered.update((r, c) for r in range(min_row, max_row + 1) for c in range(min_col, max_col + 1)
+                           if (r, c) != (min_row, min_col))
+
+        parts = [f'<table class="invoice-preview" data-sheet="{html.escape(self.sheet_name)}" '
+                 'style="border-collapse:collapse;table-layout:fixed;background:#fff;color:#000">', "<colgroup>"]
+        for col in range(1, self.num_columns + 1):
+            width_px = int(self.column_widths.get(col, DEFAULT_COLUMN_WIDTH) * 7 + 5)
+            parts.append(f'<col style="width:{width_px}px">')
+        parts.append("</colgroup>")
+
+        for row in range(self.first_row, self.last_row + 1):
+            height = self.row_heights.get(row)
+            parts.append(f'<tr style="height:{height}pt">' if height else "<tr>")
+            for col in range(1, self.num_columns + 1):
+                if (row, col) in covered:
+                    continue
+                font, alignment, number_format = self.styles.get((row, col), ({}, {}, None))
+                css = ["border:1px solid #000", "padding:1px 3px", "overflow:hidden"] + _font_css(font or DEFAULT_FONT) + _alignment_css(alignment)
+                rowspan, colspan = spans.get((row, col), (1, 1))
+                span_attrs = (f' rowspan="{rowspan}"' if rowspan > 1 else "") + (f' colspan="{colspan}"' if colspan > 1 else "")
+                text = html.escape(format_display_value(self.cells.get((row, col)), number_format))
+                parts.append(f'<td{span_attrs} style="{";".join(css)}">{text}</td>')
+            parts.append("</tr>")
+        parts.append("</table>")
+        return "".join(parts)
+
+
+def _table_data_source(sheet_name: str, data_source_indicator: str, table_estimate: Dict[str, Any],
+                       invoice_data: Dict[str, Any], fob: bool, custom: bool) -> Tuple[Optional[str], Any]:
+    """Returns (data_source_type, data) for one estimated table."""
+    if "table_key" in table_estimate:
+        return 'processed_tables', (invoice_data.get('processed_tables_data') or {}).get(table_estimate["table_key"])
+    return layout_estimate_utils.resolve_data_source(sheet_name, data_source_indicator, invoice_data, fob, custom)
+
+
+def _grand_total_pallets(invoice_data: Dict[str, Any]) -> int:
+    """Sums every table's pallet counts (same as generate_invoice.main)."""
+    total = 0
+    for table_data in (invoice_data.get('processed_tables_data') or {}).values():
+        if isinstance(table_data, dict):
+            total += sum(int(p) for p in table_data.get("pallet_count", []) if isinstance(p, (int, float)))
+    return total
+
+
+def _fill_footer(preview: SheetPreview, footer_row: int, sheet_plan: layout_plan_utils.SheetLayoutPlan,
+                 footer_config: Dict[str, Any], sum_ranges: List[Tuple[int, int]], pallet_count: int,
+                 fob_mode: bool, total_text: Optional[str] = None):
+    """Fills a footer/grand total row like write_footer_row."""
+    style = footer_config.get("style", {})
+    font = style.get("font", {"bold": True})
+    alignment = style.get("alignment", {"horizontal": "center", "vertical": "center"})
+    column_id_map = sheet_plan.column_id_map
+    for col in range(1, preview.num_columns + 1):
+        preview.set(footer_row, col, None, font, alignment)
+
+    total_text = total_text if total_text is not None else footer_config.get("total_text", "TOTAL:")
+    if column_id_map.get(footer_config.get("total_text_column_id")):
+        preview.set(footer_row, column_id_map[footer_config["total_text_column_id"]], total_text, font, alignment)
+    pallet_col_idx = column_id_map.get(footer_config.get("pallet_count_column_id"))
+    if pallet_col_idx and pallet_count > 0:
+        preview.set(footer_row, pallet_col_idx, f"{pallet_count} PALLET{'S' if pallet_count != 1 else ''}", font, alignment)
+
+    if sum_ranges:
+        number_formats = footer_config.get("number_formats", {})
+        for col_id, col_idx, col_letter in sheet_plan.footer_sum_columns:
+            if col_id not in footer_config.get("sum_column_ids", []):
+                continue
+            number_format = (number_formats.get(col_id) or {}).get("number_format")
+            if number_format and fob_mode and col_id not in ['col_pcs', 'col_qty_pcs']:
+                number_format = "##,00.00"
+            formula = f"=SUM({','.join(f'{col_letter}{start}:{col_letter}{end}' for start, end in sum_ranges)})"
+            preview.set(footer_row, col_idx, formula, font, alignment, number_format)
+
+
+def _fill_table(preview: SheetPreview, sheet_plan: layout_plan_utils.SheetLayoutPlan, sheet_section: Dict[str, Any],
+                table_estimate: Dict[str, Any], data_source_type: Optional[str], data_source: Any,
+                fob: bool, grand_total_pallets: int):
+    """Fills one header + data + footer block like write_header and fill_invoice_data."""
+    styling = sheet_section.get("styling") or {}
+    column_id_map = dict(sheet_plan.column_id_map)
+    idx_to_id_map = sheet_plan.idx_to_id_map
+    num_columns = preview.num_columns
+    header_font = styling.get("header_font", {"bold": True})
+    header_alignment = styling.get("header_alignment", {"horizontal": "center", "vertical": "center", "wrap_text": True})
+
+    # --- Header ---
+    header_start = table_estimate["header_rows"][0]
+    for cell_config in sheet_plan.header_layout:
+        preview.set(header_start + cell_config.get('row', 0), 1 + cell_config.get('col', 0), cell_config.get('text'),
+                    header_font, header_alignment)
+
+    def column_style(col_idx: int) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[str]]:
+        col_id = idx_to_id_map.get(col_idx)
+        col_specific = (styling.get("column_id_styles") or {}).get(col_id, {})
+        font = dict(styling.get("default_font") or {}, **col_specific.get("font", {}))
+        alignment = dict(styling.get("default_alignment") or {}, **col_specific.get("alignment", {}))
+        number_format = col_specific.get("number_format")
+        if col_id in (styling.get("force_text_format_ids") or []):
+            number_format = "@"
+        elif number_format and fob and col_id not in ['col_pcs', 'col_qty_pcs']:
+            number_format = "#,##0.00"
+        return font, alignment, number_format
+
+    # --- Static rows around the data ---
+    for static_row, content_key in ((table_estimate["blank_after_header_row"], "static_content_after_header"),
+                                    (table_estimate["blank_before_footer_row"], "static_content_before_footer")):
+        if not static_row:
+            continue
+        for col in range(1, num_columns + 1):
+            preview.set(static_row, col, None, *column_style(col)[:2])
+        for col_key, value in (sheet_section.get(content_key) or {}).items():
+            if str(col_key).isdigit() and 1 <= int(col_key) <= num_columns:
+                preview.set(static_row, int(col_key), value, *column_style(int(col_key))[:2])
+
+    # --- Data rows (values from the generator's own prepare_data_rows) ---
+    parsed_rules = sheet_plan.parsed_rules
+    data_rows_prepared, pallet_counts, dynamic_desc_used = [], [], False
+    if data_source_type and data_source:
+        data_rows_prepared, pallet_counts, dynamic_desc_used, _ = invoice_utils.prepare_data_rows(
+            data_source_type=data_source_type,
+            data_source=data_source,
+            dynamic_mapping_rules=parsed_rules.get("dynamic_mapping_rules", {}),
+            column_id_map=column_id_map,
+            idx_to_header_map=dict(sheet_plan.idx_to_header_map),
+            desc_col_idx=column_id_map.get("col_desc"),
+            num_static_labels=parsed_rules.get("num_static_labels", 0),
+            static_value_map=parsed_rules.get("static_value_map", {}),
+            fob_mode=fob,
+            rule_by_id=dict(sheet_plan.rule_by_id),
+        )
+    local_chunk_pallets = sum(p for p in (data_source or {}).get("pallet_count", []) if p is not None) \
+        if data_source_type == 'processed_tables' else 0
+
+    data_rows = table_estimate["data_rows"]
+    if data_rows:
+        col1_index = parsed_rules.get("col1_index", 1)
+        static_labels = parsed_rules.get("initial_static_col1_values", [])
+        no_col_idx = column_id_map.get("col_no")
+        pallet_info_col_idx = column_id_map.get("col_pallet")
+        row_pallet_index = 0
+        for i, target_row in enumerate(range(data_rows[0], data_rows[1] + 1)):
+            row_data = data_rows_prepared[i] if i < len(data_rows_prepared) else {}
+            if i < len(pallet_counts) and pallet_counts[i] and pallet_counts[i] > 0:
+                row_pallet_index += 1
+            for col in range(1, num_columns + 1):
+                prepared_value = row_data.get(col)
+                if i < len(static_labels) and col == col1_index:
+                    value = static_labels[i]
+                elif isinstance(prepared_value, dict) and prepared_value.get("type") == "formula":
+                    input_cols = [column_id_map.get(input_id) for input_id in prepared_value.get("inputs", [])]
+                    if all(input_cols) and prepared_value.get("template"):
+                        params = {f"col_ref_{idx}": get_column_letter(c) for idx, c in enumerate(input_cols)}
+                        value = "=" + prepared_value["template"].format(row=target_row, **params)
+                    else:
+                        value = "#REF!"
+                elif col == no_col_idx:
+                    value = i + 1
+                elif col == pallet_info_col_idx:
+                    value = f"{row_pallet_index}-{local_chunk_pallets}"
+                else:
+                    value = prepared_value
+                preview.set(target_row, col, value, *column_style(col))
+
+        # Vertical merges of equal neighbouring values (merge_contiguous_cells_by_id)
+        for col_id in ("col_desc", "col_pallet", "col_hs"):
+            col_idx = column_id_map.get(col_id)
+            if not col_idx or (col_id == "col_desc" and dynamic_desc_used):
+                continue
+            run_start = data_rows[0]
+            for row in range(data_rows[0] + 1, data_rows[1] + 2):
+                run_value = preview.cells.get((run_start, col_idx))
+                if row <= data_rows[1] and preview.cells.get((row, col_idx)) == run_value:
+                    continue
+                if row - 1 > run_start and run_value is not None and str(run_value).strip():
+                    preview.merges.append(f"{get_column_letter(col_idx)}{run_start}:{get_column_letter(col_idx)}{row - 1}")
+                run_start = row
+
+    # --- Footer ---
+    pallet_count = local_chunk_pallets if data_source_type == 'processed_tables' else grand_total_pallets
+    _fill_footer(preview, table_estimate["footer_row"], sheet_plan, sheet_section.get("footer_configurations") or {},
+                 [tuple(data_rows)] if data_rows else [], pallet_count, data_source_type == 'fob_aggregation')
+
+
+def build_sheet_preview(sheet_name: str, sheet_plan: layout_plan_utils.SheetLayoutPlan, sheet_section: Dict[str, Any],
+                        sheet_estimate: Dict[str, Any], invoice_data: Dict[str, Any], fob: bool = False,
+                        custom: bool = False) -> SheetPreview:
+    """
+    Builds the evaluated preview of one sheet's generated region.
+
+    Args:
+        sheet_name: The sheet name.
+        sheet_plan: The sheet's compiled layout plan.
+        sheet_section: The sheet's section from 'data_mapping'.
+        sheet_estimate: The sheet's entry from layout_estimate_utils.estimate_layout.
+        invoice_data: The invoice data as returned by generate_invoice.load_data.
+        fob: Preview the --fob output.
+        custom: Preview the --custom output.
+
+    Returns:
+        The SheetPreview.
+    """
+    preview = SheetPreview(sheet_name, sheet_plan.num_columns)
+    tables = sheet_estimate["tables"]
+    if not tables:
+        return preview
+    grand_total_pallets = _grand_total_pallets(invoice_data)
+    for table_estimate in tables:
+        data_source_type, data_source = _table_data_source(
+            sheet_name, sheet_estimate["data_source"], table_estimate, invoice_data, fob, custom)
+        _fill_table(preview, sheet_plan, sheet_section, table_estimate, data_source_type, data_source, fob, grand_total_pallets)
+
+    if sheet_estimate["grand_total_row"]:
+        table_pallets = sum(
+            sum(p for p in ((invoice_data.get('processed_tables_data') or {}).get(t["table_key"]) or {}).get("pallet_count", []) if p is not None)
+            for t in tables)
+        _fill_footer(preview, sheet_estimate["grand_total_row"], sheet_plan, sheet_section.get("footer_configurations") or {},
+                     [tuple(t["data_rows"]) for t in tables if t["data_rows"]], table_pallets, fob, total_text="TOTAL OF:")
+
+    # --- Rows whose totals are computed by the generator's writers ---
+    header_info = {
+        'first_row_index': tables[-1]["header_rows"][0], 'second_row_index': tables[-1]["header_rows"][1],
+        'column_map': dict(sheet_plan.column_map), 'column_id_map': dict(sheet_plan.column_id_map),
+        'num_columns': sheet_plan.num_columns,
+    }
+    if sheet_estimate["summary_rows"]:
+        scratch = openpyxl.Workbook().active
+        all_tables_data = invoice_data.get('processed_tables_data') or {}
+        invoice_utils.write_summary_rows(
+            worksheet=scratch, start_row=sheet_estimate["summary_rows"][0], header_info=header_info,
+            all_tables_data=all_tables_data, table_keys=[t["table_key"] for t in tables],
+            footer_config=sheet_section.get("footer_configurations") or {}, mapping_rules=sheet_section.get('mappings', {}),
+            styling_config=sheet_section.get("styling"), fob_mode=fob
+        )
+        preview.copy_rows_from(scratch, *sheet_estimate["summary_rows"])
+    if sheet_estimate["weight_summary_rows"]:
+        scratch = openpyxl.Workbook().active
+        invoice_utils.write_grand_total_weight_summary(
+            worksheet=scratch, start_row=sheet_estimate["weight_summary_rows"][0], header_info=header_info,
+            processed_tables_data=invoice_data.get('processed_tables_data') or {},
+            weight_config=sheet_section.get("weight_summary_config") or {}, styling_config=sheet_section
+        )
+        preview.copy_rows_from(scratch, *sheet_estimate["weight_summary_rows"])
+        preview.merges.extend(str(m) for m in scratch.merged_cells.ranges)
+
+    preview.first_row = tables[0]["header_rows"][0]
+    preview.last_row = max([t["footer_row"] for t in tables] + [sheet_estimate["grand_total_row"] or 0] +
+                           [(sheet_estimate[k] or [0, 0])[1] for k in ("summary_rows", "weight_summary_rows")])
+    preview.merges.extend(sheet_estimate["merges"])
+    preview.row_heights = dict(sheet_estimate.get("row_heights") or {})
+
+    styling = sheet_section.get("styling") or {}
+    for header_text, width in (styling.get("column_widths") or {}).items():
+        if sheet_plan.column_map.get(header_text):
+            preview.column_widths[sheet_plan.column_map[header_text]] = float(width)
+    for col_id, width in (styling.get("column_id_widths") or {}).items():
+        if sheet_plan.column_id_map.get(col_id):
+            preview.column_widths.setdefault(sheet_plan.column_id_map[col_id], float(width))
+
+    preview.clear_merged_cells()
+    preview.evaluate_formulas()
+    return preview
+
+
+def render_invoice_html(invoice_data: Dict[str, Any], config: Dict[str, Any], fob: bool = False, custom: bool = False,
+                        template_index: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    Renders an HTML preview of every sheet generate_invoice.py would fill.
+
+    Args:
+        invoice_data: The invoice data as returned by generate_invoice.load_data.
+        config: The loaded *_config.json.
+        fob: Preview the --fob output.
+        custom: Preview the --custom output.
+        template_index: The template's index, if available (only used for the sheet list).
+
+    Returns:
+        {sheet name: HTML table}, in processing order.
+    """
+    layout_plan = layout_plan_utils.get_layout_plan(config)
+    layout_estimate = layout_estimate_utils.estimate_layout(invoice_data, config, fob=fob, custom=custom, template_index=template_index)
+    data_mapping_config = config.get('data_mapping', {})
+    return {
+        sheet_name: build_sheet_preview(sheet_name, layout_plan.get(sheet_name), data_mapping_config.get(sheet_name, {}),
+                                        sheet_estimate, invoice_data, fob, custom).to_html()
+        for sheet_name, sheet_estimate in layout_estimate["sheets"].items()
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import contextlib
+    import io
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Render an HTML preview of an invoice without generating the workbook.")
+    parser.add_argument("input_data_file", help="Path to the input JSON data file.")
+    parser.add_argument("-o", "--output", default="preview.html", help="Path for the HTML file (default: preview.html)")
+    parser.add_argument("-t", "--templatedir", default="./TEMPLATE", help="Directory containing template Excel files.")
+    parser.add_argument("-c", "--configdir", default="./configs", help="Directory containing configuration JSON files.")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--fob", action="store_true", help="Preview the FOB version.")
+    mode_group.add_argument("--custom", action="store_true", help="Preview the custom aggregation version.")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # Keep the loaders' debug output quiet
+        import generate_invoice
+        import template_index_utils
+
+        paths = generate_invoice.derive_paths(args.input_data_file, args.templatedir, args.configdir)
+        config = generate_invoice.load_config(paths['config']) if paths else None
+        invoice_data = generate_invoice.load_data(paths['data']) if paths else None
+        template_index = template_index_utils.load_template_index(paths['template'], rebuild_if_stale=False) if paths else None
+        if config and invoice_data is not None:
+            sheet_html = render_invoice_html(invoice_data, config, fob=args.fob, custom=args.custom, template_index=template_index)
+    if not config or invoice_data is None:
+        raise SystemExit(f"Could not load the data/config for '{args.input_data_file}'.")
+
+    body = "".join(f"<h2>{html.escape(name)}</h2>{table}" for name, table in sheet_html.items())
+    Path(args.output).write_text(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(Path(args.input_data_file).stem)}"
+                                 f"</title></head><body>{body}</body></html>", encoding="utf-8")
+    print(f"Preview written to '{args.output}' ({len(sheet_html)} sheet(s)).")
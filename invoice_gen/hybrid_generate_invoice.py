@@ -3,48 +3,126 @@ import json
 import shutil
 import openpyxl
 import sys
-import re
+import traceback
 from pathlib import Path
-from copy import copy
+from copy import copy, deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple, Union
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.worksheet.page import PrintPageSetup
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.workbook import Workbook
 
 # --- Import Reusable and New Utilities ---
 import text_replace_utils
+import data_schema_utils
 import invoice_utils
 import packing_list_utils
 import merge_utils
+import template_index_utils
+import template_registry_utils
+import workbook_save_utils
+
+# --- Sheet cloning by style id ---
+# Instead of deep-copying Font/Border/Fill/... objects cell by cell, each distinct source StyleArray
+# is translated once into the target workbook's style tables and then shared by every cell using it.
+
+def build_style_id_mapper(source_workbook: Workbook, target_workbook: Workbook) -> Callable[[StyleArray], StyleArray]:
+    """
+    Returns a function that maps a StyleArray from the source workbook's shared style
+    tables to an equivalent StyleArray in the target workbook, adding any missing fonts,
+    fills, borders, number formats, protections and alignments to the target on first use.
+    Results are memoised, so each distinct source style is translated only once.
+    """
+    style_cache: Dict[Tuple[int, ...], StyleArray] = {}
+    target_named_styles = {style.name: idx for idx, style in enumerate(target_workbook._named_styles)}
+
+    def map_style(source_style: Optional[StyleArray]) -> StyleArray:
+        if source_style is None:
+            return StyleArray()
+        key = tuple(source_style)
+        mapped = style_cache.get(key)
+        if mapped is None:
+            mapped = StyleArray()
+            mapped.fontId = target_workbook._fonts.add(source_workbook._fonts[source_style.fontId])
+            mapped.fillId = target_workbook._fills.add(source_workbook._fills[source_style.fillId])
+            mapped.borderId = target_workbook._borders.add(source_workbook._borders[source_style.borderId])
+            mapped.protectionId = target_workbook._protections.add(source_workbook._protections[source_style.protectionId])
+            mapped.alignmentId = target_workbook._alignments.add(source_workbook._alignments[source_style.alignmentId])
+            if source_style.numFmtId < BUILTIN_FORMATS_MAX_SIZE:
+                mapped.numFmtId = source_style.numFmtId
+            else:
+                number_format = source_workbook._number_formats[source_style.numFmtId - BUILTIN_FORMATS_MAX_SIZE]
+                mapped.numFmtId = target_workbook._number_formats.add(number_format) + BUILTIN_FORMATS_MAX_SIZE
+            mapped.pivotButton = source_style.pivotButton
+            mapped.quotePrefix = source_style.quotePrefix
+            # Named styles are only kept if the target already defines one with the same name
+            if source_style.xfId < len(source_workbook._named_styles):
+                mapped.xfId = target_named_styles.get(source_workbook._named_styles[source_style.xfId].name, 0)
+            style_cache[key] = mapped
+        return copy(mapped)
+
+    return map_style
 
-# Helper function to copy sheets (remains unchanged)
 def copy_sheet_between_workbooks(source_sheet: Worksheet, target_workbook: Workbook) -> Worksheet:
     """
-    Manually copies a worksheet from a source workbook to a target workbook.
+    Copies a worksheet from a source workbook to a target workbook.
     This replaces the built-in copy_worksheet which only works within the same workbook.
+
+    Cells are copied by style id (see build_style_id_mapper). Merges, column and row
+    dimensions, and print/page settings are carried over in bulk. The print area is
+    deliberately not copied: rows are inserted afterwards and a fixed area would cut them off.
     """
     target_sheet = target_workbook.create_sheet(title=source_sheet.title)
-    for row in source_sheet.iter_rows():
-        for cell in row:
-            new_cell = target_sheet.cell(row=cell.row, column=cell.column, value=cell.value)
-            if cell.has_style:
-                new_cell.font = copy(cell.font)
-                new_cell.border = copy(cell.border)
-                new_cell.fill = copy(cell.fill)
-                new_cell.number_format = cell.number_format
-                new_cell.protection = copy(cell.protection)
-                new_cell.alignment = copy(cell.alignment)
+    map_style = build_style_id_mapper(source_sheet.parent, target_workbook)
+
+    # --- Cells: value + mapped style id, written straight into the cell store ---
+    for (row_idx, col_idx), cell in source_sheet._cells.items():
+        value = None if isinstance(cell, MergedCell) else cell.value
+        target_sheet._cells[(row_idx, col_idx)] = Cell(
+            target_sheet, row=row_idx, column=col_idx, value=value, style_array=map_style(cell._style)
+        )
+
     for merge_range in source_sheet.merged_cells.ranges:
         target_sheet.merge_cells(str(merge_range))
+
+    # --- Column and row dimensions ---
     for col_letter, dim in source_sheet.column_dimensions.items():
-        target_sheet.column_dimensions[col_letter].width = dim.width
-        if dim.hidden:
-              target_sheet.column_dimensions[col_letter].hidden = True
+        target_dim = target_sheet.column_dimensions[col_letter]
+        target_dim.min, target_dim.max = dim.min, dim.max
+        target_dim.width = dim.width
+        target_dim.hidden = dim.hidden
+        target_dim.outlineLevel = dim.outlineLevel
+        target_dim.collapsed = dim.collapsed
+        if dim.has_style:
+            target_dim._style = map_style(dim._style)
     for row_idx, dim in source_sheet.row_dimensions.items():
-        target_sheet.row_dimensions[row_idx].height = dim.height
-        if dim.hidden:
-            target_sheet.row_dimensions[row_idx].hidden = True
+        target_dim = target_sheet.row_dimensions[row_idx]
+        target_dim.height = dim.height
+        target_dim.hidden = dim.hidden
+        target_dim.outlineLevel = dim.outlineLevel
+        target_dim.collapsed = dim.collapsed
+        if dim.has_style:
+            target_dim._style = map_style(dim._style)
+
+    # --- Sheet-level print and view settings ---
+    target_sheet.sheet_format = deepcopy(source_sheet.sheet_format)
+    target_sheet.sheet_properties = deepcopy(source_sheet.sheet_properties)
+    target_sheet.page_margins = deepcopy(source_sheet.page_margins)
+    target_sheet.print_options = deepcopy(source_sheet.print_options)
+    target_sheet.HeaderFooter = deepcopy(source_sheet.HeaderFooter)
+    target_sheet.views = deepcopy(source_sheet.views)
+    for attr in PrintPageSetup.__attrs__:
+        setattr(target_sheet.page_setup, attr, getattr(source_sheet.page_setup, attr))
+    if source_sheet.print_title_rows:
+        target_sheet.print_title_rows = source_sheet.print_title_rows
+    if source_sheet.print_title_cols:
+        target_sheet.print_title_cols = source_sheet.print_title_cols
     return target_sheet
 
-# Other helper functions (calculate_and_inject_totals, preprocess_data_for_numerics, derive_paths, load_json_file) remain unchanged.
+# Other helper functions (calculate_and_inject_totals, derive_paths, load_json_file) remain unchanged.
 
 def calculate_and_inject_totals(data: dict) -> dict:
     """
@@ -60,17 +138,6 @@ def calculate_and_inject_totals(data: dict) -> dict:
     data.setdefault('aggregated_summary', {})['total_pallets'] = grand_total_pallets
     return data
 
-def preprocess_data_for_numerics(data: any, keys_to_convert: set) -> any:
-    """
-    Recursively traverses a data structure (dict or list) and converts
-    string values of specified keys into floats.
-    """
-    if isinstance(data, dict):
-        return {key: preprocess_data_for_numerics(value, keys_to_convert) if key not in keys_to_convert or not isinstance(value, list) else [float(item.replace(',', '')) if isinstance(item, str) else item for item in value] for key, value in data.items()}
-    elif isinstance(data, list):
-        return [preprocess_data_for_numerics(item, keys_to_convert) for item in data]
-    return data
-
 def derive_paths(input_data_path_str: str, template_dir_str: str, config_dir_str: str) -> dict | None:
     """
     Derives template and config file paths based on the input data filename.
@@ -78,46 +145,19 @@ def derive_paths(input_data_path_str: str, template_dir_str: str, config_dir_str
     print(f"Deriving paths from input: {input_data_path_str}")
     try:
         input_data_path, template_dir, config_dir = Path(input_data_path_str).resolve(), Path(template_dir_str).resolve(), Path(config_dir_str).resolve()
-        
-        # --- START OF DEBUG BLOCK 1 ---
-        print("\n--- WEB APP PATH DIAGNOSTICS ---")
-        print(f"DEBUG: Input data file path resolves to: {input_data_path}")
-        print(f"DEBUG: Template directory resolves to: {template_dir}")
-        print(f"DEBUG: Config directory resolves to: {config_dir}")
-        print(f"DEBUG: Checking initial existence...")
-        print(f"DEBUG:   Input exists? -> {input_data_path.exists()}")
-        print(f"DEBUG:   Template dir exists? -> {template_dir.exists()}")
-        print(f"DEBUG:   Config dir exists? -> {config_dir.exists()}")
-        print("--- END OF DEBUG BLOCK 1 ---\n")
-        # --- END OF DEBUG BLOCK 1 ---
 
         if not all([p.exists() for p in [input_data_path, template_dir, config_dir]]):
             print("Error: One or more paths (input file, template dir, config dir) not found.")
             return None
-        
-        template_name_part = re.sub(r'(_data|_input|_pkl)$', '', input_data_path.stem, flags=re.IGNORECASE)
-        print(f"Derived template name part: '{template_name_part}'")
-        
-        for prefix in [template_name_part, (re.match(r'^([a-zA-Z]+)', template_name_part) or [''])[0]]:
-            if not prefix: continue
-            template_path, config_path = template_dir / f"{prefix}.xlsx", config_dir / f"{prefix}_config.json"
-            
-            # --- START OF DEBUG BLOCK 2 ---
-            print("-" * 20)
-            print(f"DEBUG: Attempting with prefix: '{prefix}'")
-            print(f"DEBUG: Checking for template -> {template_path.resolve()}")
-            print(f"DEBUG: Template exists? -> {template_path.is_file()}")
-            print(f"DEBUG: Checking for config -> {config_path.resolve()}")
-            print(f"DEBUG: Config exists? -> {config_path.is_file()}")
-            print("-" * 20)
-            # --- END OF DEBUG BLOCK 2 ---
-
-            if template_path.is_file() and config_path.is_file():
-                print(f"Found match for template and config using prefix: '{prefix}'")
-                return {"data": input_data_path, "template": template_path, "config": config_path}
-                
-        print("Error: Could not find matching template/config files.")
-        return None
+
+        # Exact name part first, then its leading letters; pairs come from the startup registry.
+        # Only the _data/_input/_pkl suffixes are stripped here, never a leading 'data_'.
+        pair = template_registry_utils.get_registry(template_dir, config_dir).resolve(input_data_path.stem, strip_data_prefix=False)
+        if pair is None:
+            print("Error: Could not find matching template/config files.")
+            return None
+        print(f"Found match for template and config using prefix: '{pair.name}'")
+        return {"data": input_data_path, "template": pair.template, "config": pair.config}
     except Exception as e:
         print(f"Error deriving file paths: {e}"); return None
 
@@ -130,6 +170,103 @@ def load_json_file(file_path: Path, file_type: str) -> dict:
         print(f"FATAL ERROR: Could not load or parse {file_type} file {file_path}. Error: {e}"); sys.exit(1)
 
 
+# --- Per-process template cache: each pool worker loads the template once and reuses it ---
+_TEMPLATE_CACHE: Dict[str, Workbook] = {}
+
+def get_cached_template(template_path: Union[str, Path]) -> Workbook:
+    """Returns the loaded template workbook for this process, loading it on first use."""
+    key = str(Path(template_path).resolve())
+    if key not in _TEMPLATE_CACHE:
+        print(f"Loading template from '{template_path}'...")
+        _TEMPLATE_CACHE[key] = openpyxl.load_workbook(template_path)
+    return _TEMPLATE_CACHE[key]
+
+def render_sheet(template_workbook: Workbook, sheet_name: str, sheet_config: dict, invoice_data: dict,
+                 output_dir: Path, po_number: str, template_index: Optional[dict] = None,
+                 compress_level: Optional[int] = None) -> Optional[Path]:
+    """
+    Renders one configured sheet of the template into its own workbook and saves it.
+
+    Args:
+        template_workbook: The loaded template workbook (read only; never modified).
+        sheet_name: The sheet to render.
+        sheet_config: The sheet's entry in the config's 'sheets_to_process'.
+        invoice_data: The preprocessed invoice data.
+        output_dir: Directory the output file is written to.
+        po_number: PO number used in the output filename.
+        template_index: Optional template index (see template_index_utils) used instead of scanning.
+        compress_level: Deflate level for the saved file (see workbook_save_utils).
+
+    Returns:
+        The path of the saved file, or None if the sheet type is unknown.
+    """
+    print(f"\n--- Preparing new file for sheet: '{sheet_name}' ---")
+    output_workbook = openpyxl.Workbook()
+    worksheet = copy_sheet_between_workbooks(template_workbook[sheet_name], output_workbook)
+    if 'Sheet' in output_workbook.sheetnames: output_workbook.remove(output_workbook['Sheet'])
+
+    print(f"--- Processing Content for: '{sheet_name}' ---")
+    process_type = sheet_config.get("type")
+    text_cells = template_index_utils.text_cells_by_sheet(template_index)
+
+    if process_type == "summary":
+        print(f"Processing '{sheet_name}' as summary (text replacement).")
+        text_replace_utils.find_and_replace(output_workbook, sheet_config.get("replacements", []), 50, 20, invoice_data, text_cells)
+
+    elif process_type == "packing_list":
+        print(f"Processing '{sheet_name}' as a packing list.")
+
+        # --- REVISION ---
+        # First, perform the standard text replacement for any placeholders on the sheet.
+        print(" -> Step 1: Performing text replacement for placeholders...")
+        text_replace_utils.find_and_replace(output_workbook, sheet_config.get("replacements", []), 50, 20, invoice_data, text_cells)
+
+        # Second, continue with the detailed packing list table generation.
+        print(" -> Step 2: Generating detailed packing list table...")
+        start_row = sheet_config.get("start_row", 1)
+        merges_to_restore = merge_utils.store_original_merges(output_workbook, [sheet_name], template_index)
+        rows_to_add = packing_list_utils.calculate_rows_to_generate(invoice_data, sheet_config)
+        if rows_to_add > 0:
+            print(f"    -> Inserting {rows_to_add} rows at row {start_row}...")
+            merge_utils.force_unmerge_from_row_down(worksheet, start_row)
+            worksheet.insert_rows(start_row, amount=rows_to_add)
+
+        packing_list_utils.generate_full_packing_list(worksheet, start_row, invoice_data, sheet_config)
+        merge_utils.find_and_restore_merges_heuristic(output_workbook, merges_to_restore, [sheet_name])
+
+    else:
+        print(f"Warning: Unknown process type '{process_type}' for sheet '{sheet_name}'. Skipping.")
+        output_workbook.close()
+        return None
+
+    # --- THIS IS THE KEY LINE FOR THE FILENAME ---
+    # It creates the filename as "{Sheet Name} {PO Number}.xlsx"
+    sheet_output_path = output_dir / f"{sheet_name} {po_number}.xlsx"
+
+    print(f"\n--- Saving final workbook to '{sheet_output_path}' ---")
+    workbook_save_utils.save_workbook(output_workbook, sheet_output_path, compress_level)
+    output_workbook.close()
+    print(f"Processing complete for sheet '{sheet_name}'.")
+    return sheet_output_path
+
+def _render_sheet_job(template_path: str, sheet_name: str, sheet_config: dict, invoice_data: dict,
+                      output_dir: str, po_number: str, template_index: Optional[dict] = None,
+                      compress_level: Optional[int] = None) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Renders one sheet and never raises, so one failing sheet cannot take down the others.
+    Used both in-process and as the process-pool task.
+
+    Returns:
+        A tuple of (sheet_name, output path or None, error traceback or None).
+    """
+    try:
+        output_path = render_sheet(get_cached_template(template_path), sheet_name, sheet_config,
+                                   invoice_data, Path(output_dir), po_number, template_index, compress_level)
+        return sheet_name, str(output_path) if output_path else None, None
+    except Exception:
+        return sheet_name, None, traceback.format_exc()
+
+
 def main():
     """Main function to orchestrate hybrid invoice generation."""
     parser = argparse.ArgumentParser(description="Generate invoice documents from a JSON data file.")
@@ -137,6 +274,10 @@ def main():
     parser.add_argument("-o", "--outputdir", default=".", help="Output directory for the generated Excel files.")
     parser.add_argument("-t", "--templatedir", default="./TEMPLATE", help="Directory for template files.")
     parser.add_argument("-c", "--configdir", default="./config", help="Directory for config files.")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Render sheets in parallel with this many worker processes (default: 1, sequential).")
+    parser.add_argument("--compress-level", type=int, default=None,
+                        help="Deflate level 0-9 for the saved files (0 = stored, default: INVOICE_COMPRESS_LEVEL or 6).")
     args = parser.parse_args()
 
     print("--- Starting Hybrid Invoice Generation ---")
@@ -151,74 +292,58 @@ def main():
     invoice_data = load_json_file(paths['data'], "data")
     config = load_json_file(paths['config'], "config")
 
-    keys_to_convert = {'net', 'amount', 'price', 'unit', 'cbm'}
-    invoice_data = preprocess_data_for_numerics(invoice_data, keys_to_convert)
+    data_schema_utils.apply_numeric_schema(invoice_data)
     invoice_data = calculate_and_inject_totals(invoice_data)
-    
-    template_workbook = None
+
     try:
-        print(f"Loading template from '{paths['template']}'...")
-        template_workbook = openpyxl.load_workbook(paths['template'])
-        sheets_to_process_config = config.get("sheets_to_process", {})
-
-        for sheet_name, sheet_config in sheets_to_process_config.items():
-            if sheet_name not in template_workbook.sheetnames:
-                print(f"Warning: Sheet '{sheet_name}' from config not found in template. Skipping.")
-                continue
-
-            print(f"\n--- Preparing new file for sheet: '{sheet_name}' ---")
-            output_workbook = openpyxl.Workbook()
-            worksheet = copy_sheet_between_workbooks(template_workbook[sheet_name], output_workbook)
-            if 'Sheet' in output_workbook.sheetnames: output_workbook.remove(output_workbook['Sheet'])
-            
-            print(f"--- Processing Content for: '{sheet_name}' ---")
-            process_type = sheet_config.get("type")
-
-            if process_type == "summary":
-                print(f"Processing '{sheet_name}' as summary (text replacement).")
-                text_replace_utils.find_and_replace(output_workbook, sheet_config.get("replacements", []), 50, 20, invoice_data)
-
-            elif process_type == "packing_list":
-                print(f"Processing '{sheet_name}' as a packing list.")
-                
-                # --- REVISION ---
-                # First, perform the standard text replacement for any placeholders on the sheet.
-                print(" -> Step 1: Performing text replacement for placeholders...")
-                text_replace_utils.find_and_replace(output_workbook, sheet_config.get("replacements", []), 50, 20, invoice_data)
-
-                # Second, continue with the detailed packing list table generation.
-                print(" -> Step 2: Generating detailed packing list table...")
-                start_row = sheet_config.get("start_row", 1)
-                merges_to_restore = merge_utils.store_original_merges(output_workbook, [sheet_name])
-                rows_to_add = packing_list_utils.calculate_rows_to_generate(invoice_data, sheet_config)
-                if rows_to_add > 0:
-                    print(f"    -> Inserting {rows_to_add} rows at row {start_row}...")
-                    merge_utils.force_unmerge_from_row_down(worksheet, start_row)
-                    worksheet.insert_rows(start_row, amount=rows_to_add)
-                
-                packing_list_utils.generate_full_packing_list(worksheet, start_row, invoice_data, sheet_config)
-                merge_utils.find_and_restore_merges_heuristic(output_workbook, merges_to_restore, [sheet_name])
-            
-            else:
-                print(f"Warning: Unknown process type '{process_type}' for sheet '{sheet_name}'. Skipping.")
+        template_index = template_index_utils.load_template_index(paths['template'])
+        if template_index:
+            template_sheetnames = template_index["sheetnames"]
+        else:
+            template_probe = openpyxl.load_workbook(paths['template'], read_only=True)
+            template_sheetnames = template_probe.sheetnames
+            template_probe.close()
+    except Exception as e:
+        print(f"\n--- A CRITICAL ERROR occurred while reading the template: {e} ---"); sys.exit(1)
 
-            # --- THIS IS THE KEY LINE FOR THE FILENAME ---
-            # It creates the filename as "{Sheet Name} {PO Number}.xlsx"
-            sheet_output_path = output_dir / f"{sheet_name} {po_number}.xlsx"
-            
-            print(f"\n--- Saving final workbook to '{sheet_output_path}' ---")
-            output_workbook.save(sheet_output_path)
-            output_workbook.close()
-            print(f"Processing complete for sheet '{sheet_name}'.")
+    sheets_to_render = []
+    for sheet_name, sheet_config in config.get("sheets_to_process", {}).items():
+        if sheet_name not in template_sheetnames:
+            print(f"Warning: Sheet '{sheet_name}' from config not found in template. Skipping.")
+            continue
+        sheets_to_render.append((sheet_name, sheet_config))
 
-    except Exception as e:
-        print(f"\n--- A CRITICAL ERROR occurred: {e} ---")
-        import traceback
-        traceback.print_exc()
-    finally:
-        if template_workbook:
+    job_args = [(str(paths['template']), sheet_name, sheet_config, invoice_data, str(output_dir), po_number, template_index,
+                 args.compress_level)
+                for sheet_name, sheet_config in sheets_to_render]
+    num_workers = min(max(args.workers, 1), len(job_args)) if job_args else 1
+
+    if num_workers > 1:
+        print(f"Rendering {len(job_args)} sheets with {num_workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=get_cached_template,
+                                 initargs=(str(paths['template']),)) as pool:
+            # Submit everything first, then collect in config order
+            futures = [pool.submit(_render_sheet_job, *job) for job in job_args]
+            results = [future.result() for future in futures]
+    else:
+        results = [_render_sheet_job(*job) for job in job_args]
+        for template_workbook in _TEMPLATE_CACHE.values():
             template_workbook.close()
-            print("\nTemplate workbook closed.")
+        _TEMPLATE_CACHE.clear()
+        print("\nTemplate workbook closed.")
+
+    failed_sheets = []
+    print("\n--- Hybrid Generation Summary ---")
+    for sheet_name, output_path, error in results:
+        if error:
+            failed_sheets.append(sheet_name)
+            print(f"  FAILED  '{sheet_name}':\n{error}")
+        else:
+            print(f"  OK      '{sheet_name}' -> {output_path or 'skipped'}")
+
+    if failed_sheets:
+        print(f"\n--- A CRITICAL ERROR occurred in sheet(s): {', '.join(failed_sheets)} ---")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -9,6 +9,8 @@ from typing import List, Dict, Any, Optional, Tuple, Union
 from decimal import Decimal
 from decimal import Decimal, InvalidOperation
 import merge_utils
+from row_prototype_utils import RowPrototype
+from data_schema_utils import to_numeric
 
 # --- Constants for Styling ---
 thin_side = Side(border_style="thin", color="000000")
@@ -247,37 +249,56 @@ def apply_row_merges(worksheet: Worksheet, row_num: int, num_cols: int, merge_ru
             # Log or handle other merge errors
             pass
 
-def _apply_cell_style(cell, column_id: Optional[str], sheet_styling_config: Optional[Dict[str, Any]] = None, fob_mode: Optional[bool] = False):
+def resolve_column_style(column_id: str, sheet_styling_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resolves the font, alignment, and number format for a column ID by layering
+    its 'column_id_styles' entry over the sheet defaults.
+
+    Returns:
+        A dictionary with 'font' (Font or None), 'alignment' (Alignment or None)
+        and 'number_format' (str or None).
+    """
+    default_font_cfg = sheet_styling_config.get("default_font", {})
+    default_align_cfg = sheet_styling_config.get("default_alignment", {})
+    column_styles = sheet_styling_config.get("column_id_styles", {}) # <-- Uses "column_id_styles"
+
+    # Find column-specific style rules if the ID matches
+    col_specific_style = column_styles.get(column_id, {})
+
+    final_font_cfg = default_font_cfg.copy()
+    final_font_cfg.update(col_specific_style.get("font", {}))
+    final_align_cfg = default_align_cfg.copy()
+    final_align_cfg.update(col_specific_style.get("alignment", {}))
+
+    return {
+        "font": Font(**{k: v for k, v in final_font_cfg.items() if v is not None}) if final_font_cfg else None,
+        "alignment": Alignment(**{k: v for k, v in final_align_cfg.items() if v is not None}) if final_align_cfg else None,
+        "number_format": col_specific_style.get("number_format"),
+    }
+
+def _apply_cell_style(cell, column_id: Optional[str], sheet_styling_config: Optional[Dict[str, Any]] = None, fob_mode: Optional[bool] = False,
+                      resolved_style: Optional[Dict[str, Any]] = None):
     """
     Applies font, alignment, and number format to a cell based on a column ID.
+    A pre-resolved style (see resolve_column_style) can be passed to skip rebuilding style objects per cell.
     """
     if not sheet_styling_config or not cell or not column_id:
         return
 
     try:
-        # Get styling configurations using ID-based keys
-        default_font_cfg = sheet_styling_config.get("default_font", {})
-        default_align_cfg = sheet_styling_config.get("default_alignment", {})
-        column_styles = sheet_styling_config.get("column_id_styles", {}) # <-- Uses "column_id_styles"
-
-        # Find column-specific style rules if the ID matches
-        col_specific_style = column_styles.get(column_id, {})
+        style = resolved_style if resolved_style is not None else resolve_column_style(column_id, sheet_styling_config)
 
         # --- Apply Font ---
-        final_font_cfg = default_font_cfg.copy()
-        final_font_cfg.update(col_specific_style.get("font", {}))
-        if final_font_cfg:
-            cell.font = Font(**{k: v for k, v in final_font_cfg.items() if v is not None})
+        if style["font"] is not None:
+            cell.font = style["font"]
 
         # --- Apply Alignment ---
-        final_align_cfg = default_align_cfg.copy()
-        final_align_cfg.update(col_specific_style.get("alignment", {}))
-        if final_align_cfg:
-            cell.alignment = Alignment(**{k: v for k, v in final_align_cfg.items() if v is not None})
-            
+        if style["alignment"] is not None:
+            cell.alignment = style["alignment"]
+
         # --- Apply Number Format ---
-        number_format = col_specific_style.get("number_format")
-        
+        number_format = style["number_format"]
+
         # PCS always uses config format, never forced format
         if column_id in ['col_pcs', 'col_qty_pcs']:
             if number_format and cell.number_format != FORMAT_TEXT:
@@ -900,25 +921,6 @@ def apply_explicit_data_cell_merges_by_id(
         except Exception as e:
             print(f"Error applying explicit data cell merge for ID '{col_id}' on row {row_num}: {e}")
 
-def _to_numeric(value: Any) -> Union[int, float, None, Any]:
-    """
-    Safely attempts to convert a value to a float or int.
-    Handles strings with commas and returns the original value on failure.
-    """
-    if isinstance(value, (int, float)):
-        return value
-    if isinstance(value, str):
-        try:
-            cleaned_val = value.replace(',', '').strip()
-            if not cleaned_val:
-                return None
-            return float(cleaned_val) if '.' in cleaned_val else int(cleaned_val)
-        except (ValueError, TypeError):
-            return value # Return original string if conversion fails
-    if isinstance(value, Decimal):
-        return float(value)
-    return value # Return original value for other types
-
 def _apply_fallback(
     row_dict: Dict[int, Any],
     target_col_idx: int,
@@ -946,15 +948,19 @@ def prepare_data_rows(
     num_static_labels: int,
     static_value_map: Dict[int, Any],
     fob_mode: bool,
+    rule_by_id: Optional[Dict[str, Any]] = None,
 ) -> Tuple[List[Dict[int, Any]], List[int], bool, int]:
     """
     Corrected version with typo fix and improved fallback flexibility.
+    'rule_by_id' (from a compiled layout plan) replaces the per-cell scan of dynamic_mapping_rules.
     """
     data_rows_prepared = []
     pallet_counts_for_rows = []
     num_data_rows_from_source = 0
     dynamic_desc_used = False
     
+    # Values are normally typed at load time (data_schema_utils.apply_numeric_schema); to_numeric
+    # returns typed values unchanged and only parses data the schema doesn't cover.
     NUMERIC_IDS = {"col_qty_pcs", "col_qty_sf", "col_unit_price", "col_amount", "col_net", "col_gross", "col_cbm"}
 
     # --- Handler for FOB Aggregation (Uses new fallback logic) ---
@@ -975,15 +981,18 @@ def prepare_data_rows(
                 is_empty = data_value is None or (isinstance(data_value, str) and not data_value.strip())
 
                 if not is_empty:
-                    row_dict[target_col_idx] = _to_numeric(data_value)
+                    row_dict[target_col_idx] = to_numeric(data_value)
                     if col_id == "col_desc":
                         dynamic_desc_used = True
                 else:
-                    mapping_rule_for_id = {}
-                    for rule in dynamic_mapping_rules.values():
-                        if rule.get("id") == col_id:
-                            mapping_rule_for_id = rule
-                            break
+                    if rule_by_id is not None:
+                        mapping_rule_for_id = rule_by_id.get(col_id, {})
+                    else:
+                        mapping_rule_for_id = {}
+                        for rule in dynamic_mapping_rules.values():
+                            if rule.get("id") == col_id:
+                                mapping_rule_for_id = rule
+                                break
                     _apply_fallback(row_dict, target_col_idx, mapping_rule_for_id, fob_mode)
 
             if price_col_idx:
@@ -1004,8 +1013,8 @@ def prepare_data_rows(
             # Directly map known values first
             row_dict[column_id_map.get("col_po")] = key_tuple[0]
             row_dict[column_id_map.get("col_item")] = key_tuple[1]
-            row_dict[column_id_map.get("col_qty_sf")] = _to_numeric(value_dict.get("sqft_sum"))
-            row_dict[column_id_map.get("col_amount")] = _to_numeric(value_dict.get("amount_sum"))
+            row_dict[column_id_map.get("col_qty_sf")] = to_numeric(value_dict.get("sqft_sum"))
+            row_dict[column_id_map.get("col_amount")] = to_numeric(value_dict.get("amount_sum"))
 
             if desc_col_idx_local:
                 desc_value = key_tuple[3]
@@ -1072,7 +1081,7 @@ def prepare_data_rows(
                 is_empty = data_value is None or (isinstance(data_value, str) and not data_value.strip())
                 
                 if not is_empty:
-                    if target_id in NUMERIC_IDS: data_value = _to_numeric(data_value)
+                    if target_id in NUMERIC_IDS: data_value = to_numeric(data_value)
                     row_dict[target_col_idx] = data_value
                     if target_id == 'col_desc':
                         dynamic_desc_used = True
@@ -1098,24 +1107,6 @@ def prepare_data_rows(
     
     return data_rows_prepared, pallet_counts_for_rows, dynamic_desc_used, num_data_rows_from_source
 
-# Helper functions _to_numeric and _apply_fallback would be defined elsewhere in your code.
-# For example:
-def _to_numeric(value: Any) -> Any:
-    """Converts a value to a numeric type if possible."""
-    if isinstance(value, (int, float)):
-        return value
-    if isinstance(value, str):
-        try:
-            return int(value)
-        except (ValueError, TypeError):
-            try:
-                return float(value)
-            except (ValueError, TypeError):
-                pass
-    return value
-
-
-
 def parse_mapping_rules(
     mapping_rules: Dict[str, Any],
     column_id_map: Dict[str, int],
@@ -1539,11 +1530,14 @@ def fill_invoice_data(
     custom_flag: bool = False, # Added custom flag parameter
     data_cell_merging_rules: Optional[Dict[str, Any]] = None, # Added data cell merging rules 29/05/2025
     fob_mode: Optional[bool] = False,
+    layout_plan: Optional[Any] = None, # Compiled SheetLayoutPlan from layout_plan_utils
     ) -> Tuple[bool, int, int, int, int]: # Still 5 return values
     """
     REVISED LOGIC V13: Added merge_rules_footer parameter.
     Footer pallet count uses local_chunk_pallets for processed_tables,
     and grand_total_pallets for aggregation/fob_aggregation.
+    If a layout_plan matching header_info is given, its pre-parsed rules and resolved
+    column styles are used instead of re-deriving them from the raw config.
     """
 
     # --- Initialize Variables --- (Keep existing initializations)
@@ -1638,11 +1632,17 @@ def fill_invoice_data(
                      except Exception as align_err: # Catch other potential errors
                           print(f"Warning: Error applying header_alignment config: {align_err}. Using default.")
                           pass # Keep default alignment on error
-        parsed_rules = parse_mapping_rules(
-            mapping_rules=mapping_rules,
-            column_id_map=col_id_map,
-            idx_to_header_map=idx_to_header_map
-        )
+        # Use the compiled plan when it was built for this exact header layout
+        use_plan = layout_plan is not None and layout_plan.matches_header(header_info)
+        if use_plan:
+            parsed_rules = layout_plan.parsed_rules
+        else:
+            parsed_rules = parse_mapping_rules(
+                mapping_rules=mapping_rules,
+                column_id_map=col_id_map,
+                idx_to_header_map=idx_to_header_map
+            )
+        resolved_column_styles = layout_plan.column_styles if use_plan else {}
 
         # Unpack the results into local variables for the rest of the function to use
         static_value_map = parsed_rules["static_value_map"]
@@ -1669,6 +1669,7 @@ def fill_invoice_data(
             num_static_labels=num_static_labels,
             static_value_map=static_value_map,
             fob_mode=fob_mode,
+            rule_by_id=layout_plan.rule_by_id if use_plan else None,
         )
 # --- Determine Final Number of Data Rows ---
 # The number of rows to process is the greater of the number of data rows or static labels.
@@ -1761,6 +1762,65 @@ def fill_invoice_data(
             grid_column_ids = sheet_styling_config.get("column_ids_with_full_grid", []) if sheet_styling_config else []
 
             row_pallet_index = 0
+
+            def _data_row_values(i: int, target_row: int, row_data_dict: Dict[int, Any], display_pallet_order: int) -> Dict[int, Any]:
+                """Resolves the value of every column in data row `i`."""
+                row_values = {}
+                for c_idx in range(1, num_columns + 1):
+                    # --- Priority 1: Handle Initial Static Label Column ---
+                    if i < num_static_labels and c_idx == col1_index:
+                        row_values[c_idx] = initial_static_col1_values[i]
+                        continue
+
+                    # --- Priority 2: Handle Regular Data Rows ---
+                    # Get the value that was prepared by the "kitchen"
+                    prepared_value = row_data_dict.get(c_idx)
+                    value_to_write = None
+
+                    # First, check if the prepared value is a formula hint
+                    if isinstance(prepared_value, dict) and prepared_value.get("type") == "formula":
+                        rule = prepared_value
+                        formula_template = rule.get("template")
+                        input_ids = rule.get("inputs", [])
+                        formula_params = {'row': target_row}
+                        valid_inputs = True
+                        for idx, input_id in enumerate(input_ids):
+                            input_col_idx = col_id_map.get(input_id)
+                            if input_col_idx:
+                                formula_params[f'col_ref_{idx}'] = get_column_letter(input_col_idx)
+                            else:
+                                valid_inputs = False; break
+                        
+                        if valid_inputs and formula_template:
+                            value_to_write = f"={formula_template.format(**formula_params)}"
+                        else:
+                            value_to_write = "#REF!"
+                    
+                    # If not a hint, check for your original special columns
+                    elif c_idx == no_col_idx:
+                        value_to_write = i + 1
+                    elif c_idx == pallet_info_col_idx:
+                        value_to_write = f"{display_pallet_order}-{local_chunk_pallets}"
+
+                    # If none of the above, it's just plain data
+                    else:
+                        value_to_write = prepared_value
+                    row_values[c_idx] = value_to_write
+                return row_values
+
+            # --- Row prototype: interior data rows are styled identically, so one is captured
+            # and stamped onto the rest. Only number formats that depend on the value's type
+            # (General columns without a configured format) are re-decided per cell. ---
+            row_prototype = None
+            value_typed_format_cols = []
+            if sheet_styling_config:
+                for c_idx in range(1, num_columns + 1):
+                    current_id = idx_to_id_map.get(c_idx)
+                    if not current_id or current_id in force_text_format_ids or current_id in ['col_pcs', 'col_qty_pcs']:
+                        continue
+                    column_style = resolved_column_styles.get(current_id) or resolve_column_style(current_id, sheet_styling_config)
+                    if not column_style["number_format"]:
+                        value_typed_format_cols.append(c_idx)
             
             # --- Main Data-Writing Loop ---
             for i in range(actual_rows_to_process):
@@ -1774,59 +1834,30 @@ def fill_invoice_data(
                 if current_row_pallet_count is not None and current_row_pallet_count > 0:
                     row_pallet_index += 1
                 display_pallet_order = row_pallet_index
+                row_values = _data_row_values(i, target_row, row_data_dict, display_pallet_order)
+
+                # --- Fast path: stamp the captured interior row ---
+                if row_prototype is not None and not is_last_data_row:
+                    row_prototype.stamp(worksheet, target_row, row_values, apply_height=False)
+                    for c_idx in value_typed_format_cols:
+                        cell = worksheet.cell(row=target_row, column=c_idx)
+                        cell_value = cell.value
+                        if isinstance(cell_value, float): cell.number_format = FORMAT_NUMBER_COMMA_SEPARATED2
+                        elif isinstance(cell_value, int): cell.number_format = FORMAT_NUMBER_COMMA_SEPARATED1
+                        else: cell.number_format = FORMAT_GENERAL
+                    continue
                 
                 # --- Cell Filling and Styling Loop ---
                 for c_idx in range(1, num_columns + 1):
                     cell = worksheet.cell(row=target_row, column=c_idx)
                     current_id = idx_to_id_map.get(c_idx)
-                    value_to_write = None
+                    cell.value = row_values[c_idx]
 
-                    # --- Priority 1: Handle Initial Static Label Column ---
-                    if i < num_static_labels and c_idx == col1_index:
-                        cell.value = initial_static_col1_values[i]
-                    
-                    # --- Priority 2: Handle Regular Data Rows ---
-                    else:
-                        # Get the value that was prepared by the "kitchen"
-                        prepared_value = row_data_dict.get(c_idx)
-                        value_to_write = None
-
-                        # First, check if the prepared value is a formula hint
-                        if isinstance(prepared_value, dict) and prepared_value.get("type") == "formula":
-                            rule = prepared_value
-                            formula_template = rule.get("template")
-                            input_ids = rule.get("inputs", [])
-                            formula_params = {'row': target_row}
-                            valid_inputs = True
-                            for idx, input_id in enumerate(input_ids):
-                                input_col_idx = col_id_map.get(input_id)
-                                if input_col_idx:
-                                    formula_params[f'col_ref_{idx}'] = get_column_letter(input_col_idx)
-                                else:
-                                    valid_inputs = False; break
-                            
-                            if valid_inputs and formula_template:
-                                value_to_write = f"={formula_template.format(**formula_params)}"
-                            else:
-                                value_to_write = "#REF!"
-                        
-                        # If not a hint, check for your original special columns
-                        elif c_idx == no_col_idx:
-                            value_to_write = i + 1
-                        elif c_idx == pallet_info_col_idx:
-                            value_to_write = f"{display_pallet_order}-{local_chunk_pallets}"
-
-                        # If none of the above, it's just plain data
-                        else:
-                            value_to_write = prepared_value
-                        
-                        # Finally, write the chosen value to the cell once
-                        cell.value = value_to_write
                     # --- Apply Cell Styling and Formatting ---
                     if current_id in force_text_format_ids:
                         cell.number_format = FORMAT_TEXT
                     
-                    _apply_cell_style(cell, current_id, sheet_styling_config, fob_mode)
+                    _apply_cell_style(cell, current_id, sheet_styling_config, fob_mode, resolved_column_styles.get(current_id))
 
                 # --- Apply Border Rules for the entire row ---
                 for c_idx_border in range(1, num_columns + 1):
@@ -1857,6 +1888,10 @@ def fill_invoice_data(
                         fob_mode=fob_mode
                     )
 
+                # The second row is the first interior row (not first, not last): capture it
+                if i == 1 and actual_rows_to_process > 3:
+                    row_prototype = RowPrototype.capture(worksheet, target_row, num_columns)
+
         except Exception as fill_data_err:
             print(f"Error during data filling loop: {fill_data_err}\n{traceback.format_exc()}")
             return False, footer_row_final + 1, data_start_row, data_end_row, 0
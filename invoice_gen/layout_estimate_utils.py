@@ -0,0 +1,493 @@
+# layout_estimate_utils.py
+# Dry-run layout estimator: predicts what generate_invoice.py will lay out for a given invoice JSON,
+# config and mode (normal / --fob / --custom) without opening the template workbook.
+# The row accounting mirrors the generator (write_header, fill_invoice_data, pre_calculate_and_insert_rows,
+# the grand total / summary / weight summary rows and row_spacing), so the result lists, per sheet:
+# the row ranges of every table (header, data, blank rows, footer), the rows inserted into the template,
+# the merges the generator creates, and a printed page estimate. With a template index
+# (template_index_utils) the template's own height, merges and page setup are taken into account too.
+# Merges that depend on cell values (equal neighbouring descriptions/pallets) are only named by column.
+#
+# Usage: python layout_estimate_utils.py data/JF.json [-t TEMPLATE] [-c config] [--fob | --custom] [--json]
+
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from openpyxl.utils import get_column_letter
+
+import layout_plan_utils
+
+# Paper sizes (portrait width, height) in points, by the sheet's paperSize code
+PAPER_SIZES_PT = {
+    1: (612.0, 792.0),    # Letter
+    5: (612.0, 1008.0),   # Legal
+    8: (842.0, 1191.0),   # A3
+    9: (595.0, 842.0),    # A4
+    11: (420.0, 595.0),   # A5
+}
+DEFAULT_PAPER_SIZE = 9
+DEFAULT_ROW_HEIGHT = 15.0
+DEFAULT_MARGIN_INCHES = 0.75
+
+# Columns whose equal neighbouring values are merged vertically after the data rows are written
+CONTENT_MERGE_COLUMN_IDS = ("col_desc", "col_pallet", "col_hs")
+
+
+def resolve_data_source(sheet_name: str, data_source_indicator: str, invoice_data: Dict[str, Any],
+                        fob: bool, custom: bool) -> Tuple[Optional[str], Any]:
+    """
+    Picks the data a single-table sheet is filled from (mirrors process_single_table_sheet).
+
+    Returns:
+        (data_source_type, data) or (None, None) if the generator would skip the fill.
+    """
+    if custom and data_source_indicator == 'aggregation':
+        custom_data = invoice_data.get('custom_aggregation_results')
+        if custom_data is not None:
+            return 'custom_aggregation', custom_data
+
+    if fob and sheet_name in ["Invoice", "Contract"]:
+        data_source_indicator = 'fob_aggregation'
+
+    if data_source_indicator == 'fob_aggregation':
+        data = invoice_data.get('final_fob_compounded_result')
+        return ('fob_aggregation', data) if data is not None else (None, None)
+    if data_source_indicator == 'aggregation':
+        data = invoice_data.get('standard_aggregation_results')
+        return ('aggregation', data) if data is not None else (None, None)
+    tables = invoice_data.get('processed_tables_data') or {}
+    if data_source_indicator in tables:
+        return 'processed_tables', tables[data_source_indicator]
+    return None, None
+
+
+def count_source_rows(data_source_type: str, data_source: Any) -> int:
+    """
+    Returns the number of data rows prepare_data_rows produces for a source (before static labels).
+    Aggregation keys are expected as tuples, as returned by generate_invoice.load_data.
+    """
+    if not data_source:
+        return 0
+    if data_source_type == 'custom_aggregation':
+        return sum(1 for key in data_source if isinstance(key, tuple) and len(key) >= 4)
+    if data_source_type in ('aggregation', 'fob_aggregation'):
+        return len(data_source)
+    if data_source_type == 'processed_tables' and isinstance(data_source, dict):
+        return max((len(v) for v in data_source.values() if isinstance(v, list)), default=0)
+    return 0
+
+
+def _row_merge_ranges(row_num: int, num_columns: int, merge_rules: Optional[Dict[str, int]]) -> List[str]:
+    """Returns the ranges apply_row_merges creates for {start column: colspan} rules on one row."""
+    ranges = []
+    try:
+        rules = {int(k): int(v) for k, v in (merge_rules or {}).items()}
+    except (ValueError, TypeError):
+        return ranges
+    for start_col in sorted(rules):
+        colspan = rules[start_col]
+        if start_col < 1 or colspan < 1:
+            continue
+        end_col = min(start_col + colspan - 1, num_columns)
+        if end_col > start_col:
+            ranges.append(f"{get_column_letter(start_col)}{row_num}:{get_column_letter(end_col)}{row_num}")
+    return ranges
+
+
+def _footer_merge_ranges(row_num: int, num_columns: int, column_id_map: Dict[str, int],
+                         footer_config: Dict[str, Any]) -> List[str]:
+    """Returns the ranges write_footer_row creates from 'footer_configurations.merge_rules'."""
+    ranges = []
+    for rule in footer_config.get("merge_rules", []):
+        start_col = column_id_map.get(rule.get("start_column_id"))
+        colspan = rule.get("colspan")
+        if start_col and colspan:
+            end_col = min(start_col + colspan - 1, num_columns)
+            if end_col > start_col:
+                ranges.append(f"{get_column_letter(start_col)}{row_num}:{get_column_letter(end_col)}{row_num}")
+    return ranges
+
+
+def _data_cell_merge_ranges(row_num: int, num_columns: int, column_id_map: Dict[str, int],
+                            merge_rules_data_cells: Optional[Dict[str, Dict[str, Any]]]) -> List[str]:
+    """Returns the ranges apply_explicit_data_cell_merges_by_id creates on one data row."""
+    ranges = []
+    for col_id, rule_details in (merge_rules_data_cells or {}).items():
+        colspan = rule_details.get("rowspan") # The config key is 'rowspan' but it spans columns
+        start_col = column_id_map.get(col_id)
+        if not isinstance(colspan, int) or colspan <= 1 or not start_col:
+            continue
+        end_col = min(start_col + colspan - 1, num_columns)
+        if end_col > start_col:
+            ranges.append(f"{get_column_letter(start_col)}{row_num}:{get_column_letter(end_col)}{row_num}")
+    return ranges
+
+
+def _header_merge_ranges(header_start: int, header_layout: List[Dict[str, Any]]) -> List[str]:
+    """Returns the rowspan/colspan ranges write_header creates for a header starting at `header_start`."""
+    ranges = []
+    for cell_config in header_layout:
+        rowspan, colspan = cell_config.get('rowspan', 1), cell_config.get('colspan', 1)
+        if rowspan > 1 or colspan > 1:
+            abs_row = header_start + cell_config.get('row', 0)
+            abs_col = 1 + cell_config.get('col', 0)
+            ranges.append(f"{get_column_letter(abs_col)}{abs_row}:"
+                          f"{get_column_letter(abs_col + colspan - 1)}{abs_row + rowspan - 1}")
+    return ranges
+
+
+def _estimate_table(sheet_plan: layout_plan_utils.SheetLayoutPlan, sheet_section: Dict[str, Any],
+                    header_start: int, data_writing_start: int, source_rows: int,
+                    row_heights: Dict[int, float]) -> Dict[str, Any]:
+    """
+    Lays out one header + data + footer block the way write_header and fill_invoice_data do.
+    Generated row heights are recorded into `row_heights` (mirrors apply_row_heights).
+    """
+    num_columns = sheet_plan.num_columns
+    num_static_labels = sheet_plan.parsed_rules.get("num_static_labels", 0)
+    num_data_rows = max(source_rows, num_static_labels)
+    header_end = data_writing_start - 1
+
+    row = data_writing_start
+    row_after_header = -1
+    if sheet_section.get("add_blank_after_header", False):
+        row_after_header = row
+        row += 1
+    data_start = row
+    row += num_data_rows
+    row_before_footer = -1
+    if sheet_section.get("add_blank_before_footer", False):
+        row_before_footer = row
+        row += 1
+    footer_row = row
+
+    data_range = [data_start, data_start + num_data_rows - 1] if num_data_rows > 0 else None
+    merges = _header_merge_ranges(header_start, list(sheet_plan.header_layout))
+    if row_after_header > 0:
+        merges += _row_merge_ranges(row_after_header, num_columns, sheet_section.get("merge_rules_after_header"))
+    if data_range:
+        for data_row in range(data_range[0], data_range[1] + 1):
+            merges += _data_cell_merge_ranges(data_row, num_columns, dict(sheet_plan.column_id_map),
+                                              sheet_section.get("data_cell_merging_rule"))
+    if row_before_footer > 0:
+        merges += _row_merge_ranges(row_before_footer, num_columns, sheet_section.get("merge_rules_before_footer"))
+    merges += _footer_merge_ranges(footer_row, num_columns, dict(sheet_plan.column_id_map),
+                                   sheet_section.get("footer_configurations") or {})
+    merges += _row_merge_ranges(footer_row, num_columns, sheet_section.get("merge_rules_footer"))
+
+    # --- Row heights (apply_row_heights) ---
+    heights_cfg = (sheet_section.get("styling") or {}).get("row_heights") or {}
+    header_height = heights_cfg.get("header")
+    if header_height is not None:
+        for r in range(header_start, header_end + 1):
+            row_heights[r] = float(header_height)
+    if heights_cfg.get("after_header") is not None and row_after_header > 0:
+        row_heights[row_after_header] = float(heights_cfg["after_header"])
+    if heights_cfg.get("data_default") is not None and data_range:
+        for r in range(data_range[0], data_range[1] + 1):
+            row_heights[r] = float(heights_cfg["data_default"])
+    if row_before_footer > 0 and header_height:
+        row_heights[row_before_footer] = float(header_height) # _style_row_before_footer uses the header height
+    if heights_cfg.get("before_footer") is not None and row_before_footer > 0:
+        row_heights[row_before_footer] = float(heights_cfg["before_footer"])
+    if heights_cfg.get("footer_matches_header_height", True) and header_height is not None:
+        row_heights[footer_row] = float(header_height)
+    elif heights_cfg.get("footer") is not None:
+        row_heights[footer_row] = float(heights_cfg["footer"])
+
+    return {
+        "header_rows": [header_start, header_end],
+        "blank_after_header_row": row_after_header if row_after_header > 0 else None,
+        "data_rows": data_range,
+        "num_data_rows": num_data_rows,
+        "blank_before_footer_row": row_before_footer if row_before_footer > 0 else None,
+        "footer_row": footer_row,
+        "merges": merges,
+        "content_merge_columns": [col_id for col_id in CONTENT_MERGE_COLUMN_IDS
+                                  if col_id in sheet_plan.column_id_map and num_data_rows > 1],
+    }
+
+
+def estimate_page_count(last_row: int, row_heights: Dict[int, float],
+                        template_sheet: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Estimates how many pages rows 1..last_row print on, from the row heights and the template's
+    page setup (paper size, orientation, margins and print scale). Manual page breaks are ignored.
+    """
+    if last_row <= 0:
+        return 0
+    page_setup = (template_sheet or {}).get("page_setup") or {}
+    if page_setup.get("fit_to_page") and page_setup.get("fit_to_height"):
+        return int(page_setup["fit_to_height"])
+
+    width, height = PAPER_SIZES_PT.get(page_setup.get("paper_size") or DEFAULT_PAPER_SIZE, PAPER_SIZES_PT[DEFAULT_PAPER_SIZE])
+    if page_setup.get("orientation") == "landscape":
+        width, height = height, width
+    margin_top = page_setup.get("margin_top")
+    margin_bottom = page_setup.get("margin_bottom")
+    margins = ((DEFAULT_MARGIN_INCHES if margin_top is None else margin_top) +
+               (DEFAULT_MARGIN_INCHES if margin_bottom is None else margin_bottom)) * 72.0
+    scale = (page_setup.get("scale") or 100) / 100.0
+    printable_height = (height - margins) / scale
+    if printable_height <= 0:
+        return None
+
+    default_height = page_setup.get("default_row_height") or DEFAULT_ROW_HEIGHT
+    total_height = sum(row_heights.get(r, default_height) for r in range(1, last_row + 1))
+    return max(1, -(-int(total_height) // int(printable_height)))
+
+
+def estimate_sheet_layout(sheet_name: str, sheet_plan: layout_plan_utils.SheetLayoutPlan, sheet_section: Dict[str, Any],
+                          data_source_indicator: Optional[str], invoice_data: Dict[str, Any], fob: bool, custom: bool,
+                          template_sheet: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Estimates one sheet's layout.
+
+    Args:
+        sheet_name: The sheet name.
+        sheet_plan: The sheet's compiled layout plan.
+        sheet_section: The sheet's section from 'data_mapping'.
+        data_source_indicator: The sheet's 'sheet_data_map' entry (after the FOB override).
+        invoice_data: The loaded invoice data.
+        fob: Estimate for --fob.
+        custom: Estimate for --custom.
+        template_sheet: The sheet's entry in the template index, if available.
+
+    Returns:
+        A JSON-serialisable dictionary describing the planned layout.
+    """
+    sheet_estimate: Dict[str, Any] = {
+        "data_source": data_source_indicator, "start_row": sheet_plan.start_row, "tables": [],
+        "grand_total_row": None, "summary_rows": None, "weight_summary_rows": None, "spacing_rows": None,
+        "rows_inserted": 0, "last_row": None, "estimated_pages": None, "row_heights": {},
+        "merges": [], "template_merges": [], "warnings": [],
+    }
+    warnings = sheet_estimate["warnings"]
+    start_row = sheet_plan.start_row
+    header_layout = list(sheet_plan.header_layout)
+    if not start_row or not header_layout:
+        warnings.append("Missing 'start_row' or 'header_to_write'; the sheet is skipped.")
+        return sheet_estimate
+
+    # Template row heights stay on their row numbers when rows are inserted (openpyxl behaviour)
+    row_heights: Dict[int, float] = {int(r): h for r, h in ((template_sheet or {}).get("row_heights") or {}).items()}
+    num_columns = sheet_plan.num_columns
+    footer_config = sheet_section.get("footer_configurations") or {}
+    row_spacing = sheet_section.get('row_spacing', 0) or 0
+    heights_cfg = (sheet_section.get("styling") or {}).get("row_heights") or {}
+    footer_height = heights_cfg.get("footer", heights_cfg.get("header")) # Grand total and summary rows
+
+    if data_source_indicator == "processed_tables_multi":
+        all_tables_data = invoice_data.get('processed_tables_data') or {}
+        table_keys = sorted(all_tables_data.keys(), key=lambda x: int(x) if str(x).isdigit() else float('inf'))
+        insert_at = start_row
+        pointer = start_row
+        tables = [k for k in table_keys if isinstance(all_tables_data.get(str(k)), dict) and all_tables_data.get(str(k))]
+        for i, table_key in enumerate(tables):
+            # The multi-table loop passes second_row_index = header start + 1 to fill_invoice_data
+            table_estimate = _estimate_table(sheet_plan, sheet_section, pointer, pointer + 2,
+                                             count_source_rows('processed_tables', all_tables_data[str(table_key)]), row_heights)
+            if sheet_plan.num_header_rows != 2:
+                warnings.append(f"Table {table_key}: a {sheet_plan.num_header_rows}-row header does not match "
+                                "the 2-row header the multi-table writer assumes.")
+            table_estimate["table_key"] = str(table_key)
+            sheet_estimate["tables"].append(table_estimate)
+            pointer = table_estimate["footer_row"] + 1
+            if i < len(tables) - 1:
+                if heights_cfg.get("header"):
+                    row_heights[pointer] = float(heights_cfg["header"])
+                pointer += 1 # Spacer row between tables
+
+        if len(tables) > 1:
+            sheet_estimate["grand_total_row"] = pointer
+            sheet_estimate["merges"] += _footer_merge_ranges(pointer, num_columns, dict(sheet_plan.column_id_map), footer_config)
+            if footer_height:
+                row_heights[pointer] = float(footer_height)
+            pointer += 1
+        if sheet_section.get("summary", False) and tables:
+            if fob:
+                sheet_estimate["summary_rows"] = [pointer, pointer + 1]
+                if footer_height is not None:
+                    row_heights[pointer] = row_heights[pointer + 1] = float(footer_height)
+            pointer += 2 # Rows are reserved even when the summary is only written in FOB mode
+        if row_spacing > 0 and tables:
+            sheet_estimate["spacing_rows"] = [pointer, pointer + row_spacing - 1]
+            pointer += row_spacing
+        rows_inserted = pointer - insert_at
+
+        # Cross-check with the generator's up-front insert count (pre_calculate_and_insert_rows)
+        pre_inserted = sum(
+            sheet_plan.num_header_rows + (1 if sheet_section.get("add_blank_after_header", False) else 0) +
+            count_source_rows('processed_tables', all_tables_data[str(k)]) +
+            (1 if sheet_section.get("add_blank_before_footer", False) else 0) + 1 + (1 if i < len(tables) - 1 else 0)
+            for i, k in enumerate(tables)
+        ) + (1 if len(tables) > 1 else 0) + (2 if sheet_section.get("summary", False) and tables else 0) + max(row_spacing, 0)
+        if pre_inserted != rows_inserted:
+            warnings.append(f"Layout needs {rows_inserted} rows but the generator pre-inserts {pre_inserted} "
+                            "(static labels outnumber data rows); rows below the tables will be overwritten.")
+    else:
+        data_source_type, data_source = resolve_data_source(sheet_name, data_source_indicator, invoice_data, fob, custom)
+        header_rows = max(cell.get('row', 0) for cell in header_layout) + 1 # write_header's header height
+        insert_at = start_row + header_rows
+        if data_source_type is None:
+            warnings.append(f"Data source '{data_source_indicator}' unknown or empty; only the header is written.")
+            rows_inserted = 0
+            pointer = insert_at
+            sheet_estimate["merges"] += _header_merge_ranges(start_row, header_layout)
+        else:
+            table_estimate = _estimate_table(sheet_plan, sheet_section, start_row, insert_at,
+                                             count_source_rows(data_source_type, data_source), row_heights)
+            table_estimate["data_source_type"] = data_source_type
+            sheet_estimate["tables"].append(table_estimate)
+            pointer = table_estimate["footer_row"] + 1
+            if (sheet_section.get("weight_summary_config") or {}).get("enabled") and invoice_data.get('processed_tables_data'):
+                sheet_estimate["weight_summary_rows"] = [pointer, pointer + 1]
+                if heights_cfg.get("footer"):
+                    row_heights[pointer] = row_heights[pointer + 1] = float(heights_cfg["footer"])
+                pointer += 2
+            if row_spacing >= 1:
+                sheet_estimate["spacing_rows"] = [pointer, pointer + row_spacing - 1]
+                pointer += row_spacing
+            rows_inserted = pointer - insert_at
+
+    for table_estimate in sheet_estimate["tables"]:
+        sheet_estimate["merges"] = table_estimate.pop("merges") + sheet_estimate["merges"]
+
+    # --- Template rows below the insertion point move down. Their merges are restored afterwards by
+    # searching for the merged values, so these positions are the expected ones, not guaranteed. ---
+    specific_heights = ((sheet_section.get("styling") or {}).get("row_heights") or {}).get("specific_rows")
+    if isinstance(specific_heights, dict):
+        for row_str, height_val in specific_heights.items():
+            try:
+                row_heights[int(row_str)] = float(height_val)
+            except (ValueError, TypeError):
+                pass
+    last_row = pointer - 1
+    if template_sheet:
+        last_row = max(last_row, template_sheet.get("max_row", 0) + rows_inserted)
+        for min_row, min_col, max_col, _ in template_sheet.get("merges", []):
+            if min_row >= start_row:
+                shifted_row = min_row + rows_inserted if min_row >= insert_at else min_row
+                sheet_estimate["template_merges"].append(
+                    f"{get_column_letter(min_col)}{shifted_row}:{get_column_letter(max_col)}{shifted_row}")
+
+    sheet_estimate["rows_inserted"] = rows_inserted
+    sheet_estimate["last_row"] = last_row
+    sheet_estimate["estimated_pages"] = estimate_page_count(last_row, row_heights, template_sheet)
+    sheet_estimate["row_heights"] = {r: row_heights[r] for r in sorted(row_heights)}
+    return sheet_estimate
+
+
+def estimate_layout(invoice_data: Dict[str, Any], config: Dict[str, Any], fob: bool = False, custom: bool = False,
+                    template_index: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Estimates the full layout generate_invoice.py will produce, without touching the template.
+
+    Args:
+        invoice_data: The invoice data as returned by generate_invoice.load_data.
+        config: The loaded *_config.json.
+        fob: Estimate for --fob.
+        custom: Estimate for --custom.
+        template_index: The template's index (template_index_utils.load_template_index). Optional;
+                        without it the template's own rows, merges and page setup are not counted.
+
+    Returns:
+        {'mode', 'sheets': {sheet name: sheet estimate}, 'errors', 'warnings'}.
+    """
+    layout_plan = layout_plan_utils.get_layout_plan(config)
+    sheet_data_map = config.get('sheet_data_map', {})
+    data_mapping_config = config.get('data_mapping', {})
+    estimate: Dict[str, Any] = {
+        "mode": "fob" if fob else ("custom" if custom else "normal"),
+        "sheets": {},
+        "errors": list(layout_plan.errors),
+        "warnings": list(layout_plan.warnings),
+    }
+
+    template_sheets = (template_index or {}).get("sheets") or {}
+    sheets_to_process = config.get('sheets_to_process', [])
+    if template_index:
+        missing = [s for s in sheets_to_process if s not in template_sheets]
+        for sheet_name in missing:
+            estimate["warnings"].append(f"Sheet '{sheet_name}' is not in the template; it is skipped.")
+        sheets_to_process = [s for s in sheets_to_process if s in template_sheets]
+        if not config.get('sheets_to_process'):
+            sheets_to_process = [template_index.get("active_sheet")] if template_index.get("active_sheet") else []
+
+    if not invoice_data.get('processed_tables_data'):
+        estimate["warnings"].append("'processed_tables_data' is missing or empty.")
+
+    for sheet_name in sheets_to_process:
+        sheet_section = data_mapping_config.get(sheet_name, {})
+        data_source_indicator = sheet_data_map.get(sheet_name)
+        if fob and sheet_name in ["Invoice", "Contract"]:
+            data_source_indicator = 'fob_aggregation'
+        sheet_plan = layout_plan.get(sheet_name)
+        if not sheet_section or not data_source_indicator or sheet_plan is None:
+            estimate["warnings"].append(f"Sheet '{sheet_name}' has no 'data_mapping'/'sheet_data_map' entry; it is skipped.")
+            continue
+        estimate["sheets"][sheet_name] = estimate_sheet_layout(
+            sheet_name, sheet_plan, sheet_section, data_source_indicator, invoice_data, fob, custom,
+            template_sheets.get(sheet_name)
+        )
+    return estimate
+
+
+def format_layout_summary(estimate: Dict[str, Any]) -> str:
+    """Returns a short human-readable summary of a layout estimate."""
+    lines = [f"Layout estimate ({estimate['mode']} mode)"]
+    for sheet_name, sheet_estimate in estimate["sheets"].items():
+        pages = sheet_estimate["estimated_pages"]
+        lines.append(f"  {sheet_name}: {len(sheet_estimate['tables'])} table(s), {sheet_estimate['rows_inserted']} row(s) inserted, "
+                     f"last row {sheet_estimate['last_row']}, ~{pages if pages is not None else '?'} page(s), "
+                     f"{len(sheet_estimate['merges'])} merge(s)")
+        for table_estimate in sheet_estimate["tables"]:
+            label = f"table {table_estimate['table_key']}" if "table_key" in table_estimate else table_estimate.get("data_source_type", "table")
+            data_rows = table_estimate["data_rows"]
+            data_text = f"rows {data_rows[0]}-{data_rows[1]}" if data_rows else "no rows"
+            lines.append(f"    {label}: header {table_estimate['header_rows'][0]}-{table_estimate['header_rows'][1]}, "
+                         f"data {data_text} ({table_estimate['num_data_rows']}), footer {table_estimate['footer_row']}")
+        for label in ("grand_total_row", "summary_rows", "weight_summary_rows", "spacing_rows"):
+            if sheet_estimate[label] is not None:
+                lines.append(f"    {label.replace('_', ' ')}: {sheet_estimate[label]}")
+        for warning in sheet_estimate["warnings"]:
+            lines.append(f"    Warning: {warning}")
+    for error in estimate["errors"]:
+        lines.append(f"  Error: {error}")
+    for warning in estimate["warnings"]:
+        lines.append(f"  Warning: {warning}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import contextlib
+    import io
+
+    parser = argparse.ArgumentParser(description="Estimate an invoice's layout without rendering it.")
+    parser.add_argument("input_data_file", help="Path to the input JSON data file.")
+    parser.add_argument("-t", "--templatedir", default="./TEMPLATE", help="Directory containing template Excel files.")
+    parser.add_argument("-c", "--configdir", default="./configs", help="Directory containing configuration JSON files.")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--fob", action="store_true", help="Estimate the FOB layout.")
+    mode_group.add_argument("--custom", action="store_true", help="Estimate the custom aggregation layout.")
+    parser.add_argument("--json", action="store_true", help="Print the full estimate as JSON.")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # Keep the loaders' debug output out of the estimate
+        import generate_invoice
+        import template_index_utils
+
+        paths = generate_invoice.derive_paths(args.input_data_file, args.templatedir, args.configdir)
+        config = generate_invoice.load_config(paths['config']) if paths else None
+        invoice_data = generate_invoice.load_data(paths['data']) if paths else None
+        template_index = template_index_utils.load_template_index(paths['template'], rebuild_if_stale=False) if paths else None
+    if not config or invoice_data is None:
+        raise SystemExit(f"Could not load the data/config for '{args.input_data_file}'.")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        layout_estimate = estimate_layout(invoice_data, config, fob=args.fob, custom=args.custom, template_index=template_index)
+    if args.json:
+        print(json.dumps(layout_estimate, indent=1))
+    else:
+        print(format_layout_summary(layout_estimate))
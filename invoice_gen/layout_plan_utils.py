@@ -0,0 +1,221 @@
+# layout_plan_utils.py
+# Compiles a *_config.json into an immutable, per-sheet layout plan.
+# The plan resolves everything that only depends on the config (column indices, id->rule maps,
+# parsed mapping rules, resolved column styles, merge specs, footer SUM columns) once, so the
+# per-table and per-cell code paths no longer re-interpret the raw 'data_mapping' dictionaries.
+# Plans are cached in-process by a hash of the config content.
+
+import json
+import hashlib
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Mapping
+
+from openpyxl.utils import get_column_letter
+
+import invoice_utils
+
+# --- Data sources that need a header layout and a start row ---
+TABLE_DATA_SOURCES = {"processed_tables_multi", "aggregation", "fob_aggregation", "custom_aggregation"}
+
+# Cache of compiled plans, keyed by config hash
+_PLAN_CACHE: Dict[str, "LayoutPlan"] = {}
+
+
+@dataclass(frozen=True)
+class SheetLayoutPlan:
+    """Everything about one sheet's layout that can be derived from the config alone."""
+    sheet_name: str
+    data_source: Optional[str]
+    start_row: Optional[int]
+    header_layout: Tuple[Mapping[str, Any], ...]
+    num_header_rows: int        # Rows the header occupies, including rowspans
+    num_columns: int
+    column_id_map: Mapping[str, int]
+    column_map: Mapping[str, int]
+    idx_to_id_map: Mapping[int, str]
+    idx_to_header_map: Mapping[int, str]
+    parsed_rules: Mapping[str, Any]
+    rule_by_id: Mapping[str, Mapping[str, Any]]
+    column_styles: Mapping[str, Mapping[str, Any]]
+    merge_rules_after_header: Mapping[str, int]
+    merge_rules_before_footer: Mapping[str, int]
+    merge_rules_footer: Mapping[str, int]
+    data_cell_merging_rules: Mapping[str, Any]
+    footer_sum_columns: Tuple[Tuple[str, int, str], ...]   # (column id, column index, column letter)
+
+    def matches_header(self, header_info: Dict[str, Any]) -> bool:
+        """True if a header written at runtime produced the same column layout this plan was compiled for."""
+        return dict(self.column_id_map) == header_info.get("column_id_map", {})
+
+
+@dataclass(frozen=True)
+class LayoutPlan:
+    """A compiled config: one SheetLayoutPlan per sheet in 'data_mapping', plus validation results."""
+    config_hash: str
+    sheets: Mapping[str, SheetLayoutPlan]
+    errors: Tuple[str, ...] = field(default_factory=tuple)
+    warnings: Tuple[str, ...] = field(default_factory=tuple)
+
+    def get(self, sheet_name: str) -> Optional[SheetLayoutPlan]:
+        return self.sheets.get(sheet_name)
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """Returns a stable SHA-256 hash of a config dictionary's content."""
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively converts dicts/lists into read-only mappings/tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def compile_sheet_plan(sheet_name: str, sheet_mapping_section: Dict[str, Any], data_source: Optional[str],
+                       errors: List[str], warnings: List[str]) -> SheetLayoutPlan:
+    """
+    Compiles and validates one sheet's 'data_mapping' section.
+
+    Args:
+        sheet_name: The sheet name (for messages).
+        sheet_mapping_section: The sheet's section from 'data_mapping'.
+        data_source: The sheet's entry in 'sheet_data_map', if any.
+        errors: List that receives fatal config problems.
+        warnings: List that receives non-fatal config problems.
+
+    Returns:
+        The compiled SheetLayoutPlan.
+    """
+    header_layout = sheet_mapping_section.get("header_to_write") or []
+    start_row = sheet_mapping_section.get("start_row")
+    styling = sheet_mapping_section.get("styling") or {}
+
+    if data_source in TABLE_DATA_SOURCES and (not start_row or not header_layout):
+        errors.append(f"Sheet '{sheet_name}': missing 'start_row' or 'header_to_write'.")
+
+    # --- Header geometry and column maps (mirrors write_header) ---
+    column_id_map: Dict[str, int] = {}
+    column_map: Dict[str, int] = {}
+    for cell_config in header_layout:
+        abs_col = 1 + cell_config.get("col", 0)
+        if cell_config.get("id"):
+            if cell_config["id"] in column_id_map:
+                warnings.append(f"Sheet '{sheet_name}': duplicate header id '{cell_config['id']}'.")
+            column_id_map[cell_config["id"]] = abs_col
+        if cell_config.get("text"):
+            column_map[str(cell_config["text"]).strip()] = abs_col
+    num_header_rows = max((c.get("row", 0) + c.get("rowspan", 1) for c in header_layout), default=0)
+    num_columns = max((c.get("col", 0) + c.get("colspan", 1) for c in header_layout), default=0)
+    idx_to_id_map = {v: k for k, v in column_id_map.items()}
+    idx_to_header_map = {v: k for k, v in column_map.items()}
+
+    # --- Mapping rules ---
+    parsed_rules = invoice_utils.parse_mapping_rules(
+        mapping_rules=sheet_mapping_section.get("mappings", {}),
+        column_id_map=column_id_map,
+        idx_to_header_map=idx_to_header_map
+    ) if header_layout else {"dynamic_mapping_rules": {}}
+    rule_by_id: Dict[str, Dict[str, Any]] = {}
+    for rule in parsed_rules.get("dynamic_mapping_rules", {}).values():
+        rule_id = rule.get("id") if isinstance(rule, dict) else None
+        if not rule_id:
+            continue
+        if header_layout and rule_id not in column_id_map:
+            warnings.append(f"Sheet '{sheet_name}': mapping id '{rule_id}' has no header column.")
+        rule_by_id.setdefault(rule_id, rule) # First match wins, same as the old linear scan
+
+    # --- Resolved column styles ---
+    column_styles = {}
+    if styling:
+        for column_id in column_id_map:
+            column_styles[column_id] = invoice_utils.resolve_column_style(column_id, styling)
+
+    # --- Footer SUM columns ---
+    footer_config = sheet_mapping_section.get("footer_configurations") or {}
+    footer_sum_columns = []
+    for col_id in footer_config.get("sum_column_ids", []):
+        col_idx = column_id_map.get(col_id)
+        if col_idx:
+            footer_sum_columns.append((col_id, col_idx, get_column_letter(col_idx)))
+        elif header_layout:
+            warnings.append(f"Sheet '{sheet_name}': footer sum id '{col_id}' has no header column.")
+
+    return SheetLayoutPlan(
+        sheet_name=sheet_name,
+        data_source=data_source,
+        start_row=start_row,
+        header_layout=_freeze(list(header_layout)),
+        num_header_rows=num_header_rows,
+        num_columns=num_columns,
+        column_id_map=MappingProxyType(column_id_map),
+        column_map=MappingProxyType(column_map),
+        idx_to_id_map=MappingProxyType(idx_to_id_map),
+        idx_to_header_map=MappingProxyType(idx_to_header_map),
+        parsed_rules=_freeze(parsed_rules),
+        rule_by_id=_freeze(rule_by_id),
+        column_styles=MappingProxyType({k: MappingProxyType(v) for k, v in column_styles.items()}),
+        merge_rules_after_header=_freeze(sheet_mapping_section.get("merge_rules_after_header") or {}),
+        merge_rules_before_footer=_freeze(sheet_mapping_section.get("merge_rules_before_footer") or {}),
+        merge_rules_footer=_freeze(sheet_mapping_section.get("merge_rules_footer") or {}),
+        data_cell_merging_rules=_freeze(sheet_mapping_section.get("data_cell_merging_rule") or {}),
+        footer_sum_columns=tuple(footer_sum_columns),
+    )
+
+
+def compile_layout_plan(config: Dict[str, Any]) -> LayoutPlan:
+    """
+    Validates a loaded config and compiles it into a LayoutPlan (uncached).
+
+    Args:
+        config: The loaded *_config.json dictionary.
+
+    Returns:
+        The compiled LayoutPlan. Check its 'errors' before relying on it.
+    """
+    errors: List[str] = []
+    warnings: List[str] = []
+    data_mapping = config.get("data_mapping", {})
+    sheet_data_map = config.get("sheet_data_map", {})
+
+    for sheet_name in config.get("sheets_to_process", []):
+        if sheet_name not in data_mapping:
+            warnings.append(f"Sheet '{sheet_name}' is listed in 'sheets_to_process' but has no 'data_mapping' section.")
+
+    sheets = {}
+    for sheet_name, sheet_mapping_section in data_mapping.items():
+        if not isinstance(sheet_mapping_section, dict):
+            errors.append(f"Sheet '{sheet_name}': 'data_mapping' entry must be an object.")
+            continue
+        sheets[sheet_name] = compile_sheet_plan(
+            sheet_name, sheet_mapping_section, sheet_data_map.get(sheet_name), errors, warnings
+        )
+
+    return LayoutPlan(
+        config_hash=config_hash(config),
+        sheets=MappingProxyType(sheets),
+        errors=tuple(errors),
+        warnings=tuple(warnings),
+    )
+
+
+def get_layout_plan(config: Dict[str, Any]) -> LayoutPlan:
+    """
+    Returns the compiled LayoutPlan for a config, compiling it only the first time
+    a given config content is seen in this process.
+    """
+    key = config_hash(config)
+    plan = _PLAN_CACHE.get(key)
+    if plan is None:
+        print(f"Compiling layout plan (config hash {key[:12]})...")
+        plan = compile_layout_plan(config)
+        for message in plan.warnings:
+            print(f"Layout plan warning: {message}")
+        for message in plan.errors:
+            print(f"Layout plan error: {message}")
+        _PLAN_CACHE[key] = plan
+    return plan
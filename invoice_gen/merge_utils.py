@@ -7,7 +7,8 @@ from openpyxl.utils import range_boundaries, get_column_letter, column_index_fro
 from typing import Dict, List, Optional, Tuple, Any
 
 center_alignment = Alignment(horizontal='center', vertical='center')# --- store_original_merges FILTERED to ignore merges ABOVE row 16 ---
-def store_original_merges(workbook: openpyxl.Workbook, sheet_names: List[str]) -> Dict[str, List[Tuple[int, Any, Optional[float]]]]:
+def store_original_merges(workbook: openpyxl.Workbook, sheet_names: List[str],
+                          template_index: Optional[Dict[str, Any]] = None) -> Dict[str, List[Tuple[int, Any, Optional[float]]]]:
     """
     Stores the HORIZONTAL span (colspan), the value of the top-left cell,
     and the height of the starting row for merged ranges in specified sheets,
@@ -17,11 +18,31 @@ def store_original_merges(workbook: openpyxl.Workbook, sheet_names: List[str]) -
 
     Args: (args unchanged)
 
+        template_index: Optional template index (see template_index_utils). Merge positions
+            and heights are then taken from it; only the current top-left values are read.
+
     Returns:
         A dictionary where keys are sheet names and values are lists of
         tuples: (col_span, top_left_cell_value, row_height).
         row_height will be None if the original row had default height.
     """
+    if template_index:
+        original_merges = {}
+        print("\nStoring original merges from the template index (merges starting at row 16 or below)...")
+        for sheet_name in sheet_names:
+            sheet_index = template_index.get("sheets", {}).get(sheet_name)
+            if sheet_index is None or sheet_name not in workbook.sheetnames:
+                print(f"  Warning: Sheet '{sheet_name}' specified but not found during merge storage.")
+                original_merges[sheet_name] = []
+                continue
+            worksheet = workbook[sheet_name]
+            original_merges[sheet_name] = [
+                (max_col - min_col + 1, worksheet.cell(row=min_row, column=min_col).value, height)
+                for min_row, min_col, max_col, height in sheet_index["merges"]
+            ]
+            print(f"  Stored {len(original_merges[sheet_name])} horizontal merge span/value/height entries for sheet '{sheet_name}'.")
+        return original_merges
+
     original_merges = {}
     print("\nStoring original merge horizontal spans, top-left values, and row heights (NO coordinates)...")
     print("  (Ignoring merges that start above row 16)") # Updated filter info
@@ -0,0 +1,144 @@
+# output_cache_utils.py
+# Content-addressed cache of generated invoice workbooks.
+# The key is a SHA-256 over everything that determines the output: the JSON payload, the template
+# and config bytes, the mode flags and the generator's own source code. Identical requests can then
+# reuse the stored .xlsx bytes instead of running generate_invoice.py again.
+# Entries are plain files (<key>.xlsx); the cache is bounded by total size and evicts the least
+# recently used entries first (a file's mtime is bumped on every hit).
+
+import os
+import hashlib
+from pathlib import Path
+from typing import List, Optional, Union, Iterable
+
+GENERATOR_DIR = Path(__file__).resolve().parent
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+CACHE_SUFFIX = ".xlsx"
+
+_GENERATOR_VERSION: Optional[str] = None
+
+
+def generator_version() -> str:
+    """
+    Returns a digest of the generator's Python sources (invoice_gen/*.py), so any code change
+    invalidates previously cached outputs. Computed once per process.
+    """
+    global _GENERATOR_VERSION
+    if _GENERATOR_VERSION is None:
+        digest = hashlib.sha256()
+        for source_path in sorted(GENERATOR_DIR.glob("*.py")):
+            digest.update(source_path.name.encode("utf-8"))
+            digest.update(source_path.read_bytes())
+        _GENERATOR_VERSION = digest.hexdigest()
+    return _GENERATOR_VERSION
+
+
+def compute_cache_key(data_path: Union[str, Path], template_path: Union[str, Path],
+                      config_path: Union[str, Path], mode_flags: Iterable[str]) -> str:
+    """
+    Computes the cache key for one generator run.
+
+    Args:
+        data_path: The input JSON file.
+        template_path: The template .xlsx the generator will use.
+        config_path: The *_config.json the generator will use.
+        mode_flags: Command-line mode flags (e.g. ['--fob']). Order does not matter.
+
+    Returns:
+        The hex SHA-256 cache key.
+    """
+    digest = hashlib.sha256()
+    for label, path in (("data", data_path), ("template", template_path), ("config", config_path)):
+        content = Path(path).read_bytes()
+        digest.update(f"{label}:{len(content)}:".encode("utf-8"))
+        digest.update(content)
+    digest.update(("flags:" + " ".join(sorted(mode_flags))).encode("utf-8"))
+    digest.update(("generator:" + generator_version()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OutputCache:
+    """
+    A size-bounded LRU store of generated workbooks, one file per key.
+
+    Attributes:
+        cache_dir: Directory holding the cached files.
+        max_bytes: Total size the cache is trimmed to after each insert.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached bytes for `key` (marking the entry as recently used), or None."""
+        entry = self._entry_path(key)
+        try:
+            content = entry.read_bytes()
+            os.utime(entry, None)
+            return content
+        except OSError:
+            return None
+
+    def put(self, key: str, content: bytes):
+        """Stores `content` under `key`, then evicts least recently used entries over the size limit."""
+        if len(content) > self.max_bytes:
+            return
+        entry = self._entry_path(key)
+        temp_entry = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        try:
+            temp_entry.write_bytes(content)
+            os.replace(temp_entry, entry)  # Atomic, so concurrent readers never see a partial file
+        except OSError as e:
+            print(f"Warning: Could not write output cache entry '{entry.name}': {e}")
+            try:
+                temp_entry.unlink()
+            except OSError:
+                pass
+            return
+        self.evict(keep=entry)
+
+    def evict(self, keep: Optional[Path] = None) -> List[Path]:
+        """
+        Deletes the least recently used entries until the cache fits in `max_bytes`.
+
+        Args:
+            keep: An entry that must not be evicted (the one just written).
+
+        Returns:
+            The paths that were removed.
+        """
+        entries = []
+        for entry in self.cache_dir.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total_size = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total_size <= self.max_bytes:
+                break
+            if keep is not None and entry == keep:
+                continue
+            try:
+                entry.unlink()
+                total_size -= size
+                removed.append(entry)
+            except OSError:
+                pass # Ignore if file is locked
+        return removed
+
+    def clear(self):
+        """Removes every cached entry."""
+        for entry in self.cache_dir.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                entry.unlink()
+            except OSError:
+                pass
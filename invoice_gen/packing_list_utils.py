@@ -1,6 +1,7 @@
 import invoice_utils
 import style_utils
 import merge_utils
+from row_prototype_utils import RowPrototype
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.utils import get_column_letter
 from typing import Dict, List, Tuple
@@ -71,41 +72,35 @@ def generate_full_packing_list(worksheet: Worksheet, start_row: int, packing_lis
         idx_to_id_map = {v: k for k, v in col_map.items()}
 
         data_start_row = write_pointer_row
-        
-        # Define keys that should be converted to a numeric format
-        keys_to_convert_to_numeric = {'net', 'amount', 'price'}
 
+        # Collect each row's values first; styling is decided once and stamped onto every row
+        rows_values: List[Dict[int, object]] = []
         for r_idx in range(num_data_rows):
-            current_row = write_pointer_row + r_idx
+            row_values = {}
             if static_col_idx and r_idx < len(static_col_values):
-                worksheet.cell(row=current_row, column=static_col_idx).value = static_col_values[r_idx]
+                row_values[static_col_idx] = static_col_values[r_idx]
             
             for data_key, mapping_info in data_map.items():
                 if col_idx := col_map.get(mapping_info.get("id")):
                     if data_key in table_data:
-                        value = table_data[data_key][r_idx]
-                        
-                        # Attempt to convert targeted fields to a numeric type
-                        if data_key in keys_to_convert_to_numeric and isinstance(value, str):
-                            try:
-                                # Remove commas and convert to float
-                                numeric_value = float(value.replace(',', ''))
-                                worksheet.cell(row=current_row, column=col_idx).value = numeric_value
-                            except (ValueError, TypeError):
-                                # If conversion fails, write the original value
-                                worksheet.cell(row=current_row, column=col_idx).value = value
-                        else:
-                            # Write the original value for all other fields
-                            worksheet.cell(row=current_row, column=col_idx).value = value
-
+                        # Numeric columns were already typed at load time (data_schema_utils)
+                        row_values[col_idx] = table_data[data_key][r_idx]
+            rows_values.append(row_values)
+
+        if num_data_rows > 0:
+            # Style the first data row cell by cell, then stamp it onto the rest
+            for col_idx, value in rows_values[0].items():
+                worksheet.cell(row=write_pointer_row, column=col_idx).value = value
             for c_idx in range(1, num_columns + 1):
-                cell = worksheet.cell(row=current_row, column=c_idx)
+                cell = worksheet.cell(row=write_pointer_row, column=c_idx)
                 style_context = {
                     "col_id": idx_to_id_map.get(c_idx), "col_idx": c_idx,
-                    "static_col_idx": static_col_idx, "row_index": r_idx,
+                    "static_col_idx": static_col_idx, "row_index": 0,
                     "num_data_rows": num_data_rows
                 }
                 style_utils.apply_cell_style(cell, styling_config, style_context)
+            data_row_prototype = RowPrototype.capture(worksheet, write_pointer_row, num_columns)
+            data_row_prototype.stamp_rows(worksheet, write_pointer_row + 1, rows_values[1:])
         
         write_pointer_row += num_data_rows
         all_data_ranges.append((data_start_row, write_pointer_row - 1))
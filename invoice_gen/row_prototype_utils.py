@@ -0,0 +1,118 @@
+# row_prototype_utils.py
+# Captures a fully styled row once and stamps it onto other rows, so homogeneous data rows
+# don't repeat per-cell font/alignment/border/number-format decisions.
+# A prototype holds the row's style ids (StyleArrays), its single-row merge pattern, its height
+# and any formulas (translated relative to the target row when stamped).
+
+from copy import copy
+from typing import Dict, Any, List, Optional, Tuple
+
+from openpyxl.cell.cell import MergedCell
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.worksheet import Worksheet
+
+
+class RowPrototype:
+    """
+    A snapshot of one worksheet row that can be stamped onto other rows of the same sheet.
+
+    Attributes:
+        source_row: The row the prototype was captured from.
+        num_columns: Number of columns (from column 1) covered by the prototype.
+        styles: 1-based column index -> StyleArray.
+        merges: List of (start_col, end_col) single-row merges on the source row.
+        height: The source row's custom height, or None.
+        formulas: 1-based column index -> formula text as written on the source row.
+    """
+
+    def __init__(self, source_row: int, num_columns: int, styles: Dict[int, StyleArray],
+                 merges: List[Tuple[int, int]], height: Optional[float], formulas: Dict[int, str]):
+        self.source_row = source_row
+        self.num_columns = num_columns
+        self.styles = styles
+        self.merges = merges
+        self.height = height
+        self.formulas = formulas
+
+    @classmethod
+    def capture(cls, worksheet: Worksheet, row_num: int, num_columns: int) -> "RowPrototype":
+        """
+        Captures the styles, merges, height and formulas of `row_num` across columns 1..num_columns.
+        """
+        styles: Dict[int, StyleArray] = {}
+        formulas: Dict[int, str] = {}
+        for col_idx in range(1, num_columns + 1):
+            cell = worksheet._cells.get((row_num, col_idx))
+            if cell is None:
+                continue
+            if cell._style is not None:
+                styles[col_idx] = copy(cell._style)
+            if not isinstance(cell, MergedCell) and isinstance(cell.value, str) and cell.value.startswith("="):
+                formulas[col_idx] = cell.value
+
+        merges = [
+            (mc_range.min_col, mc_range.max_col)
+            for mc_range in worksheet.merged_cells.ranges
+            if mc_range.min_row == row_num and mc_range.max_row == row_num and mc_range.min_col <= num_columns
+        ]
+        height = worksheet.row_dimensions[row_num].height if row_num in worksheet.row_dimensions else None
+        return cls(row_num, num_columns, styles, merges, height, formulas)
+
+    def formula_for_row(self, col_idx: int, row_num: int) -> Optional[str]:
+        """Returns the prototype's formula in `col_idx`, with relative references moved to `row_num`."""
+        formula = self.formulas.get(col_idx)
+        if formula is None:
+            return None
+        col_letter = get_column_letter(col_idx)
+        return Translator(formula, origin=f"{col_letter}{self.source_row}").translate_formula(f"{col_letter}{row_num}")
+
+    def stamp(self, worksheet: Worksheet, row_num: int, values: Optional[Dict[int, Any]] = None,
+              apply_height: bool = True):
+        """
+        Stamps the prototype onto `row_num`: merges first, then style ids on every covered cell
+        (including merged-over cells), then values. Columns without an entry in `values` get the
+        prototype's formula (translated to this row) if it had one.
+
+        Args:
+            worksheet: The worksheet to write to (same workbook the prototype was captured from).
+            row_num: The 1-based target row.
+            values: 1-based column index -> value to write.
+            apply_height: Whether to copy the prototype's row height.
+        """
+        values = values or {}
+
+        # Merges go first so merged-over cells exist as MergedCell before they get their styles
+        for start_col, end_col in self.merges:
+            worksheet.merge_cells(start_row=row_num, start_column=start_col, end_row=row_num, end_column=end_col)
+
+        for col_idx, style in self.styles.items():
+            cell = worksheet._cells.get((row_num, col_idx)) or worksheet.cell(row=row_num, column=col_idx)
+            cell._style = copy(style)
+
+        for col_idx in range(1, self.num_columns + 1):
+            if col_idx in values:
+                value = values[col_idx]
+            elif col_idx in self.formulas:
+                value = self.formula_for_row(col_idx, row_num)
+            else:
+                continue
+            cell = worksheet.cell(row=row_num, column=col_idx)
+            if not isinstance(cell, MergedCell):
+                cell.value = value
+
+        if apply_height and self.height is not None:
+            worksheet.row_dimensions[row_num].height = self.height
+
+    def stamp_rows(self, worksheet: Worksheet, start_row: int, rows_values: List[Dict[int, Any]],
+                   apply_height: bool = True) -> int:
+        """
+        Stamps the prototype onto consecutive rows starting at `start_row`, one per entry in `rows_values`.
+
+        Returns:
+            The row after the last stamped row.
+        """
+        for offset, row_values in enumerate(rows_values):
+            self.stamp(worksheet, start_row + offset, row_values, apply_height)
+        return start_row + len(rows_values)
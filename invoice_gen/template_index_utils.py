@@ -0,0 +1,224 @@
+# template_index_utils.py
+# Offline "template compiler": extracts the static facts about each TEMPLATE/*.xlsx once into a
+# sidecar JSON index (TEMPLATE/<name>.index.json), so runtime code can look them up instead of
+# scanning the workbook: text cell coordinates (placeholders), footer rows, merges from row 16 down
+# with their row heights, the incoterm, the sheet list, column widths, explicit row heights and
+# the print page setup.
+# The index stores the template's SHA-256 and is rebuilt automatically when the template changes.
+#
+# Usage: python template_index_utils.py [TEMPLATE_DIR_OR_XLSX ...]
+
+import json
+import hashlib
+import openpyxl
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple, Union
+
+INDEX_VERSION = 2
+INDEX_SUFFIX = ".index.json"
+
+# Window of text cells recorded per sheet. Covers every find_and_replace caller
+# (header task 14x14, hybrid replacements 50x20, FOB task 200x16).
+SCAN_MAX_ROW = 200
+SCAN_MAX_COL = 20
+
+MERGE_MIN_ROW = 16  # Same cut-off as merge_utils.store_original_merges
+INCOTERMS = ["DAP", "FCA", "CIP"]
+INCOTERM_MAX_ROW = 50
+FOOTER_MARKERS = ["TOTAL"]
+
+# In-process cache: template path -> (sha256, index)
+_INDEX_CACHE: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+
+def file_sha256(path: Union[str, Path]) -> str:
+    """Returns the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_path_for(template_path: Union[str, Path]) -> Path:
+    """Returns the sidecar index path for a template (e.g. TEMPLATE/JF.index.json)."""
+    template_path = Path(template_path)
+    return template_path.with_name(template_path.stem + INDEX_SUFFIX)
+
+
+def compile_template_index(template_path: Union[str, Path], template_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Scans a template workbook once and returns its index.
+
+    Args:
+        template_path: Path to the template .xlsx.
+        template_hash: The template's SHA-256, if already computed.
+
+    Returns:
+        The index dictionary (JSON-serialisable).
+    """
+    template_path = Path(template_path)
+    print(f"Compiling template index for '{template_path.name}'...")
+    workbook = openpyxl.load_workbook(template_path)
+    try:
+        sheets = {}
+        for worksheet in workbook.worksheets:
+            text_cells = []
+            footer_rows = []
+            for (row_idx, col_idx), cell in sorted(worksheet._cells.items()):
+                if not isinstance(cell.value, str) or not cell.value:
+                    continue
+                if row_idx <= SCAN_MAX_ROW and col_idx <= SCAN_MAX_COL:
+                    text_cells.append([row_idx, col_idx, cell.value])
+                if any(cell.value.strip().upper().startswith(marker) for marker in FOOTER_MARKERS) and row_idx not in footer_rows:
+                    footer_rows.append(row_idx)
+
+            merges = []
+            for merged_range in worksheet.merged_cells.ranges:
+                min_col, min_row, max_col, max_row = merged_range.bounds
+                if max_row != min_row or min_row < MERGE_MIN_ROW:
+                    continue
+                height = worksheet.row_dimensions[min_row].height if min_row in worksheet.row_dimensions else None
+                merges.append([min_row, min_col, max_col, height])
+
+            sheets[worksheet.title] = {
+                "visible": worksheet.sheet_state == "visible",
+                "max_row": worksheet.max_row,
+                "max_column": worksheet.max_column,
+                "text_cells": text_cells,
+                "footer_rows": footer_rows,
+                "merges": merges,
+                "column_widths": {letter: dim.width for letter, dim in worksheet.column_dimensions.items() if dim.width},
+                "row_heights": {str(r): dim.height for r, dim in worksheet.row_dimensions.items() if dim.height},
+                "page_setup": _page_setup(worksheet),
+            }
+
+        # Same search as the Generate page: first incoterm found in the active sheet's first 50 rows
+        incoterm = None
+        active_title = workbook.active.title if workbook.active else None
+        if active_title:
+            for row_idx, _, text in sorted((r, c, t) for r, c, t in _all_text_cells(workbook.active) if r <= INCOTERM_MAX_ROW):
+                incoterm = next((term for term in INCOTERMS if term in text), None)
+                if incoterm:
+                    break
+
+        return {
+            "version": INDEX_VERSION,
+            "template": template_path.name,
+            "sha256": template_hash or file_sha256(template_path),
+            "sheetnames": workbook.sheetnames,
+            "active_sheet": active_title,
+            "incoterm": incoterm,
+            "scan_window": [SCAN_MAX_ROW, SCAN_MAX_COL],
+            "sheets": sheets,
+        }
+    finally:
+        workbook.close()
+
+
+def _page_setup(worksheet) -> Dict[str, Any]:
+    """Returns the print settings that decide how many pages a sheet prints on."""
+    page_setup = worksheet.page_setup
+    fit_to_page = bool(worksheet.sheet_properties.pageSetUpPr and worksheet.sheet_properties.pageSetUpPr.fitToPage)
+    return {
+        "paper_size": page_setup.paperSize,
+        "orientation": page_setup.orientation,
+        "scale": page_setup.scale,
+        "fit_to_page": fit_to_page,
+        "fit_to_height": page_setup.fitToHeight,
+        "margin_top": worksheet.page_margins.top,
+        "margin_bottom": worksheet.page_margins.bottom,
+        "default_row_height": worksheet.sheet_format.defaultRowHeight,
+    }
+
+
+def _all_text_cells(worksheet) -> List[Tuple[int, int, str]]:
+    """Returns (row, col, text) for every non-empty string cell of a worksheet."""
+    return [(r, c, cell.value) for (r, c), cell in worksheet._cells.items() if isinstance(cell.value, str) and cell.value]
+
+
+def build_template_index(template_path: Union[str, Path]) -> Dict[str, Any]:
+    """Compiles a template's index and writes it to its sidecar file."""
+    index = compile_template_index(template_path)
+    sidecar = index_path_for(template_path)
+    with open(sidecar, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    print(f"  -> Wrote template index '{sidecar.name}'.")
+    return index
+
+
+def load_template_index(template_path: Union[str, Path], rebuild_if_stale: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Returns a template's index, validated against the template's current SHA-256.
+
+    A missing or stale sidecar is rebuilt (and rewritten when the directory is writable)
+    if `rebuild_if_stale` is set; otherwise None is returned so callers fall back to scanning.
+    """
+    template_path = Path(template_path)
+    if not template_path.is_file():
+        return None
+    try:
+        template_hash = file_sha256(template_path)
+        cached = _INDEX_CACHE.get(str(template_path.resolve()))
+        if cached and cached[0] == template_hash:
+            return cached[1]
+
+        index = None
+        sidecar = index_path_for(template_path)
+        if sidecar.is_file():
+            with open(sidecar, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("sha256") != template_hash or index.get("version") != INDEX_VERSION:
+                print(f"Template index for '{template_path.name}' is stale.")
+                index = None
+
+        if index is None:
+            if not rebuild_if_stale:
+                return None
+            index = compile_template_index(template_path, template_hash)
+            try:
+                with open(sidecar, "w", encoding="utf-8") as f:
+                    json.dump(index, f, ensure_ascii=False, indent=1)
+            except OSError as e:
+                print(f"Warning: Could not write template index '{sidecar}': {e}. Using it in memory only.")
+
+        _INDEX_CACHE[str(template_path.resolve())] = (template_hash, index)
+        return index
+    except Exception as e:
+        print(f"Warning: Could not load template index for '{template_path.name}': {e}")
+        return None
+
+
+def text_cells_by_sheet(index: Optional[Dict[str, Any]]) -> Optional[Dict[str, List[Tuple[int, int]]]]:
+    """
+    Returns {sheet title: [(row, col), ...]} of the template's text cells, in row-major order,
+    for text_replace_utils.find_and_replace's `candidate_cells`. None if no index is available.
+    """
+    if not index:
+        return None
+    return {title: [(r, c) for r, c, _ in sheet["text_cells"]] for title, sheet in index["sheets"].items()}
+
+
+def find_incoterm(template_path: Union[str, Path]) -> Optional[str]:
+    """Returns the incoterm (DAP/FCA/CIP) recorded for a template, or None."""
+    index = load_template_index(template_path)
+    return index.get("incoterm") if index else None
+
+
+if __name__ == '__main__':
+    import sys
+
+    targets = [Path(arg) for arg in sys.argv[1:]] or [Path(__file__).resolve().parent / "TEMPLATE"]
+    template_files = []
+    for target in targets:
+        if target.is_dir():
+            template_files.extend(sorted(p for p in target.glob("*.xlsx") if not p.name.startswith("~$")))
+        elif target.suffix.lower() == ".xlsx":
+            template_files.append(target)
+
+    for template_file in template_files:
+        try:
+            build_template_index(template_file)
+        except Exception as e:
+            print(f"  -> FAILED to index '{template_file.name}': {e}")
+    print(f"Indexed {len(template_files)} template(s).")
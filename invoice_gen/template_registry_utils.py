@@ -0,0 +1,236 @@
+# template_registry_utils.py
+# Startup registry of template/config pairs. Scans TEMPLATE/ and config/ (plus config/second_layer/) once,
+# keeps only validated pairs (<NAME>.xlsx with <NAME>_config.json) in a prefix trie, and resolves an input
+# file to its pair with the same rules derive_paths always used (exact name part first, then the leading
+# letters), without probing the filesystem per call. Stray files such as 'MT_configasdfasdfasdf.json' or
+# 'JF_config  MASTER.json' are not valid config names and are listed as ignored instead of being matched.
+# Names are matched case-insensitively, as the old Path.is_file() probing did on Windows where the app runs
+# ('jf_data' finds JF.xlsx, 'jf_config.json' pairs with JF.xlsx); the returned pair keeps the on-disk names.
+# The registry re-scans automatically when a directory's modification time changes (file added, removed
+# or renamed), so a long-running app picks up new templates without a restart.
+#
+# Usage: python template_registry_utils.py [-t TEMPLATE_DIR] [-c CONFIG_DIR] [name ...]
+
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+TEMPLATE_SUFFIX = ".xlsx"
+CONFIG_SUFFIX = "_config.json"
+SECOND_LAYER_DIR = "second_layer"
+DEFAULT_VARIANT = "default"
+
+# Same name normalisation derive_paths used on the data file's stem
+DATA_SUFFIXES = ('_data', '_input', '_pkl')
+DATA_PREFIXES = ('data_',)
+VALID_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_\-]*$')
+LETTER_PREFIX_RE = re.compile(r'^([a-zA-Z]+)')
+
+
+@dataclass(frozen=True)
+class TemplatePair:
+    """A validated template with its config. 'variant' is 'default' or the config sub-folder name."""
+    name: str
+    template: Path
+    config: Path
+    variant: str = DEFAULT_VARIANT
+
+
+class _TrieNode:
+    __slots__ = ("children", "pairs")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.pairs: Dict[str, TemplatePair] = {}  # variant -> pair ending at this node
+
+
+def template_name_part(stem: str, strip_data_prefix: bool = True) -> str:
+    """
+    Strips the data-file decorations ('_data', '_input', '_pkl' or a leading 'data_') from a file stem.
+    With 'strip_data_prefix' False only the suffixes are stripped, as the hybrid generator always did.
+    """
+    for suffix in DATA_SUFFIXES:
+        if stem.lower().endswith(suffix):
+            return stem[:-len(suffix)]
+    for prefix in (DATA_PREFIXES if strip_data_prefix else ()):
+        if stem.lower().startswith(prefix):
+            return stem[len(prefix):]
+    return stem
+
+
+def _dir_mtime(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class TemplateRegistry:
+    """Index of the template/config pairs in one TEMPLATE/ + config/ directory pair."""
+
+    def __init__(self, template_dir: Union[str, Path], config_dir: Union[str, Path]):
+        self.template_dir = Path(template_dir).resolve()
+        self.config_dir = Path(config_dir).resolve()
+        self.ignored: List[Path] = []
+        self.unpaired: List[Path] = []
+        self._root = _TrieNode()
+        self._count = 0
+        self._mtimes: Tuple[Optional[int], ...] = ()
+        self.reload()
+
+    # --- Scanning ---
+    def _watched_dirs(self) -> List[Path]:
+        return [self.template_dir, self.config_dir, self.config_dir / SECOND_LAYER_DIR]
+
+    def _scan_configs(self, directory: Path) -> Dict[str, Path]:
+        configs = {}
+        if not directory.is_dir():
+            return configs
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.lower().endswith(".json"):
+                continue
+            name = entry.name[:-len(CONFIG_SUFFIX)] if entry.name.lower().endswith(CONFIG_SUFFIX) else ""
+            if VALID_NAME_RE.match(name):
+                configs[name] = Path(entry.path)
+            else:
+                self.ignored.append(Path(entry.path))
+        return configs
+
+    def reload(self) -> int:
+        """
+        Re-scans both directories and rebuilds the trie.
+
+        Returns:
+            The number of valid template/config pairs indexed.
+        """
+        self._mtimes = tuple(_dir_mtime(d) for d in self._watched_dirs())
+        self.ignored, self.unpaired = [], []
+        templates: Dict[str, Path] = {}  # lower-cased name -> template
+        if self.template_dir.is_dir():
+            for entry in sorted(os.scandir(self.template_dir), key=lambda e: e.name):
+                if entry.is_file() and entry.name.lower().endswith(TEMPLATE_SUFFIX) and not entry.name.startswith("~$"):
+                    templates.setdefault(entry.name[:-len(TEMPLATE_SUFFIX)].lower(), Path(entry.path))
+
+        variants = {DEFAULT_VARIANT: self._scan_configs(self.config_dir),
+                    SECOND_LAYER_DIR: self._scan_configs(self.config_dir / SECOND_LAYER_DIR)}
+        self._root, self._count = _TrieNode(), 0
+        for variant, configs in variants.items():
+            for name, config_path in configs.items():
+                template = templates.get(name.lower())
+                if template is not None:
+                    self._insert(TemplatePair(template.name[:-len(TEMPLATE_SUFFIX)], template, config_path, variant))
+                else:
+                    self.unpaired.append(config_path)
+        print(f"Template registry: {self._count} pair(s) indexed, {len(self.ignored)} stray config file(s) ignored.")
+        return self._count
+
+    def refresh_if_changed(self) -> bool:
+        """Reloads if any watched directory's modification time changed. Returns True if it reloaded."""
+        if tuple(_dir_mtime(d) for d in self._watched_dirs()) != self._mtimes:
+            self.reload()
+            return True
+        return False
+
+    # --- Trie ---
+    # Keys are lower-cased; the pairs keep the on-disk names
+    def _insert(self, pair: TemplatePair):
+        node = self._root
+        for char in pair.name.lower():
+            node = node.children.setdefault(char, _TrieNode())
+        if pair.variant in node.pairs:  # e.g. jf_config.json and JF_config.json side by side on Linux
+            print(f"Warning: '{pair.config.name}' differs from '{node.pairs[pair.variant].config.name}' only in case; ignored.")
+            self.ignored.append(pair.config)
+            return
+        node.pairs[pair.variant] = pair
+        self._count += 1
+
+    def _find_node(self, key: str) -> Optional[_TrieNode]:
+        node = self._root
+        for char in key.lower():
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def get(self, name: str, variant: str = DEFAULT_VARIANT) -> Optional[TemplatePair]:
+        """Returns the pair registered under 'name' (ignoring case), if any."""
+        node = self._find_node(name)
+        return node.pairs.get(variant) if node else None
+
+    def names_with_prefix(self, prefix: str = "", variant: str = DEFAULT_VARIANT) -> List[str]:
+        """Lists the registered names starting with 'prefix' (ignoring case), sorted."""
+        node = self._find_node(prefix)
+        names, stack = [], [node] if node else []
+        while stack:
+            current = stack.pop()
+            if variant in current.pairs:
+                names.append(current.pairs[variant].name)
+            stack.extend(current.children.values())
+        return sorted(names)
+
+    # --- Lookup ---
+    def resolve(self, identifier: str, variant: str = DEFAULT_VARIANT,
+                strip_data_prefix: bool = True) -> Optional[TemplatePair]:
+        """
+        Finds the pair for a data file name or identifier: the exact name part first, then its leading letters.
+        Both are matched ignoring case.
+
+        Args:
+            identifier: A data file stem or name such as 'JF', 'JF_data' or 'MOTO25001'.
+            variant: 'default', or 'second_layer' for the configs in config/second_layer/.
+            strip_data_prefix: Whether a leading 'data_' is stripped (see template_name_part()).
+
+        Returns:
+            The matching TemplatePair, or None.
+        """
+        self.refresh_if_changed()
+        name_part = template_name_part(identifier, strip_data_prefix)
+        if not name_part:
+            return None
+        pair = self.get(name_part, variant)
+        if pair is None:
+            prefix_match = LETTER_PREFIX_RE.match(name_part)
+            if prefix_match and prefix_match.group(1) != name_part:
+                pair = self.get(prefix_match.group(1), variant)
+        return pair
+
+    def __len__(self) -> int:
+        return self._count
+
+
+# Registries shared by every caller in this process, one per directory pair
+_REGISTRIES: Dict[Tuple[str, str], TemplateRegistry] = {}
+
+
+def get_registry(template_dir: Union[str, Path], config_dir: Union[str, Path]) -> TemplateRegistry:
+    """Returns the process-wide registry for a directory pair, building it on first use."""
+    key = (str(Path(template_dir).resolve()), str(Path(config_dir).resolve()))
+    if key not in _REGISTRIES:
+        _REGISTRIES[key] = TemplateRegistry(*key)
+    return _REGISTRIES[key]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List the template/config pairs and resolve names against them.")
+    parser.add_argument("names", nargs="*", help="Data file names or identifiers to resolve.")
+    parser.add_argument("-t", "--templatedir", default="./TEMPLATE", help="Directory containing template Excel files.")
+    parser.add_argument("-c", "--configdir", default="./config", help="Directory containing configuration JSON files.")
+    parser.add_argument("--variant", default=DEFAULT_VARIANT, help="'default' or 'second_layer'.")
+    args = parser.parse_args()
+
+    registry = get_registry(args.templatedir, args.configdir)
+    if args.names:
+        for name in args.names:
+            pair = registry.resolve(Path(name).stem, args.variant)
+            print(f"{name}: {pair.template.name} + {pair.config.name} ({pair.variant})" if pair else f"{name}: no match")
+    else:
+        for variant in (DEFAULT_VARIANT, SECOND_LAYER_DIR):
+            print(f"{variant}: {', '.join(registry.names_with_prefix('', variant)) or '-'}")
+        for path in registry.ignored:
+            print(f"ignored: {path}")
+        for path in registry.unpaired:
+            print(f"no template: {path}")
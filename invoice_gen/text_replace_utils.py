@@ -1,7 +1,7 @@
 import openpyxl
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.cell import Cell
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 import re
 import datetime
 
@@ -26,12 +26,10 @@ def excel_number_to_datetime(excel_num: Any) -> Optional[datetime.datetime]:
     except (ValueError, TypeError):
         return None
 
-def format_cell_as_date_smarter(cell: Cell, value: Any):
+def parse_date_value(value: Any) -> Optional[Any]:
     """
-    Intelligently parses a value (string, number, or datetime) into a
-    datetime object and formats the cell accordingly.
-    
-    This function REPLACES the old `is_date_string` and `format_cell_as_date`.
+    Parses a value (string, number, or datetime) into a datetime/date object.
+    Returns None if the value is not a recognizable date.
     """
     parsed_date = None
 
@@ -57,7 +55,18 @@ def format_cell_as_date_smarter(cell: Cell, value: Any):
         if value >= 1: # Plausible Excel dates are positive numbers.
             parsed_date = excel_number_to_datetime(value)
 
-    # 4. If we successfully found and parsed a date, format the cell
+    return parsed_date
+
+def format_cell_as_date_smarter(cell: Cell, value: Any):
+    """
+    Intelligently parses a value (string, number, or datetime) into a
+    datetime object and formats the cell accordingly.
+    
+    This function REPLACES the old `is_date_string` and `format_cell_as_date`.
+    """
+    parsed_date = parse_date_value(value)
+
+    # If we successfully found and parsed a date, format the cell
     if parsed_date:
         cell.value = parsed_date
         # This number format tells Excel to display the date as dd/mm/yyyy
@@ -66,7 +75,7 @@ def format_cell_as_date_smarter(cell: Cell, value: Any):
         # If no date could be parsed, just set the cell to the original value
         cell.value = value
 
-def _get_nested_data(data_dict: Dict[str, Any], path: List[Any]) -> Optional[Any]:
+def get_nested_data(data_dict: Dict[str, Any], path: List[Any]) -> Optional[Any]:
     """Safely retrieves a value from a nested structure of dictionaries and lists."""
     current_level = data_dict
     for key in path:
@@ -92,17 +101,26 @@ def find_and_replace(
     rules: List[Dict[str, Any]],
     limit_rows: int,
     limit_cols: int,
-    invoice_data: Optional[Dict[str, Any]] = None
+    invoice_data: Optional[Dict[str, Any]] = None,
+    candidate_cells: Optional[Dict[str, List[Tuple[int, int]]]] = None
 ):
     """
     A two-pass engine that handles 'exact', 'substring', and formula-based replacements.
     Pass 1: Locates all placeholders and performs simple value replacements.
     Pass 2: Uses the locations found in Pass 1 to build and apply formulas.
+
+    Returns a record for every exact-match 'data_path' placeholder it matched
+    ({'sheet', 'cell', 'find', 'data_path', 'is_date', 'date_formatted', 'value'}),
+    so the cells can be patched later without a full render (see header_patch_utils).
+
+    If `candidate_cells` (sheet title -> row-major (row, col) list of the template's text cells,
+    see template_index_utils) is given, only those cells are checked instead of scanning the window.
     """
     print(f"\n--- Starting Find and Replace on sheets (Searching Range up to row {limit_rows}, col {limit_cols}) ---")
     
     # NEW: A dictionary to store the cell coordinates of each placeholder.
     placeholder_locations: Dict[str, str] = {}
+    applied_replacements: List[Dict[str, Any]] = []
     
     # NEW: Separate rules for formulas vs. simple replacements.
     simple_rules = [r for r in rules if "formula_template" not in r]
@@ -117,7 +135,11 @@ def find_and_replace(
 
         # --- PASS 1: Find all placeholder locations and apply simple replacements ---
         print("  PASS 1: Locating placeholders and applying simple value replacements...")
-        for row in sheet.iter_rows(max_row=limit_rows, max_col=limit_cols):
+        if candidate_cells is not None and sheet.title in candidate_cells:
+            rows_to_scan = [[sheet.cell(row=r, column=c) for r, c in candidate_cells[sheet.title] if r <= limit_rows and c <= limit_cols]]
+        else:
+            rows_to_scan = sheet.iter_rows(max_row=limit_rows, max_col=limit_cols)
+        for row in rows_to_scan:
             for cell in row:
                 if not isinstance(cell.value, str) or not cell.value:
                     continue
@@ -142,7 +164,7 @@ def find_and_replace(
                         replacement_content = None
                         if "data_path" in rule:
                             if not invoice_data: continue
-                            replacement_content = _get_nested_data(invoice_data, rule["data_path"])
+                            replacement_content = get_nested_data(invoice_data, rule["data_path"])
                         elif "replace" in rule:
                             replacement_content = rule["replace"]
 
@@ -154,6 +176,13 @@ def find_and_replace(
                                 cell.value = replacement_content
                             elif match_mode == 'substring':
                                 cell.value = cell.value.replace(str(text_to_find), str(replacement_content))
+                        # Remember data-driven placeholder cells (even unfilled ones) so they can be patched later
+                        if "data_path" in rule and match_mode == 'exact':
+                            applied_replacements.append({
+                                "sheet": sheet.title, "cell": cell.coordinate, "find": text_to_find,
+                                "data_path": list(rule["data_path"]), "is_date": rule.get("is_date", False),
+                                "date_formatted": cell.number_format == "dd/mm/yyyy", "value": cell.value
+                            })
                         break
 
         # --- PASS 2: Build and apply formula-based replacements ---
@@ -197,13 +226,16 @@ def find_and_replace(
                 print(f"    -> SUCCESS: Placing formula '{final_formula_str}' in cell {target_cell_coord}.")
                 sheet[target_cell_coord].value = final_formula_str
 
+    return applied_replacements
+
 
 # ==============================================================================
 # SECTION 3: TASK-RUNNER FUNCTIONS (No changes needed here)
 # ==============================================================================
 
-def run_invoice_header_replacement_task(workbook: openpyxl.Workbook, invoice_data: Dict[str, Any]):
-    """Defines and runs the data-driven header replacement task."""
+def run_invoice_header_replacement_task(workbook: openpyxl.Workbook, invoice_data: Dict[str, Any],
+                                        candidate_cells: Optional[Dict[str, List[Tuple[int, int]]]] = None) -> List[Dict[str, Any]]:
+    """Defines and runs the data-driven header replacement task. Returns the applied replacement records."""
     print("\n--- Running Invoice Header Replacement Task (within A1:N14) ---")
     header_rules = [
         {"find": "JFINV", "data_path": ["processed_tables_data", "1", "inv_no", 0], "match_mode": "exact"},
@@ -213,16 +245,19 @@ def run_invoice_header_replacement_task(workbook: openpyxl.Workbook, invoice_dat
         {"find": "[[CUSTOMER_NAME]]", "data_path": ["customer_info", "name"], "match_mode": "exact"},
         {"find": "[[CUSTOMER_ADDRESS]]", "data_path": ["customer_info", "address"], "match_mode": "exact"}
     ]
-    find_and_replace(
+    applied_replacements = find_and_replace(
         workbook=workbook,
         rules=header_rules,
         limit_rows=14,
         limit_cols=14,
-        invoice_data=invoice_data
+        invoice_data=invoice_data,
+        candidate_cells=candidate_cells
     )
     print("--- Finished Invoice Header Replacement Task ---")
+    return applied_replacements
 
-def run_fob_specific_replacement_task(workbook: openpyxl.Workbook):
+def run_fob_specific_replacement_task(workbook: openpyxl.Workbook,
+                                      candidate_cells: Optional[Dict[str, List[Tuple[int, int]]]] = None):
     """Defines and runs the hardcoded, FOB-specific replacement task."""
     print("\n--- Running FOB-Specific Replacement Task (within 50x16 grid) ---")
     fob_rules = [
@@ -245,7 +280,8 @@ def run_fob_specific_replacement_task(workbook: openpyxl.Workbook):
         workbook=workbook,
         rules=fob_rules,
         limit_rows=200,
-        limit_cols=16
+        limit_cols=16,
+        candidate_cells=candidate_cells
     )
     print("--- Finished FOB-Specific Replacement Task ---")
 
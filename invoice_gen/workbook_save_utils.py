@@ -0,0 +1,112 @@
+# workbook_save_utils.py
+# Save layer for generated workbooks and download bundles.
+# - save_workbook(): openpyxl's save with a configurable deflate level (0 = stored, 1 = fastest,
+#   9 = smallest; 6 is zlib's default and gives byte-for-byte the same parts as workbook.save()).
+# - run_parallel(): runs independent generation jobs (e.g. the normal/FOB/custom modes, each its
+#   own generate_invoice.py process) concurrently and returns their results in submission order.
+# - build_bundle(): writes the final download ZIP straight from the generated parts. .xlsx files are
+#   already deflated ZIP containers, so they are stored as-is instead of being compressed a second time.
+#
+# The deflate level can also be set with the INVOICE_COMPRESS_LEVEL environment variable.
+
+import io
+import os
+import zipfile
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple, Union
+
+from openpyxl import Workbook
+from openpyxl.writer.excel import ExcelWriter
+
+DEFAULT_COMPRESS_LEVEL = 6
+COMPRESS_LEVEL_ENV = "INVOICE_COMPRESS_LEVEL"
+
+# Parts that are already compressed containers; re-deflating them costs time and saves nothing
+PRECOMPRESSED_SUFFIXES = (".xlsx", ".xlsm", ".zip", ".png", ".jpg", ".jpeg")
+
+
+def resolve_compress_level(compress_level: Optional[int] = None) -> int:
+    """Returns the deflate level to use: the argument, else INVOICE_COMPRESS_LEVEL, else the default (clamped to 0-9)."""
+    if compress_level is None:
+        try:
+            compress_level = int(os.environ.get(COMPRESS_LEVEL_ENV, DEFAULT_COMPRESS_LEVEL))
+        except ValueError:
+            compress_level = DEFAULT_COMPRESS_LEVEL
+    return max(0, min(9, compress_level))
+
+
+def zip_settings(compress_level: Optional[int] = None) -> Dict[str, Any]:
+    """Returns the zipfile.ZipFile keyword arguments (compression, compresslevel) for a deflate level."""
+    level = resolve_compress_level(compress_level)
+    if level == 0:
+        return {"compression": zipfile.ZIP_STORED}
+    return {"compression": zipfile.ZIP_DEFLATED, "compresslevel": level}
+
+
+def save_workbook(workbook: Workbook, output_path: Union[str, Path], compress_level: Optional[int] = None) -> Path:
+    """
+    Saves a workbook like workbook.save(), with a configurable deflate level.
+
+    Args:
+        workbook: The workbook to save.
+        output_path: Where to write the .xlsx.
+        compress_level: 0-9; None uses INVOICE_COMPRESS_LEVEL or DEFAULT_COMPRESS_LEVEL.
+
+    Returns:
+        The output path.
+    """
+    output_path = Path(output_path)
+    archive = zipfile.ZipFile(output_path, "w", allowZip64=True, **zip_settings(compress_level))
+    workbook.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    ExcelWriter(workbook, archive).save()
+    return output_path
+
+
+def run_parallel(jobs: Sequence[Callable[[], Any]], max_workers: Optional[int] = None) -> List[Tuple[Any, Optional[BaseException]]]:
+    """
+    Runs independent jobs concurrently in threads (suited to jobs that wait on subprocesses or I/O).
+
+    Args:
+        jobs: Zero-argument callables.
+        max_workers: Thread count; defaults to one per job.
+
+    Returns:
+        (result, None) or (None, exception) per job, in the order the jobs were given.
+    """
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as pool:
+        futures = [pool.submit(job) for job in jobs]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    return outcomes
+
+
+def build_bundle(files: Sequence[Dict[str, Any]], compress_level: Optional[int] = None) -> bytes:
+    """
+    Builds the download ZIP from in-memory parts. Already-compressed parts (.xlsx, images, zips)
+    are stored; everything else (JSON, text) is deflated at `compress_level`.
+
+    Args:
+        files: [{"name": archive name, "data": bytes}, ...]. A "path" key may be given instead of "data".
+        compress_level: 0-9 for the deflated parts; None uses INVOICE_COMPRESS_LEVEL or the default.
+
+    Returns:
+        The ZIP file's bytes.
+    """
+    settings = zip_settings(compress_level)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", **settings) as bundle:
+        for file_info in files:
+            data = file_info["data"] if "data" in file_info else Path(file_info["path"]).read_bytes()
+            if str(file_info["name"]).lower().endswith(PRECOMPRESSED_SUFFIXES):
+                bundle.writestr(file_info["name"], data, compress_type=zipfile.ZIP_STORED)
+            else:
+                bundle.writestr(file_info["name"], data)
+    return buffer.getvalue()
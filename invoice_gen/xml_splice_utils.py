@@ -0,0 +1,438 @@
+# xml_splice_utils.py
+# Alternative writer that streams generated rows straight into a template's sheet XML.
+# Every other zip part (styles, images, drawings, shared strings, printer settings) is
+# copied through untouched, so the template is never parsed into openpyxl's object model.
+# Only the target sheet part is rewritten: rows at/after the insertion point are renumbered,
+# and merges, dimension, sqref/ref attributes, row breaks and formula references are shifted to match.
+# References into the sheet from elsewhere (defined names such as print areas and titles in
+# workbook.xml, formulas on other sheets) are shifted as well.
+#
+# Scope: this is a standalone writer (see the __main__ demo); generate_invoice.py and
+# hybrid_generate_invoice.py still render through openpyxl, because their footers, merges and
+# per-table formulas are built there.
+
+import os
+import re
+import tempfile
+import zipfile
+import datetime
+import posixpath
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Iterable, Sequence, Tuple, Union
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.datetime import to_excel
+
+# --- Namespaces used to resolve a sheet name to its XML part ---
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+CALC_CHAIN_PART = "xl/calcChain.xml"
+
+# --- Regex helpers ---
+ROW_PATTERN = re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.DOTALL)
+ROW_NUM_PATTERN = re.compile(r'(<row\b[^>]*?\br=")(\d+)(")')
+CELL_REF_ATTR_PATTERN = re.compile(r'(<c\b[^>]*?\br=")([A-Z]{1,3})(\d+)(")')
+CELL_STYLE_PATTERN = re.compile(r'<c\b[^>]*?\br="([A-Z]{1,3})\d+"[^>]*?\bs="(\d+)"')
+FORMULA_PATTERN = re.compile(r'(<f\b[^>]*>)(.*?)(</f>)', re.DOTALL)
+FORMULA_REF_ATTR_PATTERN = re.compile(r'(<f\b[^>]*?\bref=")([^"]+)(")')
+REF_ATTR_PATTERN = re.compile(r'(\b(?:ref|sqref)=")([^"]+)(")')
+BREAK_ID_PATTERN = re.compile(r'(<brk\b[^>]*?\bid=")(\d+)(")')
+ROW_BREAKS_PATTERN = re.compile(r'<rowBreaks\b.*?</rowBreaks>', re.DOTALL)  # <colBreaks> ids are columns
+DEFINED_NAME_PATTERN = re.compile(r'(<definedName\b[^>]*>)(.*?)(</definedName>)', re.DOTALL)
+DIMENSION_PATTERN = re.compile(r'(<dimension\b[^>]*?\bref=")([^"]+)(")')
+# A1-style reference inside a formula. Skips function names (LOG10(), sheet-qualified
+# references (Sheet2!A1) and anything glued to a longer identifier.
+FORMULA_CELL_PATTERN = re.compile(r"(?<![A-Za-z0-9_.!'\"])(\$?)([A-Z]{1,3})(\$?)(\d+)(?![A-Za-z0-9_(!])")
+# Target of a sheet-qualified reference: a cell or cell range (Invoice!$A$1:$H$40) or a row range ($1:$3)
+QUALIFIED_TARGET = r"(\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?|\$?\d+:\$?\d+)(?![A-Za-z0-9_(])"
+
+
+def _shift_row_number(row_num: int, insert_at_row: int, amount: int) -> int:
+    """Returns the new row number for a row after inserting `amount` rows at `insert_at_row`."""
+    return row_num + amount if row_num >= insert_at_row else row_num
+
+
+def shift_formula_references(formula: str, insert_at_row: int, amount: int) -> str:
+    """
+    Shifts every same-sheet A1 reference in a formula that points at or below
+    `insert_at_row` down by `amount` rows. Text inside double quotes is left alone.
+
+    Args:
+        formula: The formula text (with or without the leading '=').
+        insert_at_row: The 1-based row where the new rows are inserted.
+        amount: The number of rows inserted.
+
+    Returns:
+        The formula with its references adjusted.
+    """
+    if not formula or amount == 0:
+        return formula
+
+    def _replace(match: re.Match) -> str:
+        col_abs, col, row_abs, row = match.groups()
+        return f"{col_abs}{col}{row_abs}{_shift_row_number(int(row), insert_at_row, amount)}"
+
+    # Split on quotes so string literals are never touched (even parts are outside quotes)
+    parts = formula.split('"')
+    for i in range(0, len(parts), 2):
+        parts[i] = FORMULA_CELL_PATTERN.sub(_replace, parts[i])
+    return '"'.join(parts)
+
+
+def shift_range_list(ref_list: str, insert_at_row: int, amount: int) -> str:
+    """
+    Shifts a space-separated list of cell ranges (e.g. an sqref "A1:B2 D5") by `amount` rows.
+    """
+    shifted = []
+    for ref in ref_list.split():
+        shifted.append(":".join(
+            re.sub(r'^(\$?[A-Z]{1,3}\$?)(\d+)$',
+                   lambda m: f"{m.group(1)}{_shift_row_number(int(m.group(2)), insert_at_row, amount)}",
+                   part)
+            for part in ref.split(":")
+        ))
+    return " ".join(shifted)
+
+
+def _sheet_reference_pattern(sheet_name: str) -> re.Pattern:
+    """
+    Matches references qualified with `sheet_name` as they appear in XML text: 'Packing list'!A1
+    (apostrophes possibly written as &apos;, embedded ones doubled) or Invoice!A1 for simple names.
+    """
+    escaped = escape(sheet_name)
+    quoted = "(?:'|&apos;)" + re.escape(escaped).replace("'", "(?:''|&apos;&apos;)") + "(?:'|&apos;)"
+    prefix = quoted
+    if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", sheet_name):
+        prefix = f"(?:{quoted}|(?<![A-Za-z0-9_.']){re.escape(sheet_name)})"
+    return re.compile(f"({prefix}!)" + QUALIFIED_TARGET, re.IGNORECASE)
+
+
+def shift_sheet_references(text: str, sheet_pattern: re.Pattern, insert_at_row: int, amount: int) -> str:
+    """
+    Shifts the references in `text` that point into the spliced sheet (matched by
+    _sheet_reference_pattern()) the same way as the sheet's own references.
+    """
+    def _replace(match: re.Match) -> str:
+        target = match.group(2)
+        if re.fullmatch(r"\$?\d+:\$?\d+", target):  # Whole rows: $1:$3
+            target = re.sub(r"(\$?)(\d+)", lambda m: f"{m.group(1)}{_shift_row_number(int(m.group(2)), insert_at_row, amount)}", target)
+        else:
+            target = shift_range_list(target, insert_at_row, amount)
+        return f"{match.group(1)}{target}"
+
+    return sheet_pattern.sub(_replace, text)
+
+
+def _shift_sheet_references_in_formulas(xml_text: str, sheet_pattern: re.Pattern, insert_at_row: int, amount: int) -> str:
+    """Applies shift_sheet_references() to the text of every <f> element."""
+    return FORMULA_PATTERN.sub(
+        lambda m: f"{m.group(1)}{shift_sheet_references(m.group(2), sheet_pattern, insert_at_row, amount)}{m.group(3)}",
+        xml_text
+    )
+
+
+def _shift_formulas_in_fragment(xml_fragment: str, insert_at_row: int, amount: int) -> str:
+    """Rewrites <f> text and shared-formula ref attributes inside an XML fragment."""
+    if "<f" not in xml_fragment:
+        return xml_fragment
+    xml_fragment = FORMULA_PATTERN.sub(
+        lambda m: f"{m.group(1)}{shift_formula_references(m.group(2), insert_at_row, amount)}{m.group(3)}",
+        xml_fragment
+    )
+    return FORMULA_REF_ATTR_PATTERN.sub(
+        lambda m: f"{m.group(1)}{shift_range_list(m.group(2), insert_at_row, amount)}{m.group(3)}",
+        xml_fragment
+    )
+
+
+def _shift_existing_row(row_xml: str, insert_at_row: int, amount: int) -> str:
+    """Renumbers a template row (and its cells) that sits at or below the insertion point."""
+    row_xml = ROW_NUM_PATTERN.sub(
+        lambda m: f"{m.group(1)}{int(m.group(2)) + amount}{m.group(3)}", row_xml, count=1
+    )
+    return CELL_REF_ATTR_PATTERN.sub(
+        lambda m: f"{m.group(1)}{m.group(2)}{int(m.group(3)) + amount}{m.group(4)}", row_xml
+    )
+
+
+def format_cell_xml(row_num: int, col_idx: int, value: Any, style_id: Optional[int]) -> str:
+    """
+    Builds the XML for a single cell. Strings are written inline so sharedStrings.xml
+    never has to be rewritten; strings starting with '=' are written as formulas.
+    """
+    ref = f"{get_column_letter(col_idx)}{row_num}"
+    style_attr = f' s="{style_id}"' if style_id is not None else ""
+
+    if value is None:
+        return f'<c r="{ref}"{style_attr}/>' if style_attr else ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style_attr}><v>{value}</v></c>'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return f'<c r="{ref}"{style_attr}><v>{to_excel(value)}</v></c>'
+
+    text = str(value)
+    if text.startswith("="):
+        return f'<c r="{ref}"{style_attr}><f>{escape(text[1:])}</f></c>'
+    space_attr = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t{space_attr}>{escape(text)}</t></is></c>'
+
+
+def build_row_xml(row_num: int, row_values: Dict[int, Any], style_ids: Optional[Dict[int, int]] = None,
+                  row_height: Optional[float] = None) -> str:
+    """
+    Builds a complete <row> element for generated data.
+
+    Args:
+        row_num: The 1-based row index in the output sheet.
+        row_values: Dictionary of 1-based column index -> value.
+        style_ids: Optional dictionary of 1-based column index -> cellXfs style id.
+        row_height: Optional custom row height.
+
+    Returns:
+        The <row> element as a string.
+    """
+    style_ids = style_ids or {}
+    columns = sorted(set(row_values) | set(style_ids))
+    cells_xml = "".join(
+        format_cell_xml(row_num, col_idx, row_values.get(col_idx), style_ids.get(col_idx))
+        for col_idx in columns
+    )
+    height_attr = f' ht="{row_height}" customHeight="1"' if row_height else ""
+    return f'<row r="{row_num}"{height_attr}>{cells_xml}</row>'
+
+
+def resolve_sheet_part(zip_file: zipfile.ZipFile, sheet_name: str) -> Optional[str]:
+    """
+    Resolves a sheet's display name to its XML part path (e.g. 'xl/worksheets/sheet3.xml')
+    by reading workbook.xml and its relationships.
+    """
+    workbook_xml = ET.fromstring(zip_file.read("xl/workbook.xml"))
+    rels_xml = ET.fromstring(zip_file.read("xl/_rels/workbook.xml.rels"))
+    rel_targets = {rel.get("Id"): rel.get("Target") for rel in rels_xml.findall(f"{{{NS_PKG_REL}}}Relationship")}
+
+    for sheet in workbook_xml.iter(f"{{{NS_MAIN}}}sheet"):
+        if sheet.get("name") == sheet_name:
+            target = rel_targets.get(sheet.get(f"{{{NS_REL}}}id"))
+            if not target:
+                return None
+            # Targets are normally relative to xl/, but may be absolute ('/xl/worksheets/...')
+            return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+    return None
+
+
+def read_prototype_styles(sheet_xml: str, row_num: int) -> Dict[int, int]:
+    """
+    Reads the style id of every cell in a template row, so generated rows can reuse
+    the template's own formatting without touching styles.xml.
+    """
+    for row_match in ROW_PATTERN.finditer(sheet_xml):
+        row_xml = row_match.group(0)
+        num_match = ROW_NUM_PATTERN.search(row_xml)
+        if num_match and int(num_match.group(2)) == row_num:
+            return {column_index_from_string(col): int(style) for col, style in CELL_STYLE_PATTERN.findall(row_xml)}
+    return {}
+
+
+def _drop_calc_chain_references(part_name: str, data: bytes) -> bytes:
+    """Removes calcChain entries from [Content_Types].xml or the workbook rels."""
+    text = data.decode("utf-8")
+    if part_name == "[Content_Types].xml":
+        text = re.sub(r'<Override\b[^>]*PartName="/xl/calcChain\.xml"[^>]*/>', "", text)
+    else:
+        text = re.sub(r'<Relationship\b[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', "", text)
+    return text.encode("utf-8")
+
+
+def splice_rows_into_template(
+    template_path: Union[str, Path],
+    output_path: Union[str, Path],
+    sheet_name: str,
+    insert_at_row: int,
+    rows: Union[Sequence[Dict[int, Any]], Iterable[Dict[int, Any]]],
+    style_ids: Optional[Dict[int, int]] = None,
+    row_height: Optional[float] = None,
+    row_count: Optional[int] = None,
+) -> int:
+    """
+    Writes a copy of `template_path` to `output_path` with `rows` inserted into
+    `sheet_name` at `insert_at_row`, without loading the workbook into openpyxl.
+
+    The template's existing rows at or below `insert_at_row` are moved down, and
+    merge ranges, the dimension, sqref/ref attributes, row page breaks and formula
+    references in the target sheet are shifted to match, as are defined names
+    (print areas, print titles) and formulas on other sheets that point into it.
+    All other zip parts are copied unchanged. If the template has a calcChain it is
+    dropped, since Excel rebuilds it on open and a stale one triggers a repair prompt.
+    The output is written under a temporary name and renamed when complete.
+
+    Note: drawing anchors are not shifted, because they live in parts this writer
+    deliberately leaves untouched.
+
+    Args:
+        template_path: Path to the template .xlsx file.
+        output_path: Path of the .xlsx file to write.
+        sheet_name: The display name of the sheet to receive the rows.
+        insert_at_row: The 1-based row index where the first generated row goes.
+        rows: Row dictionaries of 1-based column index -> value ('=...' for formulas).
+              An iterator is consumed once, as the sheet is written; pass `row_count` with it.
+        style_ids: Column index -> style id. Defaults to the styles of the template row
+                   currently at `insert_at_row` (the template's prototype data row).
+        row_height: Optional custom height applied to every generated row.
+        row_count: Number of rows in `rows`. Required when `rows` is an iterator, since every
+                   shifted reference depends on it before the first row is written.
+
+    Returns:
+        The number of rows inserted, or -1 if the sheet could not be found.
+
+    Raises:
+        ValueError: If `rows` is an iterator without `row_count`, or yields a different number of rows.
+    """
+    if row_count is None:
+        if not isinstance(rows, Sequence):
+            raise ValueError("row_count is required when rows is an iterator.")
+        row_count = len(rows)
+    amount = row_count
+    template_path = Path(template_path)
+    output_path = Path(output_path)
+    print(f"--- Splicing {amount} rows into '{sheet_name}' at row {insert_at_row} (template: {template_path.name}) ---")
+
+    with zipfile.ZipFile(template_path, "r") as zin:
+        sheet_part = resolve_sheet_part(zin, sheet_name)
+        if not sheet_part or sheet_part not in zin.namelist():
+            print(f"Error: Sheet '{sheet_name}' not found in template '{template_path.name}'.")
+            return -1
+        has_calc_chain = CALC_CHAIN_PART in zin.namelist()
+
+        sheet_xml = zin.read(sheet_part).decode("utf-8")
+        if style_ids is None:
+            style_ids = read_prototype_styles(sheet_xml, insert_at_row)
+
+        data_open = sheet_xml.find("<sheetData")
+        data_close = sheet_xml.find("</sheetData>")
+        if data_open == -1:
+            print(f"Error: Sheet part '{sheet_part}' has no <sheetData> element.")
+            return -1
+        if data_close == -1:
+            # Self-closing <sheetData/>: treat it as an empty element
+            data_tag_end = sheet_xml.find("/>", data_open) + 2
+            head, body, tail = sheet_xml[:data_open] + "<sheetData>", "", "</sheetData>" + sheet_xml[data_tag_end:]
+        else:
+            data_tag_end = sheet_xml.find(">", data_open) + 1
+            head, body, tail = sheet_xml[:data_tag_end], sheet_xml[data_tag_end:data_close], sheet_xml[data_close:]
+
+        # --- Head: only the dimension changes ---
+        head = DIMENSION_PATTERN.sub(
+            lambda m: f"{m.group(1)}{shift_range_list(m.group(2), insert_at_row, amount)}{m.group(3)}", head, count=1
+        )
+        # --- Tail: merges, conditional formats, validations, hyperlinks, ignored errors, page breaks ---
+        tail = REF_ATTR_PATTERN.sub(
+            lambda m: f"{m.group(1)}{shift_range_list(m.group(2), insert_at_row, amount)}{m.group(3)}", tail
+        )
+        tail = ROW_BREAKS_PATTERN.sub(lambda block: BREAK_ID_PATTERN.sub(
+            lambda m: f"{m.group(1)}{_shift_row_number(int(m.group(2)), insert_at_row, amount)}{m.group(3)}", block.group(0)
+        ), tail)
+        sheet_pattern = _sheet_reference_pattern(sheet_name)
+        worksheet_parts = {name for name in zin.namelist()
+                           if name.startswith("xl/worksheets/") and name.endswith(".xml") and name != sheet_part}
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, staging = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.stem}-", suffix=".xlsx")
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(staging, "w", zipfile.ZIP_DEFLATED) as zout:
+                for info in zin.infolist():
+                    if info.filename == sheet_part:
+                        sheet_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                        sheet_info.compress_type = zipfile.ZIP_DEFLATED  # ZipInfo defaults to ZIP_STORED
+                        with zout.open(sheet_info, "w") as sheet_out:
+                            sheet_out.write(head.encode("utf-8"))
+                            written = None
+                            for row_match in ROW_PATTERN.finditer(body):
+                                row_xml = row_match.group(0)
+                                num_match = ROW_NUM_PATTERN.search(row_xml)
+                                row_num = int(num_match.group(2)) if num_match else 0
+                                if row_num >= insert_at_row:
+                                    if written is None:
+                                        written = _write_generated_rows(sheet_out, rows, insert_at_row, style_ids, row_height)
+                                    row_xml = _shift_existing_row(row_xml, insert_at_row, amount)
+                                row_xml = _shift_formulas_in_fragment(row_xml, insert_at_row, amount)
+                                if "!" in row_xml:
+                                    row_xml = _shift_sheet_references_in_formulas(row_xml, sheet_pattern, insert_at_row, amount)
+                                sheet_out.write(row_xml.encode("utf-8"))
+                            if written is None:
+                                written = _write_generated_rows(sheet_out, rows, insert_at_row, style_ids, row_height)
+                            sheet_out.write(tail.encode("utf-8"))
+                        if written != amount:
+                            raise ValueError(f"rows yielded {written} row(s) but row_count was {amount}.")
+                        continue
+
+                    if info.filename == CALC_CHAIN_PART:
+                        continue
+                    data = zin.read(info.filename)
+                    if has_calc_chain and info.filename in ("[Content_Types].xml", "xl/_rels/workbook.xml.rels"):
+                        data = _drop_calc_chain_references(info.filename, data)
+                    if info.filename == "xl/workbook.xml" and b"<definedName" in data:
+                        data = DEFINED_NAME_PATTERN.sub(
+                            lambda m: f"{m.group(1)}{shift_sheet_references(m.group(2), sheet_pattern, insert_at_row, amount)}{m.group(3)}",
+                            data.decode("utf-8")
+                        ).encode("utf-8")
+                    elif info.filename in worksheet_parts and b"!" in data:
+                        data = _shift_sheet_references_in_formulas(data.decode("utf-8"), sheet_pattern, insert_at_row, amount).encode("utf-8")
+                    zout.writestr(info, data, compress_type=info.compress_type)
+            os.replace(staging, output_path)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+    print(f"--- Splice complete: '{output_path}' ---")
+    return amount
+
+
+def _write_generated_rows(sheet_out, rows: Iterable[Dict[int, Any]], insert_at_row: int,
+                          style_ids: Dict[int, int], row_height: Optional[float]) -> int:
+    """Streams the generated rows into the open sheet part, one <row> at a time. Returns the number written."""
+    written = 0
+    for offset, row_values in enumerate(rows):
+        sheet_out.write(build_row_xml(insert_at_row + offset, row_values, style_ids, row_height).encode("utf-8"))
+        written += 1
+    return written
+
+
+# ==============================================================================
+# EXAMPLE USAGE (for demonstration purposes)
+# ==============================================================================
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Splice a processed table from a JSON data file into a template sheet.")
+    parser.add_argument("template", help="Path to the template .xlsx file.")
+    parser.add_argument("data", help="Path to the JSON data file containing 'processed_tables_data'.")
+    parser.add_argument("-s", "--sheet", default="Packing list", help="Sheet to receive the rows.")
+    parser.add_argument("-r", "--row", type=int, default=21, help="Row where the data rows are inserted.")
+    parser.add_argument("-k", "--columns", nargs="+", default=["po", "item", "pcs", "sqft", "net", "gross", "cbm"],
+                        help="Data keys to write, in column order starting from column A.")
+    parser.add_argument("-o", "--output", default="result_splice.xlsx", help="Output .xlsx path.")
+    args = parser.parse_args()
+
+    with open(args.data, "r", encoding="utf-8") as f:
+        tables = json.load(f).get("processed_tables_data", {})
+
+    def demo_rows() -> Iterable[Dict[int, Any]]:
+        for table in tables.values():
+            num_rows = max((len(v) for v in table.values() if isinstance(v, list)), default=0)
+            for i in range(num_rows):
+                yield {
+                    col_idx: (table.get(key) or [None] * num_rows)[i] if i < len(table.get(key) or []) else None
+                    for col_idx, key in enumerate(args.columns, start=1)
+                }
+
+    # Count first, then stream: the generated rows are never held in memory together
+    total_rows = sum(max((len(v) for v in table.values() if isinstance(v, list)), default=0) for table in tables.values())
+    splice_rows_into_template(args.template, args.output, args.sheet, args.row, demo_rows(), row_count=total_rows)
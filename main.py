@@ -8,7 +8,6 @@ from typing import List, Optional
 import shutil
 import tkinter as tk
 from tkinter import filedialog
-import re
 
 # Setup basic logging for the wrapper script
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -146,13 +145,6 @@ def main():
     template_dir = project_root / "invoice_gen" / "TEMPLATE"
     config_dir = project_root / "invoice_gen" / "config"
 
-    match = re.match(r'([A-Za-z]+)', identifier)
-    prefix = match.group(1) if match else ''
-
-    if not prefix:
-        logging.error(f"Could not extract alphabetic prefix from filename: {identifier}")
-        sys.exit(1)
-
     # Validate paths
     essential_paths_to_check = {
         "JSON creation script": create_json_script,
@@ -184,12 +176,14 @@ def main():
         sys.exit(1)
     logging.info(f"JSON file successfully created: {expected_json_path}")
 
-    # --- Step 3: Verify Expected Config for invoice_gen ---
-    expected_config_path = config_dir / f"{prefix}_config.json"
-    logging.info(f"Invoice generation step will expect main config file: {expected_config_path}")
-    if not expected_config_path.is_file():
-        logging.error(f"Expected main config file '{expected_config_path}' not found in '{config_dir}'.")
+    # --- Step 3: Verify Expected Template/Config Pair for invoice_gen ---
+    if str(invoice_gen_dir) not in sys.path: sys.path.insert(0, str(invoice_gen_dir))
+    from template_registry_utils import get_registry
+    template_pair = get_registry(template_dir, config_dir).resolve(identifier)
+    if not template_pair:
+        logging.error(f"No template/config pair in '{template_dir}' and '{config_dir}' matches '{identifier}'.")
         sys.exit(1)
+    logging.info(f"Invoice generation step will use template '{template_pair.template.name}' with config '{template_pair.config.name}'.")
 
     # --- Step 4: Run invoice_gen/generate_invoice.py for each mode ---
     active_modes = []
@@ -203,6 +197,7 @@ def main():
     all_successful_invoice_generations = True
     generated_files_info = []
 
+    mode_runs = []
     for mode_name, mode_flags in active_modes:
         logging.info(f"--- Processing {mode_name.upper()} mode for invoice generation ---")
         output_filename = f"CT&INV&PL {identifier} {mode_name.upper()}.xlsx"
@@ -215,7 +210,17 @@ def main():
         ] + mode_flags
 
         logging.info(f"Running Invoice generation (invoice_gen/generate_invoice.py) to create: {output_filename}")
-        if not run_script(invoice_gen_script, args=invoice_gen_args, cwd=invoice_gen_dir, script_name=f"invoice_gen ({mode_name})"):
+        mode_runs.append((mode_name, output_filename, invoice_gen_args))
+
+    # The modes are independent processes, so they render and save concurrently
+    from workbook_save_utils import run_parallel
+    mode_outcomes = run_parallel([
+        lambda mode_name=mode_name, invoice_gen_args=invoice_gen_args: run_script(
+            invoice_gen_script, args=invoice_gen_args, cwd=invoice_gen_dir, script_name=f"invoice_gen ({mode_name})")
+        for mode_name, _, invoice_gen_args in mode_runs
+    ])
+    for (mode_name, output_filename, _), (succeeded, _) in zip(mode_runs, mode_outcomes):
+        if not succeeded:
             logging.error(f"Invoice generation script failed for {mode_name} mode.")
             all_successful_invoice_generations = False
         else:
@@ -5,8 +5,6 @@ from pathlib import Path
 import subprocess
 import openpyxl
 import re
-import io
-import zipfile
 import json
 import datetime
 import sqlite3
@@ -27,6 +25,7 @@ try:
     DATA_DIR = PROJECT_ROOT / "data"
     JSON_OUTPUT_DIR = DATA_DIR / "invoices_to_process"
     TEMP_UPLOAD_DIR = DATA_DIR / "temp_uploads"
+    OUTPUT_CACHE_DIR = DATA_DIR / "output_cache"
     TEMPLATE_DIR = INVOICE_GEN_DIR / "TEMPLATE"
     CONFIG_DIR = INVOICE_GEN_DIR / "config"
     DATA_DIRECTORY = DATA_DIR / 'Invoice Record'
@@ -38,14 +37,27 @@ try:
         dir_path.mkdir(parents=True, exist_ok=True)
 
     # Add script directories to path for imports
+    if str(PROJECT_ROOT) not in sys.path: sys.path.append(str(PROJECT_ROOT))
     if str(CREATE_JSON_DIR) not in sys.path: sys.path.insert(0, str(CREATE_JSON_DIR))
     if str(INVOICE_GEN_DIR) not in sys.path: sys.path.insert(0, str(INVOICE_GEN_DIR))
     from main import run_invoice_automation # For High-Quality Leather
+    import template_index_utils
+    import template_registry_utils
+    from generate_invoice import derive_paths, load_config, load_data
+    from layout_estimate_utils import estimate_layout, format_layout_summary
+    from html_preview_utils import render_invoice_html
+    from output_cache_utils import OutputCache, compute_cache_key
+    import header_patch_utils
+    import workbook_save_utils
+    import db_utils
 except (ImportError, IndexError, NameError) as e:
     st.error(f"Error: Could not configure project paths or import necessary scripts. Please check your project's directory structure. Details: {e}")
     st.exception(e)
     st.stop()
 
+# Generated workbooks keyed by (JSON, template, config, mode flags, generator code)
+OUTPUT_CACHE = OutputCache(OUTPUT_CACHE_DIR)
+
 
 # --- Database Initialization (Consolidated) ---
 def initialize_database(db_file: Path):
@@ -54,15 +66,15 @@ def initialize_database(db_file: Path):
     if they don't already exist. Merged from both original scripts.
     """
     try:
-        with sqlite3.connect(db_file) as conn:
+        with db_utils.get_connection(db_file) as conn:
             cursor = conn.cursor()
             # Main invoices table
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS invoices (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, inv_no TEXT, inv_date TEXT,
-                inv_ref TEXT UNIQUE, po TEXT, item TEXT, description TEXT, pcs TEXT,
-                sqft TEXT, pallet_count TEXT, unit TEXT, amount TEXT, net TEXT,
-                gross TEXT, cbm TEXT, production_order_no TEXT, creating_date TEXT,
+                inv_ref TEXT UNIQUE, po TEXT, item TEXT, description TEXT, pcs INTEGER,
+                sqft REAL, pallet_count INTEGER, unit TEXT, amount REAL, net REAL,
+                gross REAL, cbm REAL, production_order_no TEXT, creating_date TEXT,
                 status TEXT DEFAULT 'active'
             );
             """)
@@ -81,6 +93,8 @@ def initialize_database(db_file: Path):
             # Index for container lookups
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_inv_ref ON invoice_containers (inv_ref);")
             conn.commit()
+            # Brings a new or older database up to date (typed columns, trigger-maintained summary)
+            db_utils.migrate_schema(conn)
         return True
     except sqlite3.Error as e:
         st.error(f"Database Initialization Failed: {e}")
@@ -121,7 +135,7 @@ def get_suggested_inv_ref():
     suggestion = f"{prefix}{current_year}-1"
     if not DB_ENABLED: return suggestion
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db_utils.get_connection(DATABASE_FILE) as conn:
             cursor = conn.cursor()
             query = f"""
                 SELECT inv_ref FROM {TABLE_NAME}
@@ -152,7 +166,7 @@ def check_existing_identifiers(inv_no: str = None, inv_ref: str = None) -> dict:
     results = {}
     if not DB_ENABLED or (not inv_no and not inv_ref): return results
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db_utils.get_connection(DATABASE_FILE) as conn:
             cursor = conn.cursor()
             if inv_no:
                 cursor.execute(f"SELECT 1 FROM {TABLE_NAME} WHERE LOWER(inv_no) = LOWER(?) LIMIT 1", (inv_no,))
@@ -171,6 +185,7 @@ def reset_hq_workflow_state():
     st.session_state['hq_json_path'] = None
     st.session_state['hq_missing_fields'] = []
     st.session_state['hq_identifier'] = None
+    st.session_state['hq_last_outputs'] = {} # mode -> {'patch_key', 'data'} of the last generated workbook
 
 if 'hq_validation_done' not in st.session_state:
     reset_hq_workflow_state()
@@ -187,24 +202,11 @@ with tab1:
 
     # --- Helper Functions Specific to High-Quality Workflow ---
     def find_incoterm_from_template(identifier: str):
-        terms_to_find = ["DAP", "FCA", "CIP"]
         if not identifier: return None
-        match = re.match(r'([A-Za-z]+)', identifier)
-        if not match: return None
-        template_file_path = TEMPLATE_DIR / f"{match.group(1)}.xlsx"
-        if not template_file_path.exists(): return None
-        try:
-            workbook = openpyxl.load_workbook(template_file_path, read_only=True)
-            sheet = workbook.active
-            for row in sheet.iter_rows(min_row=1, max_row=50):
-                for cell in row:
-                    if cell.value and isinstance(cell.value, str):
-                        for term in terms_to_find:
-                            if term in cell.value:
-                                workbook.close(); return term
-            workbook.close()
-        except Exception: pass
-        return None
+        pair = template_registry_utils.get_registry(TEMPLATE_DIR, CONFIG_DIR).resolve(identifier)
+        if not pair: return None
+        # Read from the template's sidecar index (rebuilt automatically if the template changed)
+        return template_index_utils.find_incoterm(pair.template)
 
     def validate_json_data(json_path: Path, required_keys: list) -> list:
         if not json_path.exists():
@@ -221,6 +223,18 @@ with tab1:
         except (json.JSONDecodeError, Exception) as e:
             st.error(f"Validation failed due to invalid JSON: {e}"); return required_keys
 
+    def preview_invoice_layout(json_path: Path, mode_flags: list) -> tuple[dict, dict] | None:
+        # Dry run: plans rows, merges and pages and renders the tables as HTML from the JSON + config, without opening the template
+        generator_paths = derive_paths(str(json_path), str(TEMPLATE_DIR), str(CONFIG_DIR))
+        if not generator_paths: return None
+        config = load_config(generator_paths['config'])
+        invoice_data = load_data(generator_paths['data'])
+        if not config or invoice_data is None: return None
+        template_index = template_index_utils.load_template_index(generator_paths['template'])
+        fob, custom = "--fob" in mode_flags, "--custom" in mode_flags
+        return (estimate_layout(invoice_data, config, fob=fob, custom=custom, template_index=template_index),
+                render_invoice_html(invoice_data, config, fob=fob, custom=custom, template_index=template_index))
+
     # --- UI Step 1: Upload ---
     st.subheader("1. Upload Excel File")
     hq_uploaded_file = st.file_uploader("Choose an XLSX file for High-Quality Leather", type="xlsx", key="hq_uploader", on_change=reset_hq_workflow_state)
@@ -285,6 +299,20 @@ with tab1:
         with c2: gen_fob = st.checkbox("FOB Version", value=True, key="hq_fob")
         with c3: gen_combine = st.checkbox("Combine Version", value=True, key="hq_combine")
 
+        with st.expander("Invoice Preview"):
+            preview_modes = [(label, flags) for label, flags, selected in [("Normal", [], gen_normal), ("FOB", ["--fob"], gen_fob), ("Combine", ["--custom"], gen_combine)] if selected]
+            for preview_label, preview_flags in preview_modes:
+                preview = preview_invoice_layout(Path(st.session_state['hq_json_path']), preview_flags)
+                if not preview:
+                    st.info(f"No preview available for the {preview_label} version (config or data not found)."); continue
+                layout_estimate, sheet_html = preview
+                st.markdown(f"**{preview_label}**")
+                st.code(format_layout_summary(layout_estimate), language=None)
+                if layout_estimate['errors']: st.error("The config has errors; generation will likely fail for this version.")
+                if sheet_html:
+                    for sheet_tab, table_html in zip(st.tabs(list(sheet_html.keys())), sheet_html.values()):
+                        with sheet_tab: st.markdown(f'<div style="overflow-x:auto">{table_html}</div>', unsafe_allow_html=True)
+
         st.subheader("4. Generate Final Invoices")
         if st.button("Generate Final Invoices", use_container_width=True, type="primary", key="hq_generate"):
             if not (gen_normal or gen_fob or gen_combine): st.error("Please select at least one invoice version."); st.stop()
@@ -332,7 +360,11 @@ with tab1:
                 if gen_fob: modes_to_run.append(("fob", ["--fob"]))
                 if gen_combine: modes_to_run.append(("combine", ["--custom"]))
                 
+                generator_paths = derive_paths(str(json_path), str(TEMPLATE_DIR), str(CONFIG_DIR))
+                current_invoice_data = json.loads(files_to_zip[0]["data"])
+                last_outputs = st.session_state.setdefault('hq_last_outputs', {})
                 success_count = 0
+                pending_renders = []
                 with tempfile.TemporaryDirectory() as temp_dir:
                     temp_dir_path = Path(temp_dir)
                     for mode_name, mode_flags in modes_to_run:
@@ -342,28 +374,65 @@ with tab1:
                         
                         output_filename = f"CT&INV&PL {identifier} {final_mode_name}.xlsx"
                         output_path = temp_dir_path / output_filename
-                        command = [sys.executable, str(INVOICE_GEN_DIR / "generate_invoice.py"), str(json_path), "--output", str(output_path), "--templatedir", str(TEMPLATE_DIR), "--configdir", str(CONFIG_DIR)] + mode_flags
-                        
-                        # Set the environment for the subprocess to handle Unicode correctly
-                        sub_env = os.environ.copy()
-                        sub_env['PYTHONIOENCODING'] = 'utf-8'
-                        
-                        try:
-                            # Add the 'env=sub_env' parameter to the call
-                            subprocess.run(command, check=True, capture_output=True, text=True, cwd=INVOICE_GEN_DIR, encoding='utf-8', errors='replace', env=sub_env)
-                            files_to_zip.append({"name": output_filename, "data": output_path.read_bytes()})
-                            success_count += 1
-                        except subprocess.CalledProcessError as e:
-                            st.error(f"Failed to generate '{final_mode_name}' version. Error: {e.stderr}")
-            
+
+                        # Reuse the stored workbook if this exact request was generated before
+                        cache_key = None; patch_key = None
+                        if generator_paths:
+                            cache_key = compute_cache_key(json_path, generator_paths['template'], generator_paths['config'], mode_flags)
+                            patch_key = header_patch_utils.invoice_level_key(current_invoice_data, generator_paths['template'], generator_paths['config'], mode_flags)
+                            cached_output = OUTPUT_CACHE.get(cache_key)
+                            if cached_output is not None:
+                                files_to_zip.append({"name": output_filename, "data": cached_output})
+                                last_outputs[mode_name] = {"patch_key": patch_key, "data": cached_output}
+                                success_count += 1
+                                continue
+
+                        # Only invoice-level fields changed since the last run: patch its header cells instead of re-rendering
+                        previous_output = last_outputs.get(mode_name)
+                        if patch_key and previous_output and previous_output["patch_key"] == patch_key:
+                            previous_path = temp_dir_path / f"previous {output_filename}"
+                            previous_path.write_bytes(previous_output["data"])
+                            if header_patch_utils.patch_header_cells(previous_path, output_path, current_invoice_data):
+                                output_bytes = output_path.read_bytes()
+                                files_to_zip.append({"name": output_filename, "data": output_bytes})
+                                OUTPUT_CACHE.put(cache_key, output_bytes)
+                                last_outputs[mode_name] = {"patch_key": patch_key, "data": output_bytes}
+                                success_count += 1
+                                continue
+
+                        # Needs a full render: queued, and all queued modes run concurrently below
+                        command = [sys.executable, str(INVOICE_GEN_DIR / "generate_invoice.py"), str(json_path), "--output", str(output_path), "--templatedir", str(TEMPLATE_DIR), "--configdir", str(CONFIG_DIR), "--cache-formulas"] + mode_flags
+                        pending_renders.append({"slot": len(files_to_zip), "mode_name": mode_name, "final_mode_name": final_mode_name, "output_filename": output_filename,
+                                                "output_path": output_path, "command": command, "cache_key": cache_key, "patch_key": patch_key})
+                        files_to_zip.append(None) # Keeps the mode order in the ZIP
+
+                    # Set the environment for the subprocess to handle Unicode correctly
+                    sub_env = os.environ.copy()
+                    sub_env['PYTHONIOENCODING'] = 'utf-8'
+
+                    # Normal/FOB/custom are independent generate_invoice.py processes, so they render and save in parallel
+                    render_outcomes = workbook_save_utils.run_parallel([
+                        lambda command=render["command"]: subprocess.run(command, check=True, capture_output=True, text=True, cwd=INVOICE_GEN_DIR, encoding='utf-8', errors='replace', env=sub_env)
+                        for render in pending_renders
+                    ])
+                    for render, (_, render_error) in zip(pending_renders, render_outcomes):
+                        if render_error is not None:
+                            st.error(f"Failed to generate '{render['final_mode_name']}' version. Error: {getattr(render_error, 'stderr', render_error)}")
+                            continue
+                        output_bytes = render["output_path"].read_bytes()
+                        files_to_zip[render["slot"]] = {"name": render["output_filename"], "data": output_bytes}
+                        if render["cache_key"]: OUTPUT_CACHE.put(render["cache_key"], output_bytes)
+                        last_outputs[render["mode_name"]] = {"patch_key": render["patch_key"], "data": output_bytes}
+                        success_count += 1
+                files_to_zip = [file_info for file_info in files_to_zip if file_info]
+
             # Offer download
             if success_count > 0:
                 st.success(f"Successfully created {success_count} invoice file(s)!")
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                    for file_info in files_to_zip: zf.writestr(file_info["name"], file_info["data"])
+                # The .xlsx parts are already deflated, so the bundle stores them as-is
+                zip_bytes = workbook_save_utils.build_bundle(files_to_zip)
                 st.subheader("5. Download Your Files")
-                st.download_button(label=f"📥 Download All Files ({len(files_to_zip)}) as ZIP", data=zip_buffer.getvalue(), file_name=f"Invoices-{identifier}.zip", mime="application/zip", use_container_width=True)
+                st.download_button(label=f"📥 Download All Files ({len(files_to_zip)}) as ZIP", data=zip_bytes, file_name=f"Invoices-{identifier}.zip", mime="application/zip", use_container_width=True)
             else:
                 st.error("Processing finished, but no files were generated. Check errors above.")
 
@@ -487,12 +556,11 @@ with tab2:
                         generated_files = list(Path(temp_output_dir).glob(f"* {summary_data['po_number']}.xlsx"))
                         
                         zip_filename = f"{summary_data['po_number']}.zip"
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            for file_path in generated_files: zipf.write(file_path, arcname=file_path.name)
-                            if final_json_path and final_json_path.exists(): zipf.write(final_json_path, arcname=final_json_path.name)
-                        
-                        st.download_button(label=f"Download All Documents and Data (.zip)", data=zip_buffer.getvalue(), file_name=zip_filename, mime="application/zip", use_container_width=True)
+                        bundle_files = [{"name": file_path.name, "path": file_path} for file_path in generated_files]
+                        if final_json_path and final_json_path.exists(): bundle_files.append({"name": final_json_path.name, "path": final_json_path})
+                        zip_bytes = workbook_save_utils.build_bundle(bundle_files)
+
+                        st.download_button(label=f"Download All Documents and Data (.zip)", data=zip_bytes, file_name=zip_filename, mime="application/zip", use_container_width=True)
                 
                 except subprocess.CalledProcessError as e:
                     st.error("Step 2 FAILED."); st.text_area("Full Error Log:", e.stdout + e.stderr, height=300); st.stop()
@@ -1,13 +1,12 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+import db_utils
+import ingest_utils
+import amendment_utils
 import os
 from pathlib import Path
-from datetime import datetime
 import shutil
-import json
 import time
-from zoneinfo import ZoneInfo
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Add Invoice", layout="wide")
@@ -22,12 +21,7 @@ DB_DIRECTORY = DATA_ROOT / 'Invoice Record'
 DATABASE_FILE = DB_DIRECTORY / 'master_invoice_data.db'
 TABLE_NAME = 'invoices'
 CONTAINER_TABLE_NAME = 'invoice_containers'
-SUMMARY_TABLE_NAME = 'invoice_summary' # Added for summary updates
-FINAL_COLUMNS = [
-    'inv_no', 'inv_date', 'inv_ref', 'po', 'item', 'description', 'pcs',
-    'sqft', 'pallet_count', 'unit', 'amount', 'net', 'gross', 'cbm',
-    'production_order_no', 'creating_date', 'status'
-]
+FINAL_COLUMNS = ingest_utils.FINAL_COLUMNS
 
 # --- Helper Functions ---
 def setup_directories():
@@ -39,7 +33,7 @@ def get_existing_invoice_data(inv_ref, inv_no):
     """Gets all data for a specific invoice based on an EXACT match of inv_ref or inv_no."""
     if not os.path.exists(DATABASE_FILE):
         return None
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         query = f"""
         SELECT i.*,
                (SELECT GROUP_CONCAT(c.container_description, ', ')
@@ -51,57 +45,6 @@ def get_existing_invoice_data(inv_ref, inv_no):
         df = pd.read_sql_query(query, conn, params=(inv_ref, inv_no))
         return df if not df.empty else None
 
-def process_json_file(file_path):
-    """Processes JSON focusing on 'processed_tables_data' and extracts container info."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    processed_tables = data.get('processed_tables_data')
-    if not processed_tables:
-        if 'aggregated_summary' in data:
-            df = pd.DataFrame([data['aggregated_summary']])
-        else:
-            raise ValueError("File does not contain 'processed_tables_data' or 'aggregated_summary'.")
-    else:
-        all_dfs = [pd.DataFrame(table_data) for table_data in processed_tables.values()]
-        df = pd.concat(all_dfs, ignore_index=True)
-
-    df['inv_no'] = df['inv_no'].apply(lambda x: x if isinstance(x, str) and x.strip() and not x.startswith('0') else pd.NA).ffill()
-    df['inv_ref'] = df['inv_ref'].apply(lambda x: str(x).strip() if isinstance(x, str) and x.strip() else pd.NA).ffill()
-    df['inv_date'] = pd.to_datetime(df['inv_date'], errors='coerce').ffill().dt.strftime('%Y-%m-%d')
-    manual_containers = []
-    if 'container_type' in df.columns:
-        container_str = df['container_type'].dropna().astype(str).unique()
-        if len(container_str) > 0:
-            manual_containers = [c.strip() for c in container_str[0].split(',') if c.strip()]
-    # Use Cambodia timezone for creating_date
-    cambodia_tz = ZoneInfo("Asia/Phnom_Penh")
-    df['creating_date'] = datetime.now(cambodia_tz).strftime('%Y-%m-%d %H:%M:%S')
-    df['status'] = 'active'
-    for col in df.columns:
-        df[col] = pd.to_numeric(df[col], errors='ignore')
-    return df.reindex(columns=FINAL_COLUMNS), manual_containers
-
-def update_summary_for_invoice(conn, inv_ref_to_update):
-    """
-    Calculates and saves a summary record for a given invoice reference.
-    This function is the key to keeping the explorer page synchronized.
-    """
-    cursor = conn.cursor()
-    summary_update_query = f"""
-        REPLACE INTO {SUMMARY_TABLE_NAME} (inv_ref, inv_no, inv_date, status, total_sqft, total_amount, total_pcs, total_net, total_gross, total_cbm, creating_date, containers)
-        SELECT
-            i.inv_ref, MAX(i.inv_no), MAX(i.inv_date), MAX(i.status),
-            COALESCE(SUM(CAST(i.sqft AS REAL)), 0), COALESCE(SUM(CAST(i.amount AS REAL)), 0),
-            COALESCE(SUM(CAST(i.pcs AS INTEGER)), 0), COALESCE(SUM(CAST(i.net AS REAL)), 0),
-            COALESCE(SUM(CAST(i.gross AS REAL)), 0), COALESCE(SUM(CAST(i.cbm AS REAL)), 0),
-            MAX(i.creating_date), (SELECT GROUP_CONCAT(c.container_description, ', ') FROM {CONTAINER_TABLE_NAME} c WHERE c.inv_ref = i.inv_ref)
-        FROM {TABLE_NAME} i WHERE i.inv_ref = ? GROUP BY i.inv_ref
-    """
-    cursor.execute(summary_update_query, (inv_ref_to_update,))
-    conn.commit()
-    st.write(f"Updated summary for invoice ref: `{inv_ref_to_update}`")
-
 def display_containers(container_list):
     """Displays a list of containers as colorful, styled tags."""
     if not container_list:
@@ -134,21 +77,11 @@ def handle_amendment(source_file_path, new_df, existing_df, manual_containers):
     if c1.button("✅ Accept Changes", use_container_width=True):
         inv_refs_to_delete = existing_df['inv_ref'].unique().tolist()
         new_inv_ref = new_df['inv_ref'].iloc[0]
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor()
-            st.write(f"Deleting all records for matched Invoice Refs: `{', '.join(inv_refs_to_delete)}`...")
-            for ref in inv_refs_to_delete:
-                cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE inv_ref = ?", (ref,))
-                cursor.execute(f"DELETE FROM {CONTAINER_TABLE_NAME} WHERE inv_ref = ?", (ref,))
-            st.write("Inserting new records...")
-            new_df.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
-            if manual_containers:
-                st.write("Saving container info...")
-                for container in manual_containers:
-                    cursor.execute(f"INSERT INTO {CONTAINER_TABLE_NAME} (inv_ref, container_description) VALUES (?, ?)", (new_inv_ref, container))
-            conn.commit()
-            # --- UPDATE SUMMARY ---
-            update_summary_for_invoice(conn, new_inv_ref)
+        # Only the lines and containers that differ are written; the rest stay untouched
+        result = amendment_utils.apply_amendment(db_utils.get_connection(DATABASE_FILE), inv_refs_to_delete,
+                                                 new_df.to_dict(orient='records'), manual_containers,
+                                                 source=source_file_path.name)
+        st.write(f"Applied amendment to `{new_inv_ref}`: {result.describe()}.")
         os.remove(source_file_path)
         st.success("Amendment approved! Old data replaced, summary updated, and source file deleted.")
         st.rerun()
@@ -169,16 +102,14 @@ def handle_new_invoice(source_file_path, new_df, manual_containers):
 
     c1, c2, _ = st.columns([1, 1, 4])
     if c1.button("✅ Accept", use_container_width=True):
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db_utils.get_connection(DATABASE_FILE) as conn:
             new_df.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
             if manual_containers:
                 cursor = conn.cursor()
                 st.write("Saving container info...")
                 for container in manual_containers:
                     cursor.execute(f"INSERT INTO {CONTAINER_TABLE_NAME} (inv_ref, container_description) VALUES (?, ?)", (new_inv_ref, container))
-            conn.commit()
-            # --- UPDATE SUMMARY ---
-            update_summary_for_invoice(conn, new_inv_ref)
+            conn.commit() # invoice_summary is updated by its triggers in the same transaction
         os.remove(source_file_path)
         st.success(f"Invoice '{new_inv_ref}' added, summary updated, and source file deleted.")
         st.rerun()
@@ -190,16 +121,35 @@ def handle_new_invoice(source_file_path, new_df, manual_containers):
 
 # --- Main Application Logic ---
 setup_directories()
+
+# Result of the last bulk import; kept in session state because the page reruns right after it
+bulk_manifest = st.session_state.pop("bulk_ingest_manifest", None)
+if bulk_manifest is not None:
+    counts = bulk_manifest['counts']
+    st.success(f"Accepted {counts[ingest_utils.ACCEPTED]}, quarantined {counts[ingest_utils.QUARANTINED]}, deferred {counts[ingest_utils.DEFERRED]} for review.")
+    with st.expander("Bulk import details", expanded=True):
+        st.dataframe(pd.DataFrame(bulk_manifest['files']), use_container_width=True)
+
 json_files = sorted(JSON_DIRECTORY.glob('*.json'))
 
 if not json_files:
     st.success("✅ No new invoices to process.")
     st.stop()
 
+# --- Bulk import: every new invoice at once; amendments stay in the queue for review below ---
+if len(json_files) > 1:
+    with st.expander(f"📥 Bulk Import ({len(json_files)} files waiting)"):
+        st.markdown("Imports every pending file that does **not** match an existing invoice. Invalid files are moved to `failed_invoices`; amendments stay in the queue for review below.")
+        if st.button("Import All New Invoices", use_container_width=True, key="bulk_ingest_btn"):
+            with st.spinner("Importing..."):
+                st.session_state.bulk_ingest_manifest = ingest_utils.ingest_pending(DATABASE_FILE, JSON_DIRECTORY, FAILED_DIRECTORY)
+            # The import deleted or moved the files listed above, so start over with the queue as it is now
+            st.rerun()
+
 file_to_process = json_files[0]
 
 try:
-    new_invoice_df, manual_containers = process_json_file(file_to_process)
+    new_invoice_df, manual_containers = ingest_utils.load_invoice_file(file_to_process)
     if new_invoice_df.empty:
         raise ValueError("Processing the file resulted in an empty dataset.")
 
@@ -1,11 +1,12 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
+import db_utils
+import amendment_utils
+import export_utils
 import os
+from pathlib import Path
 from datetime import datetime, timedelta
 import math
-import io
-import csv
 from zoneinfo import ZoneInfo
 
 # --- Page Configuration ---
@@ -29,10 +30,16 @@ if not os.path.exists(DATABASE_FILE):
     st.stop()
 
 # --- HELPER FUNCTIONS ---
-@st.cache_data
-def get_overall_grand_totals():
-    """Calculates and caches the grand totals for all active invoices."""
-    with sqlite3.connect(DATABASE_FILE) as conn:
+# Cached reads are keyed on db_utils.data_version() of the table or invoice they read, so a write only
+# invalidates what it touched: voiding one invoice reloads that invoice and the totals, not every
+# other invoice's line items.
+def _versions(*scopes):
+    with db_utils.get_connection(DATABASE_FILE) as conn:
+        return db_utils.data_version(conn, *scopes)
+
+@st.cache_data(max_entries=8)
+def _load_grand_totals(version):
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         query = f"""
             SELECT
                 COALESCE(SUM(total_sqft), 0), COALESCE(SUM(total_amount), 0),
@@ -43,121 +50,99 @@ def get_overall_grand_totals():
         """
         return conn.execute(query).fetchone()
 
-@st.cache_data
-def find_active_invoices(search_mode, search_term):
-    """Finds only active invoices for legacy support if needed elsewhere."""
-    with sqlite3.connect(DATABASE_FILE) as conn:
+def get_overall_grand_totals():
+    """Calculates and caches the grand totals for all active invoices."""
+    return _load_grand_totals(_versions(SUMMARY_TABLE_NAME))
+
+@st.cache_data(max_entries=64)
+def _load_active_invoices(search_mode, search_term, version):
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         query = f"SELECT DISTINCT inv_no, inv_ref FROM {TABLE_NAME} WHERE LOWER({search_mode}) LIKE LOWER(?) AND status = 'active' ORDER BY inv_no"
         return [{'inv_no': row[0], 'inv_ref': row[1]} for row in conn.cursor().execute(query, (f'%{search_term}%',)).fetchall()]
 
-def get_invoice_line_items(inv_ref):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+def find_active_invoices(search_mode, search_term):
+    """Finds only active invoices for legacy support if needed elsewhere."""
+    return _load_active_invoices(search_mode, search_term, _versions(TABLE_NAME))
+
+@st.cache_data(max_entries=256)
+def _load_line_items(inv_ref, version):
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         return pd.read_sql_query(f"SELECT id, inv_no, inv_date, inv_ref, po, item, description, pcs, sqft, pallet_count, unit, amount, net, gross, cbm, production_order_no, creating_date FROM {TABLE_NAME} WHERE inv_ref = ?", conn, params=(inv_ref,))
 
-def get_invoice_containers(inv_ref):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+def get_invoice_line_items(inv_ref):
+    return _load_line_items(inv_ref, _versions(db_utils.invoice_scope(inv_ref)))
+
+@st.cache_data(max_entries=256)
+def _load_containers(inv_ref, version):
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute(f"SELECT container_description FROM {CONTAINER_TABLE_NAME} WHERE inv_ref = ?", (inv_ref,))
         return [row[0] for row in cursor.fetchall()]
 
+def get_invoice_containers(inv_ref):
+    return _load_containers(inv_ref, _versions(db_utils.invoice_scope(inv_ref)))
+
+def clear_all_caches():
+    """Drops every cached read (the version keys already make them current; this is a manual fallback)."""
+    for loader in (_load_grand_totals, _load_active_invoices, _load_line_items, _load_containers):
+        loader.clear()
+
 def update_invoice_data(original_inv_ref, edited_df, container_list):
     """
-    Updates invoice data, handling inv_ref changes properly.
+    Updates invoice data, handling inv_ref changes properly. Only the edited lines and containers are
+    written (see amendment_utils); untouched rows stay as they are.
     original_inv_ref: The original invoice reference (used to find existing records)
     edited_df: The edited dataframe (may contain new inv_ref values)
     """
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("BEGIN TRANSACTION;")
-        try:
-            # Get the new inv_ref from the edited data (all rows should have the same inv_ref)
-            new_inv_refs = edited_df['inv_ref'].unique()
-            if len(new_inv_refs) != 1:
-                raise ValueError("All rows must have the same invoice reference")
-            new_inv_ref = new_inv_refs[0]
-            
-            # Check if the new inv_ref already exists (and it's not the same as original)
-            if new_inv_ref != original_inv_ref:
-                cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE inv_ref = ? AND inv_ref != ?", (new_inv_ref, original_inv_ref))
-                if cursor.fetchone()[0] > 0:
-                    raise ValueError(f"Invoice reference '{new_inv_ref}' already exists in the database")
-            
-            # Delete old records using original inv_ref
-            cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE inv_ref = ?", (original_inv_ref,))
-            cursor.execute(f"DELETE FROM {CONTAINER_TABLE_NAME} WHERE inv_ref = ?", (original_inv_ref,))
-            cursor.execute(f"DELETE FROM {SUMMARY_TABLE_NAME} WHERE inv_ref = ?", (original_inv_ref,))
-            
-            # Insert new records with potentially new inv_ref
-            df_to_save = edited_df.copy()
-            df_to_save['status'] = 'active'
-            df_to_save.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
-            
-            # Insert container data with new inv_ref
-            if container_list:
-                container_data = [(new_inv_ref, desc) for desc in container_list]
-                cursor.executemany(f"INSERT INTO {CONTAINER_TABLE_NAME} (inv_ref, container_description) VALUES (?, ?)", container_data)
-            
-            # Update summary with new inv_ref
-            summary_update_query = f"""
-                REPLACE INTO {SUMMARY_TABLE_NAME} (inv_ref, inv_no, inv_date, status, total_sqft, total_amount, total_pcs, total_net, total_gross, total_cbm, creating_date, containers)
-                SELECT
-                    i.inv_ref, MAX(i.inv_no), MAX(i.inv_date), MAX(i.status),
-                    COALESCE(SUM(CAST(i.sqft AS REAL)), 0), COALESCE(SUM(CAST(i.amount AS REAL)), 0),
-                    COALESCE(SUM(CAST(i.pcs AS INTEGER)), 0), COALESCE(SUM(CAST(i.net AS REAL)), 0),
-                    COALESCE(SUM(CAST(i.gross AS REAL)), 0), COALESCE(SUM(CAST(i.cbm AS REAL)), 0),
-                    MAX(i.creating_date), (SELECT GROUP_CONCAT(c.container_description, ', ') FROM {CONTAINER_TABLE_NAME} c WHERE c.inv_ref = i.inv_ref)
-                FROM {TABLE_NAME} i WHERE i.inv_ref = ? GROUP BY i.inv_ref """
-            cursor.execute(summary_update_query, (new_inv_ref,))
-            cursor.execute("COMMIT;")
-            # Clear all relevant caches
-            get_overall_grand_totals.clear()
-            find_active_invoices.clear()
-        except Exception as e:
-            cursor.execute("ROLLBACK;")
-            raise e
+    conn = db_utils.get_connection(DATABASE_FILE)
+    # Get the new inv_ref from the edited data (all rows should have the same inv_ref)
+    new_inv_refs = edited_df['inv_ref'].unique()
+    if len(new_inv_refs) != 1:
+        raise ValueError("All rows must have the same invoice reference")
+    new_inv_ref = new_inv_refs[0]
+
+    # Check if the new inv_ref already exists (and it's not the same as original)
+    if new_inv_ref != original_inv_ref:
+        if conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE inv_ref = ? AND inv_ref != ?", (new_inv_ref, original_inv_ref)).fetchone()[0] > 0:
+            raise ValueError(f"Invoice reference '{new_inv_ref}' already exists in the database")
+
+    df_to_save = edited_df.copy()
+    df_to_save['status'] = 'active'
+    db_utils.bind_invoice_numbers(df_to_save) # Edited cells may come back as text
+    # One transaction; invoice_summary follows the line and container changes through its triggers
+    amendment_utils.apply_amendment(conn, [original_inv_ref], df_to_save.to_dict(orient='records'),
+                                    container_list, source="Invoice Explorer")
 
 def void_invoice_action(inv_ref_to_void):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute("BEGIN TRANSACTION;")
         try:
             cursor.execute(f"UPDATE {TABLE_NAME} SET status = 'voided' WHERE inv_ref = ?", (inv_ref_to_void,))
-            cursor.execute(f"UPDATE {SUMMARY_TABLE_NAME} SET status = 'voided' WHERE inv_ref = ?", (inv_ref_to_void,))
             conn.commit()
-            # Clear all relevant caches
-            get_overall_grand_totals.clear()
-            find_active_invoices.clear()
         except Exception as e:
             cursor.execute("ROLLBACK;")
             raise e
 
 def reactivate_invoice_action(inv_ref_to_reactivate):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute("BEGIN TRANSACTION;")
         try:
             cursor.execute(f"UPDATE {TABLE_NAME} SET status = 'active' WHERE inv_ref = ?", (inv_ref_to_reactivate,))
-            cursor.execute(f"UPDATE {SUMMARY_TABLE_NAME} SET status = 'active' WHERE inv_ref = ?", (inv_ref_to_reactivate,))
             conn.commit()
-            # Clear all relevant caches
-            get_overall_grand_totals.clear()
-            find_active_invoices.clear()
         except Exception as e:
             cursor.execute("ROLLBACK;")
             raise e
 
 def permanently_delete_invoice_action(inv_ref_to_delete):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db_utils.get_connection(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute("BEGIN TRANSACTION;")
         try:
             cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE inv_ref = ?", (inv_ref_to_delete,))
             cursor.execute(f"DELETE FROM {CONTAINER_TABLE_NAME} WHERE inv_ref = ?", (inv_ref_to_delete,))
-            cursor.execute(f"DELETE FROM {SUMMARY_TABLE_NAME} WHERE inv_ref = ?", (inv_ref_to_delete,))
             conn.commit()
-            # Clear all relevant caches
-            get_overall_grand_totals.clear()
-            find_active_invoices.clear()
         except Exception as e:
             cursor.execute("ROLLBACK;")
             raise e
@@ -168,6 +153,35 @@ def cancel_edit_action(inv_ref):
     st.session_state.pop(f"editor_data_{inv_ref}", None)
 
 
+SUMMARY_TOTAL_COLUMNS = ('total_sqft', 'total_amount', 'total_pcs', 'total_net', 'total_gross', 'total_cbm')
+
+def fts_prefix_term(column, text):
+    """Builds an FTS5 prefix query for one column, quoting the user's text as a phrase."""
+    return f'{column} : "{text.replace(chr(34), chr(34) * 2)}"*'
+
+def build_summary_search(ref_filter, no_filter, date_range):
+    """
+    Builds the FROM clause, WHERE conditions and parameters for the summary search.
+    Text filters join the FTS index directly, so matches never round-trip through Python.
+    """
+    base_query = f"FROM {SUMMARY_TABLE_NAME} s"
+    conditions, params = [], []
+    if ref_filter or no_filter:
+        fts_query_parts = []
+        if ref_filter: fts_query_parts.append(fts_prefix_term('inv_ref', ref_filter))
+        if no_filter: fts_query_parts.append(fts_prefix_term('inv_no', no_filter))
+        base_query += f" JOIN {FTS_TABLE_NAME} ON {FTS_TABLE_NAME}.rowid = s.rowid"
+        conditions.append(f"{FTS_TABLE_NAME} MATCH ?")
+        params.append(" OR ".join(fts_query_parts))
+    if date_range and len(date_range) == 2:
+        start_date, end_date = date_range
+        start_dt = datetime.combine(start_date, datetime.min.time()).strftime('%Y-%m-%d %H:%M:%S')
+        end_dt = datetime.combine(end_date, datetime.max.time()).strftime('%Y-%m-%d %H:%M:%S')
+        conditions.append("s.creating_date BETWEEN ? AND ?")
+        params.extend([start_dt, end_dt])
+    return base_query, conditions, params
+
+
 # --- Tabs ---
 tab1, tab2 = st.tabs(["Invoice Summary", "Report Generator"])
 
@@ -186,6 +200,7 @@ with tab1:
         for key in ['view_details_ref', 'edit_details_ref', 'void_confirm_ref']:
             if key in st.session_state: del st.session_state[key]
         st.session_state.summary_current_page = 1
+        st.session_state.pop('summary_page_keys', None)
 
     with st.expander("🔍 Filters for Summary View", expanded=True):
         f_col1, f_col2 = st.columns(2)
@@ -201,81 +216,59 @@ with tab1:
         filter_button_col1.button("Reset Summary Filters", on_click=reset_summary_filters_and_page, use_container_width=True, key="reset_summary")
         
         # Add manual cache refresh button
-        def clear_all_caches():
-            get_overall_grand_totals.clear()
-            find_active_invoices.clear()
+        def refresh_caches():
+            clear_all_caches()
             st.success("Cache refreshed! Totals updated.")
         
-        filter_button_col2.button("🔄 Refresh Totals", on_click=clear_all_caches, use_container_width=True, key="refresh_cache", help="Click if totals seem outdated")
+        filter_button_col2.button("🔄 Refresh Totals", on_click=refresh_caches, use_container_width=True, key="refresh_cache", help="Click if totals seem outdated")
 
     # Initialize filtered_totals to None
     filtered_totals = None
 
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            base_query = f"FROM {SUMMARY_TABLE_NAME}"
-            conditions, params = [], []
-
+        with db_utils.get_connection(DATABASE_FILE) as conn:
             ref_filter = st.session_state.get('summary_ref_filter', "").strip()
             no_filter = st.session_state.get('summary_no_filter', "").strip()
-
-            if ref_filter or no_filter:
-                fts_query_parts = []
-                if ref_filter: fts_query_parts.append(f'inv_ref : "{ref_filter}"*')
-                if no_filter: fts_query_parts.append(f'inv_no : "{no_filter}"*')
-                fts_match_query = " OR ".join(fts_query_parts)
-
-                fts_cursor = conn.cursor()
-                fts_cursor.execute(f"SELECT rowid FROM {FTS_TABLE_NAME} WHERE {FTS_TABLE_NAME} MATCH ?", (fts_match_query,))
-                matching_rowids = [row[0] for row in fts_cursor.fetchall()]
-
-                if not matching_rowids:
-                    matching_rowids = [-1]
-
-                placeholders = ','.join('?' for _ in matching_rowids)
-                conditions.append(f"rowid IN ({placeholders})")
-                params.extend(matching_rowids)
-
-            if st.session_state.get('summary_date_range') and len(st.session_state.summary_date_range) == 2:
-                start_date, end_date = st.session_state.summary_date_range
-                start_dt = datetime.combine(start_date, datetime.min.time()).strftime('%Y-%m-%d %H:%M:%S')
-                end_dt = datetime.combine(end_date, datetime.max.time()).strftime('%Y-%m-%d %H:%M:%S')
-                conditions.append("creating_date BETWEEN ? AND ?")
-                params.extend([start_dt, end_dt])
-
+            date_range = st.session_state.get('summary_date_range')
+            base_query, conditions, params = build_summary_search(ref_filter, no_filter, date_range)
             where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-            count_query = f"SELECT COUNT(*) {base_query} {where_clause}"
-            total_items = conn.execute(count_query, params).fetchone()[0]
-
-            # --- NEW: FAST SUMMATION FOR FILTERED RESULTS (ACTIVE ONLY) ---
+            # One pass for the match count and the active-only totals of the filtered results
+            stats_query = f"""
+                SELECT COUNT(*),
+                    {', '.join(f"COALESCE(SUM(CASE WHEN s.status = 'active' THEN s.{c} END), 0)" for c in SUMMARY_TOTAL_COLUMNS)}
+                {base_query} {where_clause}
+            """
+            total_items, *totals = conn.execute(stats_query, params).fetchone()
             if where_clause:
-                # Add status = 'active' condition to filtered totals
-                active_condition = "status = 'active'"
-                if conditions:
-                    where_clause_with_active = f"WHERE {' AND '.join(conditions)} AND {active_condition}"
-                    params_with_active = params
-                else:
-                    where_clause_with_active = f"WHERE {active_condition}"
-                    params_with_active = []
-                
-                sum_query = f"""
-                    SELECT
-                        COALESCE(SUM(total_sqft), 0), COALESCE(SUM(total_amount), 0),
-                        COALESCE(SUM(total_pcs), 0), COALESCE(SUM(total_net), 0),
-                        COALESCE(SUM(total_gross), 0), COALESCE(SUM(total_cbm), 0)
-                    {base_query} {where_clause_with_active}
-                """
-                filtered_totals = conn.execute(sum_query, params_with_active).fetchone()
+                filtered_totals = tuple(totals)
 
             ITEMS_PER_PAGE = 15
             total_pages = math.ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
             if st.session_state.summary_current_page > total_pages: st.session_state.summary_current_page = total_pages
 
-            start_idx = (st.session_state.summary_current_page - 1) * ITEMS_PER_PAGE
-            paginated_query = f"SELECT * {base_query} {where_clause} ORDER BY inv_ref DESC LIMIT ? OFFSET ?"
-            paginated_params = params + [ITEMS_PER_PAGE, start_idx]
+            # Keyset pagination: each page starts after the last inv_ref of the page before it
+            page_keys = st.session_state.get('summary_page_keys')
+            # Any insert, delete or rename in the summary moves the page boundaries, so it resets the keys too
+            filter_signature = (ref_filter, no_filter, str(date_range), db_utils.data_version(conn, SUMMARY_TABLE_NAME))
+            if not page_keys or page_keys['filters'] != filter_signature:
+                page_keys = {'filters': filter_signature, 'after': {1: None}}
+                st.session_state.summary_page_keys = page_keys
+            current_page = st.session_state.summary_current_page
+            if current_page not in page_keys['after']:
+                # Jumped to a page not reached yet: look up its boundary key (index-only, no row data)
+                boundary_query = f"SELECT s.inv_ref {base_query} {where_clause} ORDER BY s.inv_ref DESC LIMIT 1 OFFSET ?"
+                boundary = conn.execute(boundary_query, params + [(current_page - 1) * ITEMS_PER_PAGE - 1]).fetchone()
+                page_keys['after'][current_page] = boundary[0] if boundary else None
+            after_ref = page_keys['after'][current_page]
+
+            page_conditions = conditions + (["s.inv_ref < ?"] if after_ref is not None else [])
+            page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            paginated_query = f"SELECT s.* {base_query} {page_where} ORDER BY s.inv_ref DESC LIMIT ?"
+            paginated_params = params + ([after_ref] if after_ref is not None else []) + [ITEMS_PER_PAGE]
             paginated_df = pd.read_sql_query(paginated_query, conn, params=paginated_params)
+            if not paginated_df.empty:
+                page_keys['after'][current_page + 1] = paginated_df['inv_ref'].iloc[-1]
 
     except Exception as e:
         st.error(f"An error occurred while querying data: {e}")
@@ -312,7 +305,7 @@ with tab1:
                             st.warning("Are you sure? This is reversible.")
                             confirm_c1, confirm_c2 = st.columns(2)
                             if confirm_c1.button("✅ Yes, Confirm Void", key=f"void_confirm_btn_{row.inv_ref}", use_container_width=True, type="primary"):
-                                void_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' has been voided."); del st.session_state.void_confirm_ref; get_overall_grand_totals.clear(); find_active_invoices.clear(); st.rerun()
+                                void_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' has been voided."); del st.session_state.void_confirm_ref; st.rerun()
                             if confirm_c2.button("❌ No, Cancel", key=f"void_cancel_btn_{row.inv_ref}", use_container_width=True):
                                 del st.session_state.void_confirm_ref; st.rerun()
                         else:
@@ -377,9 +370,7 @@ with tab1:
                                     else:
                                         st.success(f"Invoice '{row.inv_ref}' has been updated successfully!")
 
-                                    # Clear caches and session state to reflect changes
-                                    get_overall_grand_totals.clear()
-                                    find_active_invoices.clear()
+                                    # Clear session state to reflect changes (cached reads follow the data version)
                                     cancel_edit_action(row.inv_ref) # Clear edit state
                                     st.rerun() # Rerun to show the updated, non-edit view
 
@@ -393,12 +384,12 @@ with tab1:
                     with manage_col1:
                         st.info("This invoice can be restored to an active state.")
                         if st.button("✅ Restore Invoice", key=f"restore_btn_{row.inv_ref}", use_container_width=True, type="primary"):
-                            reactivate_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' has been restored to active status."); get_overall_grand_totals.clear(); find_active_invoices.clear(); st.rerun()
+                            reactivate_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' has been restored to active status."); st.rerun()
                     with manage_col2:
                         st.error("**DANGER ZONE: Permanent Deletion**")
                         if st.checkbox("I understand this cannot be undone.", key=f"del_check_{row.inv_ref}"):
                             if st.button("❌ DELETE FOREVER", key=f"del_btn_{row.inv_ref}", use_container_width=True):
-                                permanently_delete_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' was permanently deleted."); get_overall_grand_totals.clear(); find_active_invoices.clear(); st.rerun()
+                                permanently_delete_invoice_action(row.inv_ref); st.success(f"Invoice '{row.inv_ref}' was permanently deleted."); st.rerun()
 
         # --- NEW: DISPLAY FILTERED TOTALS ---
         if filtered_totals:
@@ -442,67 +433,63 @@ with tab1:
         st.error(f"Could not calculate grand totals: {e}")
 
 # ==============================================================================
-# TAB 2 (Report Generator - Unchanged)
+# TAB 2 (Report Generator)
 # ==============================================================================
 with tab2:
     st.header("📄 Report Generator")
-    st.warning("This tool is for exporting large datasets directly to a CSV file.", icon="⚙️")
+    st.warning("This tool is for exporting large datasets directly to a CSV or Excel file.", icon="⚙️")
     
-    # --- Step 1: Select Report Mode (Unchanged) ---
+    # --- Step 1: Select Report Mode ---
     st.subheader("1. Select Report Mode")
     export_mode = st.radio("Choose report format:", ('Summarized by Invoice', 'All Individual Rows'), horizontal=True, label_visibility="collapsed")
+    export_source = 'summary' if export_mode == 'Summarized by Invoice' else 'lines'
+    export_format = st.radio("File type:", ('CSV', 'Excel (.xlsx)'), horizontal=True)
+    with db_utils.get_connection(DATABASE_FILE) as conn:
+        source_columns = export_utils.available_columns(conn, export_source)
+    export_columns = st.multiselect("Columns to include:", source_columns, default=source_columns, key=f"export_columns_{export_source}")
 
-    # --- Step 2: Filter by Date (Unchanged) ---
+    # --- Step 2: Filter Data (applied in the query) ---
     st.subheader("2. Filter Data for Report by Creation Date")
     col1, col2 = st.columns(2)
     start_date_filter = col1.date_input("Start Date", value=None, key="export_start_date")
     end_date_filter = col2.date_input("End Date", value=None, key="export_end_date")
+    col3, col4 = st.columns(2)
+    export_status = col3.selectbox("Status:", ('All', 'Active', 'Voided'), key="export_status")
+    export_ref_filter = col4.text_input("Invoice Ref contains:", key="export_ref_filter")
 
-    # --- Step 3: Generate and Download (Optimized) ---
+    # --- Step 3: Generate and Download (streamed to a file on disk) ---
     st.subheader("3. Generate and Download")
     if st.button("Generate Report", use_container_width=True, type="primary"):
         if not start_date_filter or not end_date_filter:
             st.error("Please select both a Start Date and an End Date to generate a report.")
             st.stop() 
+        if not export_columns:
+            st.error("Please select at least one column.")
+            st.stop()
 
-        start_datetime_str = datetime.combine(start_date_filter, datetime.min.time()).strftime('%Y-%m-%d %H:%M:%S')
-        end_datetime_str = datetime.combine(end_date_filter, datetime.max.time()).strftime('%Y-%m-%d %H:%M:%S')
-        params = [start_datetime_str, end_datetime_str]
-        
+        export_result = None
         try:
-            with sqlite3.connect(DATABASE_FILE) as conn:
-                if export_mode == 'Summarized by Invoice':
-                    query = f"SELECT * FROM {SUMMARY_TABLE_NAME} WHERE creating_date BETWEEN ? AND ? ORDER BY creating_date DESC"
-                else:
-                    query = f"SELECT * FROM {TABLE_NAME} WHERE creating_date BETWEEN ? AND ?"
-                
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                
-                column_names = [description[0] for description in cursor.description]
-                
-                first_row = cursor.fetchone()
-                
-                if not first_row:
+            with st.spinner("Writing report..."):
+                export_result = export_utils.export_report(
+                    DATABASE_FILE, export_source, 'csv' if export_format == 'CSV' else 'xlsx', export_columns,
+                    start_date_filter, end_date_filter, None if export_status == 'All' else [export_status.lower()],
+                    export_ref_filter)
+        except Exception as e:
+            st.error(f"Could not generate report. Error: {e}")
+
+        # Served only in the run that wrote it: the download button copies the file into Streamlit's
+        # media store, so rendering it again on every rerun would re-read the whole report each time.
+        if export_result is not None:
+            try:
+                if export_result.rows == 0:
                     st.warning("No data found for the selected criteria.")
                 else:
-                    string_io = io.StringIO()
-                    csv_writer = csv.writer(string_io)
-                    csv_writer.writerow(column_names)
-                    csv_writer.writerow(first_row)
-                    
-                    # Optimized with a larger chunk size for faster processing
-                    while True:
-                        chunk = cursor.fetchmany(10000) # Increased chunk size
-                        if not chunk:
-                            break
-                        csv_writer.writerows(chunk)
-                        
-                    csv_data = string_io.getvalue().encode('utf-8')
-                    file_name_mode = "summarized" if export_mode == 'Summarized by Invoice' else "all_rows"
-                    file_name = f"invoice_report_{file_name_mode}_{start_date_filter}_to_{end_date_filter}.csv"
-                    
-                    st.download_button( "📥 Download Full Report as CSV", csv_data, file_name, 'text/csv', use_container_width=True)
-                        
-        except Exception as e:
-            st.error(f"Could not generate report. Error: {e}")
\ No newline at end of file
+                    st.caption(f"{export_result.rows:,} row(s), {export_result.path.stat().st_size / (1024 * 1024):,.1f} MB. "
+                               "Generate the report again to download another copy.")
+                    with open(export_result.path, 'rb') as report_file:
+                        st.download_button(f"📥 Download Full Report as {Path(export_result.file_name).suffix[1:].upper()}", report_file, export_result.file_name,
+                                           export_result.mime, use_container_width=True)
+            except FileNotFoundError:
+                st.error("The report file was removed before it could be served. Please generate it again.")
+            finally:
+                export_result.path.unlink(missing_ok=True) # Already copied into the download; nothing else reads it
\ No newline at end of file
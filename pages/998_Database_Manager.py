@@ -1,9 +1,7 @@
 import streamlit as st
 import os
-import shutil
-from datetime import datetime
-import sqlite3
-from zoneinfo import ZoneInfo
+import db_utils
+import backup_utils
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Database Admin", layout="wide")
@@ -14,7 +12,7 @@ st.info("Use the tabs below to switch between Backup/Restore and a full Database
 DATA_ROOT = "data"
 DATA_DIRECTORY = os.path.join(DATA_ROOT, 'Invoice Record')
 DATABASE_FILE = os.path.join(DATA_DIRECTORY, 'master_invoice_data.db')
-BACKUP_DIRECTORY = 'backups'
+BACKUP_DIRECTORY = backup_utils.BACKUP_DIRECTORY
 
 # Confirmation phrases and passwords
 RESTORE_CONFIRM_PHRASE = "overwrite my live data"
@@ -24,35 +22,32 @@ NUKE_PASSWORD = "hengh428"  # IMPORTANT: Use st.secrets in a real application
 # --- Helper Functions ---
 
 def create_backup():
-    """Creates a timestamped backup of the live database file."""
+    """Creates a timestamped, verified and compressed online backup of the live database."""
     if not os.path.exists(DATABASE_FILE):
         st.error("Database file not found. Cannot perform backup.")
         return
-    os.makedirs(BACKUP_DIRECTORY, exist_ok=True)
-    # Use Cambodia timezone for backup timestamp
-    cambodia_tz = ZoneInfo("Asia/Phnom_Penh")
-    timestamp = datetime.now(cambodia_tz).strftime('%Y-%m-%d_%H-%M-%S')
-    backup_file_name = f"master_invoice_data_{timestamp}.db"
-    backup_file_path = os.path.join(BACKUP_DIRECTORY, backup_file_name)
+    progress_bar = st.progress(0.0)
     try:
-        shutil.copy2(DATABASE_FILE, backup_file_path)
-        st.success(f"Successfully created backup: **{backup_file_name}**")
+        backup = backup_utils.create_backup(DATABASE_FILE, BACKUP_DIRECTORY,
+                                            progress=lambda done, total: progress_bar.progress(done / total if total else 1.0))
+        pruned = backup_utils.prune_backups(BACKUP_DIRECTORY, DATABASE_FILE)
+        st.success(f"Successfully created backup: **{backup.name}**")
+        if pruned:
+            st.info(f"Retention policy removed {len(pruned)} older backup(s).")
     except Exception as e:
         st.error(f"Failed to create backup. Error: {e}")
+    finally:
+        progress_bar.empty()
 
 def get_existing_backups():
-    """Returns a sorted list of available database backups."""
-    if not os.path.exists(BACKUP_DIRECTORY):
-        return []
-    files = [f for f in os.listdir(BACKUP_DIRECTORY) if f.endswith('.db')]
-    files.sort(key=lambda x: os.path.getmtime(os.path.join(BACKUP_DIRECTORY, x)), reverse=True)
-    return files
+    """Returns the names of the available database backups, newest first."""
+    return [backup.name for backup in backup_utils.list_backups(BACKUP_DIRECTORY, DATABASE_FILE)]
 
 def restore_from_backup(backup_file_name):
-    """Overwrites the live database with a selected backup file."""
-    backup_file_path = os.path.join(BACKUP_DIRECTORY, backup_file_name)
-    os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
-    shutil.copy2(backup_file_path, DATABASE_FILE)
+    """Overwrites the live database with a selected backup file (checked first, swapped in atomically)."""
+    backup_utils.restore_backup(backup_file_name, BACKUP_DIRECTORY, DATABASE_FILE)
+    # The restored data_versions may repeat version numbers already used as cache keys
+    st.cache_data.clear()
 
 def delete_backup_file(backup_file_name):
     """Permanently deletes a backup file."""
@@ -66,7 +61,7 @@ def initialize_empty_database():
     """
     try:
         os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db_utils.get_connection(DATABASE_FILE) as conn:
             cursor = conn.cursor()
 
             # --- Drop all existing objects to ensure a clean slate ---
@@ -80,15 +75,18 @@ def initialize_empty_database():
             cursor.execute("DROP TABLE IF EXISTS invoice_summary;")
             cursor.execute("DROP TABLE IF EXISTS invoice_containers;")
             cursor.execute("DROP TABLE IF EXISTS invoices;")
+            cursor.execute("DROP TABLE IF EXISTS invoice_change_log;")
+            cursor.execute("DROP TABLE IF EXISTS dashboard_daily;")
+            cursor.execute("DROP TABLE IF EXISTS dashboard_invoice_days;")
 
             # --- Create new schema ---
             # Create 'invoices' table
             cursor.execute("""
                 CREATE TABLE invoices (
                     id INTEGER PRIMARY KEY AUTOINCREMENT, inv_no TEXT, inv_date TEXT,
-                    inv_ref TEXT, po TEXT, item TEXT, description TEXT, pcs TEXT,
-                    sqft TEXT, pallet_count TEXT, unit TEXT, amount TEXT, net TEXT,
-                    gross TEXT, cbm TEXT, production_order_no TEXT, creating_date TEXT,
+                    inv_ref TEXT, po TEXT, item TEXT, description TEXT, pcs INTEGER,
+                    sqft REAL, pallet_count INTEGER, unit TEXT, amount REAL, net REAL,
+                    gross REAL, cbm REAL, production_order_no TEXT, creating_date TEXT,
                     status TEXT DEFAULT 'active'
                 );
             """)
@@ -102,60 +100,21 @@ def initialize_empty_database():
                 );
             """)
 
-            # Create 'invoice_summary' table
-            cursor.execute("""
-                CREATE TABLE invoice_summary (
-                    inv_ref TEXT PRIMARY KEY, inv_no TEXT, inv_date TEXT,
-                    status TEXT, total_sqft REAL, total_amount REAL,
-                    total_pcs INTEGER, total_net REAL, total_gross REAL,
-                    total_cbm REAL, creating_date TEXT, containers TEXT
-                );
-            """)
+            # --- Create invoice_summary, its FTS index and the triggers that maintain it ---
+            db_utils.create_summary_schema(conn)
+            db_utils.create_change_log(conn)
+            db_utils.create_rollup_schema(conn)
+            # data_versions is kept, so versions never repeat; dropping the tables fired no triggers
+            db_utils.create_data_version_tracking(conn)
 
-            # Create FTS5 virtual table for searching the summary
-            cursor.execute("""
-                CREATE VIRTUAL TABLE summary_fts USING fts5(
-                    inv_ref, inv_no, containers,
-                    content='invoice_summary',
-                    content_rowid='rowid'
-                );
-            """)
-
-            # --- Create Triggers to keep FTS table synchronized ---
-            cursor.execute("""
-                CREATE TRIGGER summary_ai AFTER INSERT ON invoice_summary BEGIN
-                    INSERT INTO summary_fts(rowid, inv_ref, inv_no, containers)
-                    VALUES (new.rowid, new.inv_ref, new.inv_no, new.containers);
-                END;
-            """)
-            cursor.execute("""
-                CREATE TRIGGER summary_ad AFTER DELETE ON invoice_summary BEGIN
-                    INSERT INTO summary_fts(summary_fts, rowid, inv_ref, inv_no, containers)
-                    VALUES ('delete', old.rowid, old.inv_ref, old.inv_no, old.containers);
-                END;
-            """)
-            cursor.execute("""
-                CREATE TRIGGER summary_au AFTER UPDATE ON invoice_summary BEGIN
-                    INSERT INTO summary_fts(summary_fts, rowid, inv_ref, inv_no, containers)
-                    VALUES ('delete', old.rowid, old.inv_ref, old.inv_no, old.containers);
-                    INSERT INTO summary_fts(rowid, inv_ref, inv_no, containers)
-                    VALUES (new.rowid, new.inv_ref, new.inv_no, new.containers);
-                END;
-            """)
-            
             # --- Create Indexes for performance ---
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_inv_ref ON invoices (inv_ref);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_containers_inv_ref ON invoice_containers (inv_ref);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_summary_inv_ref ON invoice_summary (inv_ref);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_summary_inv_no ON invoice_summary(inv_no);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_summary_creating_date ON invoice_summary(creating_date);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_summary_containers ON invoice_summary(containers);")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_lower_inv_ref ON invoices (LOWER(inv_ref));")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_lower_inv_no ON invoices (LOWER(inv_no));")
 
             # --- Reclaim Unused Space to Shrink File Size ---
             st.info("Reclaiming unused disk space... This may take a moment.")
             cursor.execute("VACUUM;")
+        st.cache_data.clear()
 
         return True, "Database re-initialized and file size reclaimed successfully."
     except Exception as e:
@@ -164,7 +123,11 @@ def initialize_empty_database():
 # --- Callback Functions for UI State ---
 
 def handle_restore_callback(backup_file):
-    restore_from_backup(backup_file)
+    try:
+        restore_from_backup(backup_file)
+    except Exception as e:  # e.g. the database is still open in another app process
+        st.error(f"Restore failed: {e}")
+        return
     st.session_state.confirm_restore = False
     st.session_state.typed_restore = ""
     st.success(f"Successfully restored database from **{backup_file}**.")
@@ -205,7 +168,8 @@ with tab1:
             with st.expander("Restore From This Backup"):
                 st.warning(
                     f"Restoring from **{selected_backup}** will overwrite your live data. "
-                    f"All changes made since this backup was created will be **permanently lost**."
+                    f"All changes made since this backup was created will be **permanently lost**. "
+                    f"Only run it when no other app instance or script has the database open; otherwise it is refused."
                 )
                 st.checkbox("I understand I will lose current data.", key="confirm_restore")
                 st.text_input("Confirm by typing:", key="typed_restore", placeholder=f"Type '{RESTORE_CONFIRM_PHRASE}' to confirm")
@@ -220,6 +184,19 @@ with tab1:
                 is_delete_disabled = (st.session_state.get('typed_delete', '').strip() != DELETE_CONFIRM_PHRASE or not st.session_state.get('confirm_delete', False))
                 st.button("Permanently Delete This Backup", type="primary", on_click=handle_delete_callback, args=(selected_backup,), disabled=is_delete_disabled, use_container_width=True)
 
+    st.divider()
+
+    st.header("Rebuild Invoice Summary")
+    st.markdown("The summary used by the Invoice Explorer and the dashboard rollups are kept up to date automatically. Rebuild them from the invoice lines only if their totals look wrong.")
+    if st.button("🔄 Rebuild Summary Now", use_container_width=True, key="rebuild_summary_btn"):
+        with st.spinner("Rebuilding summary..."):
+            conn = db_utils.get_connection(DATABASE_FILE)
+            rebuilt = db_utils.rebuild_summaries(conn)
+            rolled_up = db_utils.rebuild_rollups(conn)
+        # Rebuilds do not change the invoice data, so its version (the cache key) stays the same
+        st.cache_data.clear()
+        st.success(f"Rebuilt {rebuilt} invoice summary row(s) and {rolled_up} dashboard rollup row(s).")
+
 # --- Tab 2: Database Reset (Danger Zone) ---
 with tab2:
     st.header("Permanent Database Reset")